@@ -1,41 +1,38 @@
-import json
-import re
-import subprocess
+import multiprocessing as mp
 from collections import Counter
 from pathlib import Path
 
 import click
 import numpy as np
 
+from forgery_detection.data.video_metadata import get_video_metadata
+from forgery_detection.data.video_metadata import METADATA_FILE
+
 
 @click.command()
 @click.option("--folder", required=True, type=click.Path(exists=True))
-def calculate_fps(folder):
+@click.option("--n_jobs", default=mp.cpu_count())
+def calculate_fps(folder, n_jobs):
+    """Prints the fps of all videos in folder, see video_metadata."""
     folder = Path(folder)
+    videos = sorted(
+        video
+        for video in folder.iterdir()
+        if video.is_file() and video.name != METADATA_FILE
+    )
+    video_metadata = get_video_metadata(folder, videos, n_jobs=n_jobs)
 
     fps_list = []
-    regex = re.compile(r"\d+\sfps")
-    for video in folder.iterdir():
-        try:
-            subprocess.check_output(
-                f"/home/sebastian/bin/ffmpeg -i {video}",
-                stderr=subprocess.STDOUT,
-                shell=True,
-            )
-        except subprocess.CalledProcessError as e:
-            try:
-                match = regex.findall(str(e.output))[0].split(" ")[0]
-                fps_list.append(float(match))
-            except IndexError:
-                print(f"Didn't find fps for {video.name}")
-    with open("fps.json", "w") as f:
-        json.dump(fps_list, f)
+    for video in videos:
+        fps = video_metadata.get(video)["fps"]
+        if fps > 0:
+            fps_list.append(fps)
+        else:
+            print(f"Didn't find fps for {video.name}")
+    print(Counter(fps_list))
     print(np.histogram(fps_list))
+    print(f"missing videos {len(videos) - len(fps_list)}")
 
 
 if __name__ == "__main__":
-    # calculate_fps()
-    with open("fps.json", "r") as f:
-        fps_list = json.load(f)
-        print(Counter(fps_list))
-        print(f"missing videos {1000-len(fps_list)}")
+    calculate_fps()
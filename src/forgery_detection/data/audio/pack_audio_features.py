@@ -0,0 +1,29 @@
+import logging
+
+import click
+
+from forgery_detection.data.file_lists import SimpleFileList
+
+logger = logging.getLogger(__file__)
+
+
+@click.command()
+@click.option("--audio_file", required=True, type=click.Path(exists=True))
+@click.option("--output_file", required=True, type=click.Path())
+@click.option(
+    "--packed_features",
+    default="packed_features.npy",
+    help="Path of the packed features, relative to the root of the audio file list.",
+)
+def pack_audio_features(audio_file, output_file, packed_features):
+    """Packs all features of a SimpleFileList into one memory-mappable .npy file."""
+    file_list = SimpleFileList.load(audio_file, load_features=False)
+    file_list.pack(packed_features)
+    file_list.save(output_file)
+
+    data_set = SimpleFileList.load(output_file)
+    logger.info(f"packed audio file list: {data_set}")
+
+
+if __name__ == "__main__":
+    pack_audio_features()
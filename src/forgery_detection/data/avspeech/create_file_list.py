@@ -61,6 +61,7 @@ def _create_file_list(
                 sampled_images_idx=sampled_images_idx,
             )
 
+    file_list.build_video_tables()
     file_list.save(output_file)
     logger.info(f"{output_file} created.")
     return file_list
@@ -0,0 +1,367 @@
+import math
+from typing import List
+from typing import Tuple
+from typing import Union
+
+import torch
+import torch.nn.functional as F
+
+from forgery_detection.data.set import NORMALIZE_MEAN
+from forgery_detection.data.set import NORMALIZE_STD
+from forgery_detection.data.utils import crop_and_resize
+
+
+class SequenceBatch:
+    """Frames of a batch of sequences, that are cropped and resized lazily.
+
+    Geometric transforms only change the box that is cut out of each frame and the size
+    it is resized to. The frames are resampled once, when a transform needs the actual
+    pixels. All random parameters are drawn per sequence and repeated for each frame.
+
+    Args:
+        frames: n x h x w x c uint8 frames, as returned by FileListDataset.load_batch
+            with raw_frames, n = b * t. Frames smaller than h x w are zero padded.
+        boxes: n x 4 (x, y, w, h) box of each frame that contains the actual image.
+        sequence_length: t
+
+    """
+
+    def __init__(self, frames: torch.Tensor, boxes: torch.Tensor, sequence_length: int):
+        self.sequence_length = sequence_length
+        self._set_images(frames.permute(0, 3, 1, 2).float().div_(255))
+        self.boxes = boxes.to(self.frames.device, torch.float)
+        # h x w of each frame after resampling
+        self.output_sizes = self.boxes[:, [3, 2]].clone()
+        self._images = None
+
+    def _set_images(self, images: torch.Tensor):
+        self.frames = images
+        self._images = images
+        n, _, h, w = images.shape
+        self.boxes = images.new_tensor([0, 0, w, h]).repeat(n, 1)
+        self.output_sizes = images.new_tensor([h, w]).repeat(n, 1)
+
+    @property
+    def nb_sequences(self) -> int:
+        return len(self.frames) // self.sequence_length
+
+    @property
+    def device(self) -> torch.device:
+        return self.frames.device
+
+    def rand(self, *size) -> torch.Tensor:
+        """Uniform random numbers with one row per sequence, repeated for each frame."""
+        values = torch.rand(self.nb_sequences, *size, device=self.device)
+        return values.repeat_interleave(self.sequence_length, dim=0)
+
+    def uniform(self, low: float, high: float) -> torch.Tensor:
+        return low + (high - low) * self.rand()
+
+    @property
+    def images(self) -> torch.Tensor:
+        """n x c x h x w float images in [0, 1], cropped and resized to output_sizes."""
+        if self._images is None:
+            self._images = self._resample()
+        return self._images
+
+    @images.setter
+    def images(self, images: torch.Tensor):
+        self._set_images(images)
+
+    def crop(self, boxes: torch.Tensor, output_sizes: torch.Tensor):
+        """Crops boxes, given in pixels of the current output, and resizes them.
+
+        Args:
+            boxes: n x 4 (x, y, w, h) relative to the image of size output_sizes
+            output_sizes: n x 2 (h, w) the crops are resized to
+
+        """
+        scale = self.boxes[:, [2, 3]] / self.output_sizes[:, [1, 0]]
+        self.boxes = torch.cat(
+            (self.boxes[:, :2] + boxes[:, :2] * scale, boxes[:, 2:] * scale), dim=1
+        )
+        self.output_sizes = output_sizes
+        self._images = None
+
+    def _resample(self) -> torch.Tensor:
+        sizes = self.output_sizes.round().long()
+        if (sizes != sizes[0]).any():
+            raise ValueError(
+                "Frames of batch have different sizes. Add a transform that resizes "
+                "them to the same size."
+            )
+        h, w = sizes[0].tolist()
+        _, _, frame_h, frame_w = self.frames.shape
+        is_identity = (frame_h, frame_w) == (h, w) and (
+            self.boxes == self.boxes.new_tensor([0, 0, w, h])
+        ).all()
+        if is_identity:
+            return self.frames
+        return crop_and_resize(self.frames, self.boxes, (h, w))
+
+    def to_sequences(self) -> torch.Tensor:
+        """Returns the images as b x t x c x h x w like load_batch does.
+
+        For sequence_length 1 there is no t dimension.
+        """
+        images = self.images
+        if self.sequence_length == 1:
+            return images
+        return images.view(-1, self.sequence_length, *images.shape[1:])
+
+
+class BatchCompose:
+    def __init__(self, transforms: List, sequence_length: int):
+        self.transforms = transforms
+        self.sequence_length = sequence_length
+
+    def __call__(self, frames: torch.Tensor, boxes: torch.Tensor) -> torch.Tensor:
+        batch = SequenceBatch(frames, boxes, self.sequence_length)
+        for transform in self.transforms:
+            transform(batch)
+        return batch.to_sequences()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            + ", ".join(repr(transform) for transform in self.transforms)
+            + ")"
+        )
+
+
+def get_batch_transform(
+    image_transforms: List, tensor_transforms: List, sequence_length: int
+) -> BatchCompose:
+    """Batch version of the transform FileList.get_dataset builds."""
+    return BatchCompose(
+        image_transforms + [BatchNormalize()] + tensor_transforms, sequence_length
+    )
+
+
+class BatchTransform:
+    def __call__(self, batch: SequenceBatch):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.__dict__})"
+
+
+class BatchResize(BatchTransform):
+    """Resizes the smaller edge of each frame to size, like transforms.Resize(size)."""
+
+    def __init__(self, size: int):
+        self.size = size
+
+    def __call__(self, batch: SequenceBatch):
+        h, w = batch.output_sizes.t()
+        # like torchvision, the smaller edge is exactly size and the other one is
+        # int(size * long / short), scaling both by size / short loses pixels
+        short, long = torch.min(h, w).double(), torch.max(h, w).double()
+        long = (self.size * long / short).floor().to(h)
+        size = torch.full_like(h, self.size)
+        output_sizes = torch.stack(
+            (torch.where(h > w, long, size), torch.where(w > h, long, size)), dim=1
+        )
+        batch.crop(
+            torch.stack((torch.zeros_like(h), torch.zeros_like(h), w, h), dim=1),
+            output_sizes,
+        )
+
+
+class BatchCenterCrop(BatchTransform):
+    def __init__(self, size: int):
+        self.size = size
+
+    def __call__(self, batch: SequenceBatch):
+        h, w = batch.output_sizes.t()
+        size = torch.full_like(h, self.size)
+        batch.crop(
+            torch.stack(
+                (((w - size) / 2).round(), ((h - size) / 2).round(), size, size), dim=1
+            ),
+            torch.stack((size, size), dim=1),
+        )
+
+
+class BatchRandomResizedCrop(BatchTransform):
+    """Batch version of transforms.RandomResizedCrop, with one crop per sequence.
+
+    Instead of retrying until a crop fits into the image, the crop is clamped to the
+    image size.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        scale: Tuple[float, float] = (0.08, 1.0),
+        ratio: Tuple[float, float] = (3.0 / 4.0, 4.0 / 3.0),
+    ):
+        self.size = size
+        self.scale = scale
+        self.ratio = ratio
+
+    def __call__(self, batch: SequenceBatch):
+        h, w = batch.output_sizes.t()
+        area = h * w * batch.uniform(*self.scale)
+        ratio = torch.exp(
+            batch.uniform(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        )
+
+        crop_w = torch.min(torch.sqrt(area * ratio), w)
+        crop_h = torch.min(torch.sqrt(area / ratio), h)
+        x = (w - crop_w) * batch.rand()
+        y = (h - crop_h) * batch.rand()
+
+        size = torch.full_like(h, self.size)
+        batch.crop(
+            torch.stack((x, y, crop_w, crop_h), dim=1), torch.stack((size, size), dim=1)
+        )
+
+
+class BatchRandomHorizontalFlip(BatchTransform):
+    def __init__(self, p: float = 0.5):
+        self.p = p
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        flip = (batch.rand() < self.p).view(-1, 1, 1, 1)
+        batch.images = torch.where(flip, images.flip(-1), images)
+
+
+class BatchRandomRotation(BatchTransform):
+    """Rotates by an angle in (-degrees, degrees) with probability p.
+
+    With p < 1 this is the same as transforms.RandomApply([RandomRotation(degrees)], p).
+    Like RandomRotation the area outside of the rotated image is black.
+    """
+
+    def __init__(self, degrees: float, p: float = 1.0):
+        self.degrees = degrees
+        self.p = p
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        angle = batch.uniform(-self.degrees, self.degrees) * math.pi / 180
+        angle = torch.where(batch.rand() < self.p, angle, torch.zeros_like(angle))
+
+        _, _, h, w = images.shape
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        zeros = torch.zeros_like(angle)
+        # affine_grid works on coordinates normalized to [-1, 1] per axis
+        theta = torch.stack(
+            (
+                torch.stack((cos, -sin * h / w, zeros), dim=1),
+                torch.stack((sin * w / h, cos, zeros), dim=1),
+            ),
+            dim=1,
+        )
+        grid = F.affine_grid(theta, images.shape, align_corners=False)
+        batch.images = F.grid_sample(images, grid, align_corners=False)
+
+
+def _grayscale(images: torch.Tensor) -> torch.Tensor:
+    # same weights as PIL uses for converting to "L"
+    weights = images.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+    return (images * weights).sum(dim=1, keepdim=True)
+
+
+class BatchRandomGrayscale(BatchTransform):
+    def __init__(self, p: float = 0.1):
+        self.p = p
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        grayscale = (batch.rand() < self.p).view(-1, 1, 1, 1)
+        batch.images = torch.where(
+            grayscale, _grayscale(images).expand_as(images), images
+        )
+
+
+class BatchColorJitter(BatchTransform):
+    """Batch version of transforms.ColorJitter without hue.
+
+    The adjustments are always applied in the order brightness, contrast, saturation.
+    """
+
+    def __init__(
+        self, brightness: float = 0, contrast: float = 0, saturation: float = 0
+    ):
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+
+    def _factor(self, batch: SequenceBatch, value: float) -> torch.Tensor:
+        return batch.uniform(max(0, 1 - value), 1 + value).view(-1, 1, 1, 1)
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        if self.brightness:
+            images = images * self._factor(batch, self.brightness)
+        if self.contrast:
+            mean = _grayscale(images).mean(dim=(1, 2, 3), keepdim=True)
+            images = torch.lerp(
+                mean.expand_as(images), images, self._factor(batch, self.contrast)
+            )
+        if self.saturation:
+            images = torch.lerp(
+                _grayscale(images).expand_as(images),
+                images,
+                self._factor(batch, self.saturation),
+            )
+        batch.images = images.clamp(0, 1)
+
+
+class BatchRandomErasing(BatchTransform):
+    """Batch version of transforms.RandomErasing with value 0.
+
+    Instead of retrying until the rectangle fits into the image, it is clamped to the
+    image size.
+    """
+
+    def __init__(
+        self,
+        p: float = 0.5,
+        scale: Tuple[float, float] = (0.02, 0.33),
+        ratio: Tuple[float, float] = (0.3, 3.3),
+    ):
+        self.p = p
+        self.scale = scale
+        self.ratio = ratio
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        _, _, h, w = images.shape
+        area = h * w * batch.uniform(*self.scale)
+        ratio = torch.exp(
+            batch.uniform(math.log(self.ratio[0]), math.log(self.ratio[1]))
+        )
+
+        erase_h = torch.sqrt(area * ratio).clamp(max=h)
+        erase_w = torch.sqrt(area / ratio).clamp(max=w)
+        y = ((h - erase_h) * batch.rand()).view(-1, 1)
+        x = ((w - erase_w) * batch.rand()).view(-1, 1)
+
+        rows = torch.arange(h, device=batch.device, dtype=torch.float)
+        cols = torch.arange(w, device=batch.device, dtype=torch.float)
+        inside_rows = (rows >= y.floor()) & (rows < (y + erase_h.view(-1, 1)).floor())
+        inside_cols = (cols >= x.floor()) & (cols < (x + erase_w.view(-1, 1)).floor())
+        erase = inside_rows[:, :, None] & inside_cols[:, None, :]
+        erase &= (batch.rand() < self.p).view(-1, 1, 1)
+
+        batch.images = images.masked_fill(erase[:, None], 0)
+
+
+class BatchNormalize(BatchTransform):
+    def __init__(
+        self,
+        mean: Union[List[float], Tuple[float]] = NORMALIZE_MEAN,
+        std: Union[List[float], Tuple[float]] = NORMALIZE_STD,
+    ):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, batch: SequenceBatch):
+        images = batch.images
+        mean = images.new_tensor(self.mean).view(1, -1, 1, 1)
+        std = images.new_tensor(self.std).view(1, -1, 1, 1)
+        batch.images = (images - mean) / std
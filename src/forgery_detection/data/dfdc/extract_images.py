@@ -5,16 +5,25 @@ from pathlib import Path
 from typing import List
 
 import click
-import face_recognition
 from cv2 import cv2
 from joblib import delayed
 from joblib import Parallel
 from tqdm import tqdm
 
+from forgery_detection.data.face_detection import DETECTORS
+from forgery_detection.data.face_detection import get_detector
+
 logger = logging.getLogger(__file__)
 
 
-def extract_faces_on_10th_frame(video, extracted_images_dir, meta_data):
+def extract_faces_on_10th_frame(
+    video,
+    extracted_images_dir,
+    meta_data,
+    detector="face_recognition",
+    max_size=None,
+    batch_size=32,
+):
     video_file = (
         extracted_images_dir / meta_data["label"] / video.split("/")[-1].split(".")[0]
     ).with_suffix(".json")
@@ -22,8 +31,21 @@ def extract_faces_on_10th_frame(video, extracted_images_dir, meta_data):
         logger.warning(f"{video_file} already preprocessed. Skipping it.")
         return
 
+    face_detector = get_detector(detector, max_size=max_size)
     bounding_boxes = {}
-    # find first face
+    frame_nums, frames = [], []
+
+    def detect_faces():
+        for frame_num, faces in zip(frame_nums, face_detector.detect(frames)):
+            if faces:
+                # (top, right, bottom, left) like face_recognition.face_locations
+                bounding_boxes[f"{frame_num:04d}"] = [
+                    (face.top(), face.right(), face.bottom(), face.left())
+                    for face in faces
+                ]
+        frame_nums.clear()
+        frames.clear()
+
     capture = cv2.VideoCapture(video)
     frame_num = 0
     while capture.isOpened():
@@ -31,23 +53,22 @@ def extract_faces_on_10th_frame(video, extracted_images_dir, meta_data):
         ret = capture.grab()
 
         if not ret:
-            capture.release()
             break
 
         if frame_num % 10 == 0:
             ret, frame = capture.retrieve()
 
             if not ret:
-                capture.release()
                 break
 
-            face_locations = face_recognition.face_locations(frame)
-
-            if face_locations:
-                bounding_boxes[f"{frame_num:04d}"] = face_locations
+            frame_nums.append(frame_num)
+            frames.append(frame)
+            if len(frames) == batch_size:
+                detect_faces()
 
         frame_num += 1
     capture.release()
+    detect_faces()
 
     with open(str(video_file), "w") as f:
         json.dump(bounding_boxes, f)
@@ -56,7 +77,19 @@ def extract_faces_on_10th_frame(video, extracted_images_dir, meta_data):
 @click.command()
 @click.option("--folder_numbers", "-n", multiple=True, required=True, type=int)
 @click.option("--data_dir", type=click.Path(exists=True))
-def extract_images(folder_numbers: List[int], data_dir: click.Path):
+@click.option(
+    "--detector", type=click.Choice(list(DETECTORS)), default="face_recognition"
+)
+@click.option(
+    "--max_size",
+    default=None,
+    type=int,
+    help="Frames are downscaled to this size of their longer side for detection.",
+)
+@click.option("--batch_size", default=32, help="Frames that are detected at once.")
+def extract_images(
+    folder_numbers: List[int], data_dir: click.Path, detector, max_size, batch_size
+):
     root_dir = Path(data_dir)
     with open(root_dir / "all_metadata.json", "r") as f:
         all_meta_data = json.load(f)
@@ -81,7 +114,12 @@ def extract_images(folder_numbers: List[int], data_dir: click.Path):
         Parallel(n_jobs=mp.cpu_count())(
             delayed(
                 lambda _video, _meta_data: extract_faces_on_10th_frame(
-                    _video, extracted_images_dir, _meta_data
+                    _video,
+                    extracted_images_dir,
+                    _meta_data,
+                    detector=detector,
+                    max_size=max_size,
+                    batch_size=batch_size,
                 )
             )(str(root_dir / video), meta_data)
             for video, meta_data in tqdm(
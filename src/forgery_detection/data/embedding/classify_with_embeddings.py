@@ -77,41 +77,17 @@ with torch.no_grad():
 
 #%%
 import numpy as np
-from scipy import signal
-
-vshift = 15
-
-
-def calc_pdist(feat1, feat2, vshift=10):
-    win_size = vshift * 2 + 1
-
-    feat2p = torch.nn.functional.pad(feat2, (0, 0, vshift, vshift))
-
-    dists = []
-
-    for i in range(0, len(feat1)):
-        dists.append(
-            torch.nn.functional.pairwise_distance(
-                feat1[[i], :].repeat(win_size, 1), feat2p[i : i + win_size, :]
-            )
-        )
-
-    return dists
 
+from forgery_detection.lightning.logging.video_metrics import evaluate_sync
 
-dists = calc_pdist(out[0].cpu()[:100], out[1].cpu()[:100], vshift)
-
-mdist = torch.mean(torch.stack(dists, 1), 1)
-
-minval, minidx = torch.min(mdist, 0)
+vshift = 15
 
-offset = vshift - minidx
-conf = torch.median(mdist) - minval
 
-fdist = np.stack([dist[minidx].numpy() for dist in dists])
-# fdist   = numpy.pad(fdist, (3,3), 'constant', constant_values=15)
-fconf = torch.median(mdist).numpy() - fdist
-fconfm = signal.medfilt(fconf, kernel_size=9)
+sync = evaluate_sync(out[0].cpu()[:100], out[1].cpu()[:100], vshift)
+dists, mdist = sync["dists"], sync["mdists"][0]
+offset, conf = sync["offsets"][0], sync["confs"][0]
+minval = mdist[vshift - offset]
+fconfm = sync["framewise_confs"].numpy()
 
 np.set_printoptions(formatter={"float": "{: 0.3f}".format})
 print("Framewise conf: ")
@@ -126,7 +102,7 @@ plt.plot(mdist), plt.show()
 #%%
 import matplotlib.pyplot as plt
 
-plt.imshow(np.array(torch.stack(dists))), plt.show()
+plt.imshow(dists.numpy()), plt.show()
 
 #%% load samples extracted by syncnet pipeline
 root = "/home/sebastian/repos/syncnet_python/output/pytmp/yt_test"
@@ -165,19 +141,11 @@ syncnet_out_vid = torch.cat([x[0] for x in syncnet_out], dim=0)
 syncnet_out_audio = torch.cat([x[1] for x in syncnet_out], dim=0)
 
 #%%
-dists = calc_pdist(syncnet_out_vid, syncnet_out_audio, vshift)
-
-mdist = torch.mean(torch.stack(dists, 1), 1)
-
-minval, minidx = torch.min(mdist, 0)
-
-offset = vshift - minidx
-conf = torch.median(mdist) - minval
-
-fdist = np.stack([dist[minidx].numpy() for dist in dists])
-# fdist   = numpy.pad(fdist, (3,3), 'constant', constant_values=15)
-fconf = torch.median(mdist).numpy() - fdist
-fconfm = signal.medfilt(fconf, kernel_size=9)
+sync = evaluate_sync(syncnet_out_vid, syncnet_out_audio, vshift)
+dists, mdist = sync["dists"], sync["mdists"][0]
+offset, conf = sync["offsets"][0], sync["confs"][0]
+minval = mdist[vshift - offset]
+fconfm = sync["framewise_confs"].numpy()
 
 np.set_printoptions(formatter={"float": "{: 0.3f}".format})
 print("Framewise conf: ")
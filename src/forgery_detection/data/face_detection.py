@@ -0,0 +1,151 @@
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import dlib
+import numpy as np
+
+
+# https://github.com/ondyari/FaceForensics/
+# blob/master/classification/detect_from_video.py
+def get_boundingbox(face, width, height, scale=1.3, minsize=None):
+    x1 = face.left()
+    y1 = face.top()
+    x2 = face.right()
+    y2 = face.bottom()
+    size_bb = int(max(x2 - x1, y2 - y1) * scale)
+    if minsize:
+        if size_bb < minsize:
+            size_bb = minsize
+    center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
+
+    # Check for out of bounds, x-y top left corner
+    x1 = max(int(center_x - size_bb // 2), 0)
+    y1 = max(int(center_y - size_bb // 2), 0)
+    # Check for too big bb size for given x, y
+    size_bb = min(width - x1, size_bb)
+    size_bb = min(height - y1, size_bb)
+
+    return x1, y1, size_bb
+
+
+class FaceDetector:
+    """Detects the faces on batches of BGR frames of the same size.
+
+    If max_size is set, bigger frames are downscaled for the detection, so that their
+    longer side is max_size pixels. The faces are rescaled to the original frames.
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max_size
+
+    def detect(self, frames: List[np.ndarray]) -> List[List[dlib.rectangle]]:
+        """Returns the faces of each frame, the first one is the best."""
+        if len(frames) == 0:
+            return []
+        height, width, _ = frames[0].shape
+        scale = 1.0
+        if self.max_size and max(height, width) > self.max_size:
+            scale = self.max_size / max(height, width)
+            frames = [
+                cv2.resize(
+                    frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                )
+                for frame in frames
+            ]
+        return [
+            [
+                dlib.rectangle(*(int(round(value / scale)) for value in face))
+                for face in faces
+            ]
+            for faces in self._detect(frames)
+        ]
+
+    def _detect(
+        self, frames: List[np.ndarray]
+    ) -> List[List[Tuple[float, float, float, float]]]:
+        """Returns left, top, right and bottom of the faces of each frame."""
+        raise NotImplementedError()
+
+
+class DlibHOGDetector(FaceDetector):
+    def __init__(self, max_size: Optional[int] = None, upsample=1):
+        super().__init__(max_size)
+        self.upsample = upsample
+        self._detector = dlib.get_frontal_face_detector()
+
+    def _detect(self, frames):
+        return [
+            [
+                (face.left(), face.top(), face.right(), face.bottom())
+                for face in self._detector(
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), self.upsample
+                )
+            ]
+            for frame in frames
+        ]
+
+
+class FaceRecognitionDetector(FaceDetector):
+    """face_recognition with its hog or cnn model, only the cnn model uses batches."""
+
+    def __init__(
+        self, max_size: Optional[int] = None, upsample=1, model="hog", batch_size=32
+    ):
+        super().__init__(max_size)
+        # only needed for this detector
+        import face_recognition
+
+        self._face_recognition = face_recognition
+        self.upsample = upsample
+        self.model = model
+        self.batch_size = batch_size
+
+    def _detect(self, frames):
+        frames = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+        if self.model == "cnn":
+            locations = self._face_recognition.batch_face_locations(
+                frames, self.upsample, batch_size=self.batch_size
+            )
+        else:
+            locations = [
+                self._face_recognition.face_locations(
+                    frame, self.upsample, model=self.model
+                )
+                for frame in frames
+            ]
+        return [
+            [(left, top, right, bottom) for top, right, bottom, left in faces]
+            for faces in locations
+        ]
+
+
+class MTCNNDetector(FaceDetector):
+    """The cnn cascade of facenet_pytorch, which runs fine on the cpu."""
+
+    def __init__(self, max_size: Optional[int] = None, min_face_size=20, device="cpu"):
+        super().__init__(max_size)
+        # only needed for this detector
+        from facenet_pytorch import MTCNN
+
+        self._mtcnn = MTCNN(keep_all=True, min_face_size=min_face_size, device=device)
+
+    def _detect(self, frames):
+        boxes, _ = self._mtcnn.detect(
+            np.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames])
+        )
+        return [
+            [] if faces is None else [tuple(face) for face in faces] for faces in boxes
+        ]
+
+
+DETECTORS = {
+    "dlib": DlibHOGDetector,
+    "face_recognition": FaceRecognitionDetector,
+    "mtcnn": MTCNNDetector,
+}
+
+
+def get_detector(name: str, **kwargs) -> FaceDetector:
+    return DETECTORS[name](**kwargs)
@@ -16,20 +16,22 @@ from forgery_detection.data.face_forensics.splits import VAL_NAME
 from forgery_detection.data.file_lists import FileList
 from forgery_detection.data.utils import img_name_to_int
 from forgery_detection.data.utils import select_frames
+from forgery_detection.data.video_metadata import get_video_metadata
 
 logger = logging.getLogger(__file__)
 
 
 def _get_min_sequence_length(source_dir_data_structure):
-    min_length = -1
-
-    for source_sub_dir in source_dir_data_structure.get_subdirs():
-        for video_folder in sorted(source_sub_dir.iterdir()):
-            number_of_frames = len(list(video_folder.glob("*.png")))
-            if min_length == -1 or min_length > number_of_frames:
-                min_length = number_of_frames
-
-    return min_length
+    video_folders = [
+        video_folder
+        for source_sub_dir in source_dir_data_structure.get_subdirs()
+        for video_folder in sorted(source_sub_dir.iterdir())
+    ]
+    # the number of frames is only counted once and cached next to the dataset
+    video_metadata = get_video_metadata(
+        source_dir_data_structure.root_dir, video_folders
+    )
+    return min(map(video_metadata.face_frames, video_folders), default=-1)
 
 
 def _create_file_list(
@@ -95,6 +97,7 @@ def _create_file_list(
                         sampled_images_idx=sampled_images_idx,
                     )
 
+    file_list.build_video_tables()
     file_list.save(output_file)
     logger.info(f"{output_file} created.")
     return file_list
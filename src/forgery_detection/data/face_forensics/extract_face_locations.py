@@ -1,55 +1,40 @@
 import json
+import time
 from pathlib import Path
+from typing import Dict
+from typing import List
 
 import click
 import cv2
-import dlib
+import numpy as np
 from joblib import delayed
 from joblib import Parallel
 from tqdm import tqdm
 
+from forgery_detection.data.face_detection import DETECTORS
+from forgery_detection.data.face_detection import get_boundingbox
+from forgery_detection.data.face_detection import get_detector
 from forgery_detection.data.face_forensics import FaceForensicsDataStructure
+from forgery_detection.data.face_forensics.face_tracking import box_iou
+from forgery_detection.data.face_forensics.face_tracking import DetectThenTrack
 
 
-# https://github.com/ondyari/FaceForensics/
-# blob/master/classification/detect_from_video.py
-def get_boundingbox(face, width, height, scale=1.3, minsize=None):
-    x1 = face.left()
-    y1 = face.top()
-    x2 = face.right()
-    y2 = face.bottom()
-    size_bb = int(max(x2 - x1, y2 - y1) * scale)
-    if minsize:
-        if size_bb < minsize:
-            size_bb = minsize
-    center_x, center_y = (x1 + x2) // 2, (y1 + y2) // 2
-
-    # Check for out of bounds, x-y top left corner
-    x1 = max(int(center_x - size_bb // 2), 0)
-    y1 = max(int(center_y - size_bb // 2), 0)
-    # Check for too big bb size for given x, y
-    size_bb = min(width - x1, size_bb)
-    size_bb = min(height - y1, size_bb)
-
-    return x1, y1, size_bb
-
-
-def _find_face(_img, detector):
-    img = cv2.imread(str(_img))
-    gray_img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    faces = detector(gray_img, 1)
-    try:
-        face = faces[0]
-        height, width, _ = img.shape
-        x, y, size = get_boundingbox(face, width, height, scale=1.3)
-        # cropped_face = img[y : y + size, x : x + size]
-        # cv2.imwrite("cropped_face.png", cropped_face)
-        return _img.name, [x, y, size]
-    except IndexError:
-        return _img.name, []
+def _to_face_location(face, img) -> List[int]:
+    if face is None:
+        return []
+    height, width, _ = img.shape
+    return list(get_boundingbox(face, width, height, scale=1.3))
+
+
+def _read_images(video_folder):
+    # the frames have to be in order for tracking
+    for img in sorted(video_folder.iterdir()):
+        yield img.name, cv2.imread(str(img))
 
 
-def _extract_face_locations_from_video(video_folder, face_dir) -> bool:
+def _extract_face_locations_from_video(
+    video_folder, face_dir, keyframe_interval=10, detector="dlib", max_size=None
+) -> bool:
 
     video_face_dir = face_dir / video_folder.name
     # if the folder already exists just continue
@@ -59,8 +44,14 @@ def _extract_face_locations_from_video(video_folder, face_dir) -> bool:
         return False
 
     # extract all faces and save it
-    detector = dlib.get_frontal_face_detector()
-    faces = dict(_find_face(img, detector) for img in video_folder.iterdir())
+    locate_face = DetectThenTrack(
+        keyframe_interval=keyframe_interval,
+        detector=get_detector(detector, max_size=max_size),
+    )
+    faces = {
+        name: _to_face_location(locate_face(img), img)
+        for name, img in _read_images(video_folder)
+    }
 
     with open(video_face_dir / "faces.json", "w") as fb:
         json.dump(faces, fb)
@@ -68,10 +59,92 @@ def _extract_face_locations_from_video(video_folder, face_dir) -> bool:
     return True
 
 
+def _compare_to_full_detection(
+    video_folder, keyframe_interval, detector="dlib", max_size=None
+) -> Dict:
+    """Compares the face locations with keyframes to detecting faces on each frame.
+
+    The detection on each frame always uses the full resolution frames.
+    """
+    tracked = DetectThenTrack(
+        keyframe_interval=keyframe_interval,
+        detector=get_detector(detector, max_size=max_size),
+    )
+    full = DetectThenTrack(keyframe_interval=1, detector=get_detector(detector))
+    tracked_time = full_time = 0.0
+    ious, nb_disagreements = [], 0
+
+    for _, img in _read_images(video_folder):
+        start = time.perf_counter()
+        face = _to_face_location(tracked(img), img)
+        tracked_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        full_face = _to_face_location(full(img), img)
+        full_time += time.perf_counter() - start
+
+        if face and full_face:
+            ious.append(box_iou(face, full_face))
+        elif face or full_face:
+            nb_disagreements += 1
+
+    return {
+        "frames": tracked.nb_frames,
+        "detections": tracked.nb_detections,
+        "ious": ious,
+        "disagreements": nb_disagreements,
+        "tracked_time": tracked_time,
+        "full_time": full_time,
+    }
+
+
+def _print_iou_report(method: str, results: List[Dict]):
+    def _sum(key):
+        return sum(result[key] for result in results)
+
+    frames = max(_sum("frames"), 1)
+    ious = np.array([iou for result in results for iou in result["ious"]])
+    mean_iou = ious.mean() if len(ious) else float("nan")
+    low_iou = (ious < 0.5).mean() if len(ious) else float("nan")
+    print(
+        f"{method}: {frames} frames, detector on {_sum('detections') / frames:.1%}, "
+        f"mean iou {mean_iou:.3f}, iou<0.5 on {low_iou:.1%}, "
+        f"face found by only one on {_sum('disagreements') / frames:.1%}, "
+        f"speedup {_sum('full_time') / max(_sum('tracked_time'), 1e-9):.1f}x"
+    )
+
+
 @click.command()
 @click.option("--data_dir_root", required=True, type=click.Path(exists=True))
 @click.option("--compression", default="raw")
-def extract_face_locations(data_dir_root, compression):
+@click.option(
+    "--keyframe_interval",
+    default=10,
+    help="The face detector runs on every n-th frame, the face is tracked in "
+    "between. 1 detects faces on each frame.",
+)
+@click.option(
+    "--report_iou",
+    is_flag=True,
+    help="Only report the iou to detecting faces on each frame, nothing is saved.",
+)
+@click.option("--nb_videos", default=10, help="Videos per method for --report_iou.")
+@click.option("--detector", type=click.Choice(list(DETECTORS)), default="dlib")
+@click.option(
+    "--max_size",
+    default=None,
+    type=int,
+    help="Frames are downscaled to this size of their longer side for detection.",
+)
+def extract_face_locations(
+    data_dir_root,
+    compression,
+    keyframe_interval,
+    report_iou,
+    nb_videos,
+    detector,
+    max_size,
+):
     source_dir_data_structure = FaceForensicsDataStructure(
         data_dir_root, compressions=compression, data_types="images"
     )
@@ -79,6 +152,17 @@ def extract_face_locations(data_dir_root, compression):
     methods = tqdm(source_dir_data_structure.get_subdirs(), position=0, leave=False)
     for method in methods:
         methods.set_description(f"Current method: {method.parents[1].name}")
+
+        if report_iou:
+            results = Parallel(n_jobs=12)(
+                delayed(_compare_to_full_detection)(
+                    video_folder, keyframe_interval, detector, max_size
+                )
+                for video_folder in sorted(method.iterdir())[:nb_videos]
+            )
+            _print_iou_report(method.parents[1].name, results)
+            continue
+
         # add a face folder next to images and videos
         face_dir: Path = method.parent / "faces"
         face_dir.mkdir(exist_ok=True)
@@ -87,7 +171,7 @@ def extract_face_locations(data_dir_root, compression):
         Parallel(n_jobs=12)(
             delayed(
                 lambda _video_folder: _extract_face_locations_from_video(
-                    _video_folder, face_dir
+                    _video_folder, face_dir, keyframe_interval, detector, max_size
                 )
             )(video_folder)
             for video_folder in tqdm(sorted(method.iterdir()), position=1, leave=False)
@@ -0,0 +1,237 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Optional
+from typing import Tuple
+
+import click
+import cv2
+import numpy as np
+from joblib import delayed
+from joblib import Parallel
+from tqdm import tqdm
+
+from forgery_detection.data.face_detection import DETECTORS
+from forgery_detection.data.face_detection import get_boundingbox
+from forgery_detection.data.face_detection import get_detector
+from forgery_detection.data.face_forensics import Compression
+from forgery_detection.data.face_forensics import DataType
+from forgery_detection.data.face_forensics import FaceForensicsDataStructure
+from forgery_detection.data.face_forensics.face_tracking import DetectThenTrack
+from forgery_detection.data.video_clips import find_videos
+
+FACES_FILE = "faces.json"
+TRACKED_BB_FILE = "tracked_bb.json"
+# same layout as the shards of packed.pack_video
+PACKED_FILE = "faces.bin"
+
+
+def _is_inside(face, box: Tuple[int, int, int]) -> bool:
+    x, y, size = box
+    return (
+        face.left() >= x
+        and face.top() >= y
+        and face.right() <= x + size
+        and face.bottom() <= y + size
+    )
+
+
+class FaceSequenceTracker:
+    """Keeps the same box for all frames of a sequence, like tracked_bb.json.
+
+    A sequence starts with the box of the first detected face. It ends if the face
+    leaves the box or if no face is detected for more than max_missing_frames frames.
+    The frame that ends a sequence gets no box, so two sequences never touch.
+    """
+
+    def __init__(self, scale=1.3, max_missing_frames=5):
+        self.scale = scale
+        self.max_missing_frames = max_missing_frames
+        self.box = None
+        self._missing = 0
+
+    def update(self, face, width: int, height: int) -> Optional[Tuple[int, int, int]]:
+        if face is None:
+            self._missing += 1
+            if self._missing > self.max_missing_frames:
+                self.box = None
+            return self.box
+
+        self._missing = 0
+        if self.box is not None and not _is_inside(face, self.box):
+            self.box = None
+            return None
+        if self.box is None:
+            self.box = get_boundingbox(face, width, height, scale=self.scale)
+        return self.box
+
+
+def extract_faces_from_video(
+    video: Path,
+    face_dir: Path,
+    packed=False,
+    scale=1.3,
+    max_missing_frames=5,
+    keyframe_interval=10,
+    detector="dlib",
+    max_size=None,
+) -> bool:
+    """Decodes the video once and writes the face crops and face locations.
+
+    The faces are found with DetectThenTrack.
+
+    Writes into face_dir / video name:
+    - faces.json: [x, y, size] of the detected face of each frame, like
+      extract_face_locations
+    - tracked_bb.json: [x, y, w, h] of the crop of each frame or None, see
+      FaceSequenceTracker
+    - the crops as 0000.png, ... or, if packed is set, all crops as RGB uint8 one
+      after the other in faces.bin. Their shapes follow from tracked_bb.json.
+
+    tracked_bb.json is written last and marks the video as done, leftovers of an
+    interrupted run are deleted. Returns False if the video was done already.
+    """
+    video_face_dir = face_dir / video.with_suffix("").name
+    tracked_bb_file = video_face_dir / TRACKED_BB_FILE
+    if tracked_bb_file.exists():
+        return False
+    if video_face_dir.exists():
+        shutil.rmtree(video_face_dir)
+    video_face_dir.mkdir(parents=True)
+
+    locate_face = DetectThenTrack(
+        keyframe_interval=keyframe_interval,
+        detector=get_detector(detector, max_size=max_size),
+    )
+    tracker = FaceSequenceTracker(scale=scale, max_missing_frames=max_missing_frames)
+    faces, tracked_bb = {}, {}
+
+    cap = cv2.VideoCapture(str(video))
+    shard = open(video_face_dir / PACKED_FILE, "wb") if packed else None
+    try:
+        frame_num = 0
+        while cap.isOpened():
+            success, image = cap.read()
+            if not success:
+                break
+            height, width, _ = image.shape
+            name = f"{frame_num:04d}"
+            frame_num += 1
+
+            face = locate_face(image)
+            faces[f"{name}.png"] = (
+                [] if face is None else list(get_boundingbox(face, width, height))
+            )
+
+            box = tracker.update(face, width, height)
+            if box is None:
+                tracked_bb[name] = None
+                continue
+            x, y, size = box
+            tracked_bb[name] = [x, y, size, size]
+            crop = image[y : y + size, x : x + size]
+            if packed:
+                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
+                shard.write(np.ascontiguousarray(crop).tobytes())
+            else:
+                cv2.imwrite(str(video_face_dir / f"{name}.png"), crop)
+    finally:
+        cap.release()
+        if shard is not None:
+            shard.close()
+
+    with open(video_face_dir / FACES_FILE, "w") as f:
+        json.dump(faces, f)
+    # rename is atomic, so tracked_bb.json is either complete or missing
+    tmp_file = tracked_bb_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(tracked_bb, f)
+    tmp_file.rename(tracked_bb_file)
+    return True
+
+
+@click.command()
+@click.option("--data_dir_root", required=True, type=click.Path(exists=True))
+@click.option("--compression", default=Compression.c40)
+@click.option(
+    "--source_data_type",
+    type=click.Choice(DataType.__members__.keys()),
+    default=DataType.videos.name,
+)
+@click.option(
+    "--output_root",
+    default=None,
+    help="Root of the face images. Default is data_dir_root.",
+)
+@click.option("--packed", is_flag=True, help="Write the crops into one file per video.")
+@click.option("--max_missing_frames", default=5)
+@click.option(
+    "--keyframe_interval",
+    default=10,
+    help="The face detector runs on every n-th frame, the face is tracked in "
+    "between. 1 detects faces on each frame.",
+)
+@click.option("--detector", type=click.Choice(list(DETECTORS)), default="dlib")
+@click.option(
+    "--max_size",
+    default=None,
+    type=int,
+    help="Frames are downscaled to this size of their longer side for detection.",
+)
+@click.option("--n_jobs", default=12)
+def extract_faces_from_videos(
+    data_dir_root,
+    compression,
+    source_data_type,
+    output_root,
+    packed,
+    max_missing_frames,
+    keyframe_interval,
+    detector,
+    max_size,
+    n_jobs,
+):
+    """Replaces extracting frames, face locations and faces with a single pass.
+
+    Videos that are done already are skipped, so the extraction can be resumed.
+    """
+    videos_data_structure = FaceForensicsDataStructure(
+        data_dir_root, compressions=compression, data_types=DataType[source_data_type]
+    )
+    face_images_data_structure = FaceForensicsDataStructure(
+        output_root or data_dir_root,
+        compressions=compression,
+        data_types=DataType.face_images_tracked,
+    )
+
+    # iterate over all manipulation methods and original videos
+    methods = tqdm(
+        zip(
+            videos_data_structure.get_subdirs(),
+            face_images_data_structure.get_subdirs(),
+        ),
+        position=0,
+        leave=False,
+    )
+    for videos_dir, face_dir in methods:
+        methods.set_description(f"Current method: {videos_dir.parents[1].name}")
+        extracted = Parallel(n_jobs=n_jobs)(
+            delayed(extract_faces_from_video)(
+                video,
+                face_dir,
+                packed=packed,
+                max_missing_frames=max_missing_frames,
+                keyframe_interval=keyframe_interval,
+                detector=detector,
+                max_size=max_size,
+            )
+            for video in tqdm(find_videos(videos_dir), position=1, leave=False)
+        )
+        print(
+            f"{videos_dir.parents[1].name}: extracted {sum(extracted)} videos, "
+            f"{len(extracted) - sum(extracted)} were done already."
+        )
+
+
+if __name__ == "__main__":
+    extract_faces_from_videos()
@@ -0,0 +1,94 @@
+from typing import List
+from typing import Optional
+
+import cv2
+import dlib
+import numpy as np
+
+from forgery_detection.data.face_detection import DlibHOGDetector
+from forgery_detection.data.face_detection import FaceDetector
+
+# frames are compared at this size to find scene changes
+SCENE_CHANGE_SIZE = (32, 32)
+
+
+def box_iou(box: List[int], other: List[int]) -> float:
+    """IoU of two [x, y, size] boxes, as saved in faces.json."""
+    x, y, size = box
+    other_x, other_y, other_size = other
+    width = min(x + size, other_x + other_size) - max(x, other_x)
+    height = min(y + size, other_y + other_size) - max(y, other_y)
+    intersection = max(width, 0) * max(height, 0)
+    return intersection / (size ** 2 + other_size ** 2 - intersection)
+
+
+class DetectThenTrack:
+    """Finds the face of consecutive frames of a video.
+
+    The detector runs on every keyframe_interval-th frame, after a scene change and
+    whenever the confidence of the correlation tracker drops below min_confidence.
+    In between, the face of the last detection is tracked. keyframe_interval 1 runs
+    the detector on each frame. The default detector is DlibHOGDetector.
+    """
+
+    def __init__(
+        self,
+        keyframe_interval=10,
+        min_confidence=7.0,
+        scene_change_threshold=30.0,
+        detector: Optional[FaceDetector] = None,
+    ):
+        self.keyframe_interval = keyframe_interval
+        self.min_confidence = min_confidence
+        self.scene_change_threshold = scene_change_threshold
+        self.detector = detector or DlibHOGDetector()
+        self._tracker = None
+        self._frames_since_detection = 0
+        self._previous_small = None
+        self.nb_frames = 0
+        self.nb_detections = 0
+
+    def _is_scene_change(self, gray: np.ndarray) -> bool:
+        small = cv2.resize(gray, SCENE_CHANGE_SIZE, interpolation=cv2.INTER_AREA)
+        previous_small, self._previous_small = self._previous_small, small
+        if previous_small is None:
+            return False
+        return np.mean(cv2.absdiff(small, previous_small)) > self.scene_change_threshold
+
+    def _track(self, gray: np.ndarray):
+        if self._tracker.update(gray) < self.min_confidence:
+            return None
+        position = self._tracker.get_position()
+        return dlib.rectangle(
+            int(round(position.left())),
+            int(round(position.top())),
+            int(round(position.right())),
+            int(round(position.bottom())),
+        )
+
+    def __call__(self, img: np.ndarray):
+        """Returns the face in the BGR image as dlib.rectangle or None."""
+        self.nb_frames += 1
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        scene_change = self._is_scene_change(gray)
+
+        face = None
+        if (
+            self._tracker is not None
+            and self._frames_since_detection < self.keyframe_interval
+            and not scene_change
+        ):
+            face = self._track(gray)
+            self._frames_since_detection += 1
+        if face is not None:
+            return face
+
+        self.nb_detections += 1
+        self._frames_since_detection = 1
+        faces = self.detector.detect([img])[0]
+        face = faces[0] if faces else None
+        self._tracker = None
+        if face is not None and self.keyframe_interval > 1:
+            self._tracker = dlib.correlation_tracker()
+            self._tracker.start_track(gray, face)
+        return face
@@ -1,21 +1,93 @@
 import json
+import multiprocessing as mp
 import shutil
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
 
 import click
-import cv2
 import numpy as np
+from joblib import delayed
+from joblib import Parallel
 from tqdm import tqdm
 
 from forgery_detection.data.face_forensics import Compression
 from forgery_detection.data.face_forensics import DataType
 from forgery_detection.data.face_forensics import FaceForensicsDataStructure
+from forgery_detection.data.video_metadata import get_video_metadata
+
+
+def bbs_to_array(
+    tracked_bb: Dict[str, Optional[List[int]]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Converts tracked_bb.json to a len x 4 array and a mask of frames with a box."""
+    values = list(tracked_bb.values())
+    valid = np.array([bool(bb) for bb in values], dtype=bool)
+    bbs = np.zeros((len(values), 4), dtype=np.int64)
+    if valid.any():
+        bbs[valid] = [bb for bb in values if bb]
+    return bbs, valid
+
+
+def array_to_bbs(bbs: np.ndarray, valid: np.ndarray) -> Dict[str, Optional[List[int]]]:
+    return {
+        f"{frame:04d}": bb if is_valid else None
+        for frame, (bb, is_valid) in enumerate(zip(bbs.tolist(), valid.tolist()))
+    }
+
+
+def resample_bbs(
+    bbs: np.ndarray, valid: np.ndarray, length: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Maps the boxes of each frame to a video with length frames.
+
+    Each new frame gets the box of the first old frame at or after its relative
+    position. To not have discontinued sequences, i.e. two different boxes next to
+    each other, the first frame of the second box gets no box.
+    """
+    data_points_x = np.linspace(0, 100_000, len(bbs))
+    interpolated_x = np.linspace(0, 100_000, length)
+    resampled_idx = np.searchsorted(data_points_x, interpolated_x)
+    resampled_idx = resampled_idx.clip(max=len(bbs) - 1)
+    bbs, valid = bbs[resampled_idx], valid[resampled_idx]
+
+    changed = np.zeros(length, dtype=bool)
+    changed[1:] = valid[:-1] & valid[1:] & (bbs[1:] != bbs[:-1]).any(axis=1)
+    changed &= resampled_idx != 0
+
+    # a frame after a removed box is not compared to a box anymore, so in a run of
+    # changes every second one is removed
+    frames = np.arange(length)
+    last_unchanged = np.maximum.accumulate(np.where(changed, -1, frames))
+    removed = changed & ((frames - last_unchanged) % 2 == 1)
+    return bbs, valid & ~removed
+
+
+def _resample_video(tracked_bb: Path, resampled_tracked_bb: Path, length: int):
+    resampled_tracked_bb.parent.mkdir(parents=True, exist_ok=True)
+    with open(tracked_bb, "r") as f:
+        tracked_bb_dict = json.load(f)
+
+    # if there is no difference in frame_count, we do not need to do extra stuff
+    if len(tracked_bb_dict) == length:
+        shutil.copy(str(tracked_bb), str(resampled_tracked_bb))
+        return
+
+    bbs, valid = resample_bbs(*bbs_to_array(tracked_bb_dict), length)
+    with open(resampled_tracked_bb, "w") as f:
+        json.dump(array_to_bbs(bbs, valid), f)
 
 
 @click.command()
 @click.option("--resampled_data_dir_root", required=True, type=click.Path(exists=True))
 @click.option("--bb_data_dir_root", required=True, type=click.Path(exists=True))
 @click.option("--compressions", multiple=True, default=Compression.c40)
-def resample_tracked_bbs(resampled_data_dir_root, bb_data_dir_root, compressions):
+@click.option("--n_jobs", default=mp.cpu_count())
+def resample_tracked_bbs(
+    resampled_data_dir_root, bb_data_dir_root, compressions, n_jobs
+):
     tracked_bb_data_structure = FaceForensicsDataStructure(
         bb_data_dir_root,
         compressions=compressions,
@@ -32,6 +104,17 @@ def resample_tracked_bbs(resampled_data_dir_root, bb_data_dir_root, compressions
         data_types=DataType.face_images_tracked,
     )
 
+    # the frame counts are only probed once and cached next to the dataset
+    video_metadata = get_video_metadata(
+        resampled_data_dir_root,
+        [
+            video
+            for resampled_videos in resampled_videos_data_structure.get_subdirs()
+            for video in resampled_videos.iterdir()
+        ],
+        n_jobs=n_jobs,
+    )
+
     for resampled_videos, tracked_bbs, resampled_face_images in zip(
         resampled_videos_data_structure.get_subdirs(),
         tracked_bb_data_structure.get_subdirs(),
@@ -39,61 +122,14 @@ def resample_tracked_bbs(resampled_data_dir_root, bb_data_dir_root, compressions
     ):
         print(f"Current method: {resampled_videos.parents[1].name}")
 
-        for video in tqdm(sorted(resampled_videos.iterdir())):
-
-            tracked_bb = tracked_bbs / video.with_suffix("").name / "tracked_bb.json"
-            resampled_tracked_bb = (
-                resampled_face_images / video.with_suffix("").name / "tracked_bb.json"
+        Parallel(n_jobs=n_jobs)(
+            delayed(_resample_video)(
+                tracked_bbs / video.with_suffix("").name / "tracked_bb.json",
+                resampled_face_images / video.with_suffix("").name / "tracked_bb.json",
+                video_metadata.frame_count(video),
             )
-            resampled_tracked_bb.parent.mkdir(parents=True, exist_ok=True)
-
-            with open(tracked_bb, "r") as f:
-                tracked_bb_dict = json.load(f)
-                cap = cv2.VideoCapture(str(video))
-                property_id = int(cv2.CAP_PROP_FRAME_COUNT)
-                resampled_video_length = int(cv2.VideoCapture.get(cap, property_id))
-
-                tracked_bb_length = len(tracked_bb_dict)
-
-                # if there is no difference in frame_count, we do not need to do extr
-                # stuff
-                if tracked_bb_length == resampled_video_length:
-                    shutil.copy(str(tracked_bb), str(resampled_tracked_bb))
-                else:
-
-                    # this means there is at least one frame without tracking
-                    # information
-                    # in this video
-                    tracked_bb_values = list(tracked_bb_dict.values())
-                    data_points_x = np.linspace(0, 100_000, tracked_bb_length)
-                    interpolated_x = np.linspace(0, 100_000, resampled_video_length)
-                    resampled_idx = []
-                    current_pos = 0
-                    for x in interpolated_x:
-                        while (
-                            x > data_points_x[current_pos]
-                            and current_pos < tracked_bb_length
-                        ):
-                            current_pos += 1
-                        resampled_idx.append(current_pos)
-
-                    # now we have the mappings and have to choose the values
-                    resampled_bbs = {}
-                    for _i, idx in enumerate(resampled_idx):
-                        # make sure that we do not have discontinued sequences
-                        # aka a two sequences after another without a None in between
-                        next_val = tracked_bb_values[idx]
-                        if (
-                            idx != 0
-                            and resampled_bbs[f"{_i-1:04d}"] is not None
-                            and resampled_bbs[f"{_i-1:04d}"] != next_val
-                        ):
-                            resampled_bbs[f"{_i:04d}"] = None
-                        else:
-                            resampled_bbs[f"{_i:04d}"] = next_val
-
-                    with open(resampled_tracked_bb, "w") as f:
-                        json.dump(resampled_bbs, f)
+            for video in tqdm(sorted(resampled_videos.iterdir()))
+        )
 
 
 if __name__ == "__main__":
@@ -1,30 +1,12 @@
 import json
 from pathlib import Path
-from typing import List
 
 import dlib
 import numpy as np
 from cv2 import cv2
 from tqdm import tqdm
 
-
-def calculate_relative_bb(
-    total_width: int, total_height: int, relative_bb_values: List[int]
-):
-    x, y, w, h = relative_bb_values
-
-    size_bb = int(max(w, h) * 1.3)
-    center_x, center_y = x + int(0.5 * w), y + int(0.5 * h)
-
-    # Check for out of bounds, x-y lower left corner
-    x = max(int(center_x - size_bb // 2), 0)
-    y = max(int(center_y - size_bb // 2), 0)
-
-    # Check for too big size for given x, y
-    size_bb = min(total_width - x, size_bb)
-    size_bb = min(total_height - y, size_bb)
-
-    return x, y, size_bb, size_bb
+from forgery_detection.data.utils import calculate_relative_bb
 
 
 def shape_to_np(shape, dtype="int"):
@@ -0,0 +1,18 @@
+import click
+
+from forgery_detection.data.file_lists import FileList
+
+
+@click.command()
+@click.option("--file_list_path", required=True, type=click.Path(exists=True))
+def add_video_tables(file_list_path):
+    """Adds start and length of each video to an existing file list."""
+    f = FileList.load(file_list_path)
+    f.build_video_tables()
+    for split, videos in f.videos.items():
+        print(f"{split}: {len(videos)} videos")
+    f.save(file_list_path)
+
+
+if __name__ == "__main__":
+    add_video_tables()
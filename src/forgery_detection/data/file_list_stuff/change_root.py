@@ -20,7 +20,7 @@ def change_root(file_list_path, new_root):
         == "y"
     )
     if save_filelist:
-        f.save(file_list_path)
+        FileList.change_root(file_list_path, new_root)
         print("Succesfully saved.")
     else:
         print("Aborted.")
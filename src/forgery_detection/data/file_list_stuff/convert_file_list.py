@@ -0,0 +1,26 @@
+import click
+
+from forgery_detection.data.file_lists import FileList
+
+
+@click.command()
+@click.option("--source_file_list", required=True, type=click.Path(exists=True))
+@click.option("--target_file_list", required=True, type=click.Path(exists=False))
+@click.option(
+    "--to_json",
+    is_flag=True,
+    help="Export a binary file list to json. Otherwise a json file list is converted "
+    "to a binary one.",
+)
+def convert_file_list(source_file_list, target_file_list, to_json):
+    """Converts between json file lists and binary ones, which load splits lazily."""
+    f = FileList.load(source_file_list)
+    if to_json:
+        f.save(target_file_list)
+    else:
+        f.save_binary(target_file_list)
+    print(FileList.load(target_file_list))
+
+
+if __name__ == "__main__":
+    convert_file_list()
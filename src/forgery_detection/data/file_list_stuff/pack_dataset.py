@@ -0,0 +1,37 @@
+import multiprocessing as mp
+from pathlib import Path
+
+import click
+
+from forgery_detection.data.face_forensics.splits import TEST_NAME
+from forgery_detection.data.face_forensics.splits import TRAIN_NAME
+from forgery_detection.data.face_forensics.splits import VAL_NAME
+from forgery_detection.data.file_lists import FileList
+from forgery_detection.data.packed import pack_file_list
+from forgery_detection.data.packed import PackedFrames
+
+
+@click.command()
+@click.option("--source_file_list", required=True, type=click.Path(exists=True))
+@click.option("--target_file_list", required=True, type=click.Path(exists=False))
+@click.option("--target_dataset_folder", required=True, type=click.Path(exists=False))
+@click.option("--n_jobs", default=mp.cpu_count())
+def pack_dataset(source_file_list, target_file_list, target_dataset_folder, n_jobs):
+    """Packs all frames of a file list into one shard per video.
+
+    The resulting file list can be used with --frame_loader PACKED.
+    """
+    f = FileList.load(source_file_list)
+    packed_root = Path(target_dataset_folder)
+    packed_root.mkdir(parents=True, exist_ok=False)
+
+    for split in [TRAIN_NAME, VAL_NAME, TEST_NAME]:
+        pack_file_list(f, packed_root, split, n_jobs=n_jobs)
+        print(PackedFrames(packed_root, split))
+
+    f.packed_root = str(packed_root)
+    f.save(target_file_list)
+
+
+if __name__ == "__main__":
+    pack_dataset()
@@ -0,0 +1,25 @@
+import multiprocessing as mp
+
+import click
+
+from forgery_detection.data.file_lists import FileList
+
+
+@click.command()
+@click.option("--file_list_path", required=True, type=click.Path(exists=True))
+@click.option("--crop_boxes_file", required=True, type=click.Path(exists=False))
+@click.option("--n_jobs", default=mp.cpu_count())
+def precompute_crop_boxes(file_list_path, crop_boxes_file, n_jobs):
+    """Stores the face crop box of every sample as int32 array next to the file list.
+
+    Datasets with should_align_faces then look up the boxes instead of calculating
+    them for every sample.
+    """
+    f = FileList.load(file_list_path)
+    f.precompute_crop_boxes(crop_boxes_file, n_jobs=n_jobs)
+    f.save(file_list_path)
+    print(f"Saved crop boxes to {crop_boxes_file}.")
+
+
+if __name__ == "__main__":
+    precompute_crop_boxes()
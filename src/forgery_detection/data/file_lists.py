@@ -1,14 +1,21 @@
 import json
 import logging
+import multiprocessing as mp
 import os
 import pickle
+from collections.abc import MutableMapping
+from collections.abc import Sequence
 from pathlib import Path
 from pprint import pformat
 from shutil import copy2
+from typing import Callable
 from typing import List
 from typing import Optional
 
 import numpy as np
+from joblib import delayed
+from joblib import Parallel
+from PIL import Image
 from torch.utils.data import Dataset
 from torchvision import transforms
 from tqdm import tqdm
@@ -16,30 +23,56 @@ from tqdm import tqdm
 from forgery_detection.data.face_forensics.splits import TEST_NAME
 from forgery_detection.data.face_forensics.splits import TRAIN_NAME
 from forgery_detection.data.face_forensics.splits import VAL_NAME
+from forgery_detection.data.frame_cache import SharedFrameCache
+from forgery_detection.data.packed import group_samples_by_video
+from forgery_detection.data.packed import PackedFrames
 from forgery_detection.data.set import FileListDataset
+from forgery_detection.data.set import get_transform
+from forgery_detection.data.utils import calculate_crop_boxes
 from forgery_detection.lightning.logging.const import AudioMode
+from forgery_detection.lightning.logging.const import FrameLoader
 
 logger = logging.getLogger(__file__)
 
+# name of the file containing everything but the splits in a binary file list
+BINARY_META = "file_list.json"
+# attributes of FileList that contain one entry per split
+SPLIT_ATTRIBUTES = ["samples", "samples_idx", "relative_bbs", "videos"]
+
 
 class SimpleFileList:
     def __init__(self, root: str):
         self.root = root
         self.files = {}
+        self.packed_features = None
+        self.offsets = {}
 
     def save(self, path):
         """Save self.__dict__ as json."""
         with open(path, "w") as f:
-            json.dump(self.__dict__, f)
+            json.dump(
+                {
+                    key: value
+                    for key, value in self.__dict__.items()
+                    if not key.startswith("_")
+                },
+                f,
+            )
 
     @classmethod
-    def load(cls, path):
+    def load(cls, path, load_features=True):
         """Restore instance from json via self.__dict__."""
         with open(path, "r") as f:
             __dict__ = json.load(f)
         file_list = cls.__new__(cls)
         file_list.__dict__.update(__dict__)
-        file_list._load_data_in_memory()
+        if not load_features:
+            return file_list
+        # file lists saved before packing existed don't have this attribute
+        if file_list.__dict__.get("packed_features"):
+            file_list._load_packed_features()
+        else:
+            file_list._load_data_in_memory()
         return file_list
 
     def __call__(self, path, stacked=False):
@@ -47,7 +80,7 @@ class SimpleFileList:
         video_name = "/".join(parts[:-1])
         image_name = parts[-1].split(".")[0]
 
-        corresponding_audio = self.files[video_name]
+        corresponding_audio = self._get_features(video_name)
 
         try:
             if not stacked:
@@ -79,28 +112,73 @@ class SimpleFileList:
             )
             raise
 
+    def _get_features(self, video_name: str) -> np.ndarray:
+        # file lists saved before packing existed don't have this attribute
+        if getattr(self, "packed_features", None):
+            start, length = self.offsets[video_name]
+            return self._features[start : start + length]
+        return self.files[video_name]
+
+    def _load_features(self, path: str) -> np.ndarray:
+        with open(os.path.join(self.root, path), "rb") as f:
+            features = pickle.load(f)  # 13 x [len(video)*4]
+
+        if features.shape[0] == 13:
+            try:
+                features = (
+                    np.transpose(features, (1, 0)).reshape((-1, 4, 13)).astype("float32")
+                )  # len(video) x 4 x 13
+            except ValueError:
+                logger.error(f"skipping {path}, as the shape is off: {features.shape}")
+        return features
+
     def _load_data_in_memory(self):
         total_not_reshaped = 0
         for key, path in self.files.items():
-            with open(os.path.join(self.root, path), "rb") as f:
-                features = pickle.load(f)  # 13 x [len(video)*4]
-
-            if features.shape[0] == 13:
-                try:
-                    features = (
-                        np.transpose(features, (1, 0))
-                        .reshape((-1, 4, 13))
-                        .astype("float32")
-                    )  # len(video) x 4 x 13
-                except ValueError:
-                    logger.error(
-                        f"skipping {path}, as the shape is off: {features.shape}"
-                    )
-            else:
+            features = self._load_features(path)
+            if features.shape[1:] != (4, 13):
                 total_not_reshaped += 1
             self.files[key] = features
         logger.warning(f"not reshaping {total_not_reshaped} items")
 
+    def _load_packed_features(self):
+        # memory-mapping lets all dataloader workers share the same pages
+        self._features = np.load(
+            os.path.join(self.root, self.packed_features), mmap_mode="r"
+        )
+
+    def pack(self, packed_features: str):
+        """Stores features of all videos in one contiguous float32 array.
+
+        Afterwards the features are memory-mapped instead of being kept in memory.
+        Videos whose features can't be reshaped to len(video) x 4 x 13 are removed
+        from self.files.
+
+        Args:
+            packed_features: path of the .npy file, relative to self.root
+        """
+        features = []
+        self.offsets = {}
+        start = 0
+        for key, path in tqdm(list(self.files.items())):
+            video_features = self._load_features(path)
+            if video_features.shape[1:] != (4, 13):
+                logger.error(
+                    f"removing {key}, as the shape is off: {video_features.shape}"
+                )
+                del self.files[key]
+                continue
+            features.append(video_features)
+            self.offsets[key] = [start, len(video_features)]
+            start += len(video_features)
+
+        np.save(
+            os.path.join(self.root, packed_features),
+            np.concatenate(features).astype(np.float32),
+        )
+        self.packed_features = packed_features
+        self._load_packed_features()
+
     def __repr__(self):
         return f"""SimpleFileList:
 
@@ -108,6 +186,191 @@ root={self.root}
 number_of_elements={len(self.files)}"""
 
 
+def _get_image_size(path: Path):
+    # only reads the header of the image
+    with Image.open(path) as image:
+        return image.size
+
+
+class PackedSamples(Sequence):
+    """Read-only list of (path, label) of one split of a binary FileList.
+
+    Each path is split into its folder and its file name. Both are interned in a table,
+    so the samples only need two int32 indices and a label per frame."""
+
+    def __init__(
+        self,
+        folders: np.ndarray,
+        folder_idx: np.ndarray,
+        names: np.ndarray,
+        name_idx: np.ndarray,
+        labels: np.ndarray,
+    ):
+        self.folders = folders
+        self.folder_idx = folder_idx
+        self.names = names
+        self.name_idx = name_idx
+        self.labels = labels
+
+    @classmethod
+    def from_samples(cls, samples: list):
+        if isinstance(samples, PackedSamples):
+            return samples
+        paths = [path for path, _ in samples]
+        folders, folder_idx = np.unique(
+            np.array([path[: path.rfind("/") + 1] for path in paths], dtype=str),
+            return_inverse=True,
+        )
+        names, name_idx = np.unique(
+            np.array([path[path.rfind("/") + 1 :] for path in paths], dtype=str),
+            return_inverse=True,
+        )
+        labels = np.array([label for _, label in samples], dtype=np.int64)
+        # there are file lists with more than 256 classes (i.e. imagenet)
+        label_dtype = np.uint8 if len(labels) == 0 or labels.max() < 256 else np.int32
+        return cls(
+            folders,
+            folder_idx.astype(np.int32),
+            names,
+            name_idx.astype(np.int32),
+            labels.astype(label_dtype),
+        )
+
+    def save(self, directory: Path, split: str):
+        for key, value in self.__dict__.items():
+            _save_array(directory / f"{split}_{key}.npy", value)
+
+    @classmethod
+    def load(cls, directory: Path, split: str):
+        return cls(
+            *(
+                _load_array(directory / f"{split}_{key}.npy")
+                for key in ["folders", "folder_idx", "names", "name_idx", "labels"]
+            )
+        )
+
+    def get_frame_numbers(self) -> np.ndarray:
+        """Like VideoTable.frame_numbers, but only parses each file name once."""
+        numbers = np.array(
+            [int(name.split(".")[0]) for name in self.names], dtype=np.int32
+        )
+        return numbers[self.name_idx]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return (
+            self.folders[self.folder_idx[idx]] + self.names[self.name_idx[idx]],
+            int(self.labels[idx]),
+        )
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def _load_array(path: Path) -> np.ndarray:
+    return np.load(path, mmap_mode="r")
+
+
+def _save_array(path: Path, value: np.ndarray):
+    # the old file could still be memory-mapped, so it is replaced instead of being
+    # overwritten in place
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, value)
+    os.replace(tmp_path, path)
+
+
+class LazySplits(MutableMapping):
+    """Dict of split -> value, that loads the value of a split on first access."""
+
+    def __init__(self, splits: List[str], load_split: Callable):
+        self._splits = list(splits)
+        self._load_split = load_split
+        self._loaded = {}
+        # whether splits were set or deleted since loading
+        self.changed = False
+
+    def __getitem__(self, split):
+        if split not in self._loaded:
+            if split not in self._splits:
+                raise KeyError(split)
+            self._loaded[split] = self._load_split(split)
+        return self._loaded[split]
+
+    def __setitem__(self, split, value):
+        if split not in self._splits:
+            self._splits.append(split)
+        self._loaded[split] = value
+        self.changed = True
+
+    def __delitem__(self, split):
+        self.changed = True
+        self._splits.remove(split)
+        self._loaded.pop(split, None)
+
+    def __iter__(self):
+        return iter(self._splits)
+
+    def __len__(self):
+        return len(self._splits)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, PackedSamples):
+        return [[path, label] for path, label in value]
+    return value
+
+
+class VideoTable:
+    """Start offset into the samples and length of every video of a split.
+
+    Also holds the frame number of every sample, so both can be looked up without
+    touching the file system."""
+
+    def __init__(self, samples: list, videos: List[List[int]]):
+        videos = np.asarray(videos, dtype=np.int64).reshape(-1, 2)
+        self.starts = videos[:, 0]
+        self.lengths = videos[:, 1]
+        self.video_idx = np.repeat(
+            np.arange(len(videos), dtype=np.int32), self.lengths
+        )
+        self._samples = samples
+        self._frame_numbers = None
+
+    @property
+    def frame_numbers(self) -> np.ndarray:
+        # only parsed when needed, not all file lists have numbers as image names
+        if self._frame_numbers is None and isinstance(self._samples, PackedSamples):
+            self._frame_numbers = self._samples.get_frame_numbers()
+        elif self._frame_numbers is None:
+            self._frame_numbers = np.array(
+                [
+                    int(path.rsplit("/", 1)[-1].split(".")[0])
+                    for path, _ in self._samples
+                ],
+                dtype=np.int32,
+            )
+        return self._frame_numbers
+
+    @staticmethod
+    def calculate_videos(samples: list) -> List[List[int]]:
+        """Returns [start, length] of each video, i.e. of each folder in samples."""
+        return [
+            [sample_indices[0], len(sample_indices)]
+            for _, sample_indices in group_samples_by_video(samples)
+        ]
+
+    def get_frame_number_and_video_length(self, idx):
+        """Works for single indices as well as for arrays of indices."""
+        return self.frame_numbers[idx], self.lengths[self.video_idx[idx]]
+
+    def __len__(self):
+        return len(self.starts)
+
+
 class FileList:
     def __init__(self, root: str, classes: List[str], min_sequence_length: int):
         self.root = root
@@ -117,8 +380,11 @@ class FileList:
         self.samples = {TRAIN_NAME: [], VAL_NAME: [], TEST_NAME: []}
         self.samples_idx = {TRAIN_NAME: [], VAL_NAME: [], TEST_NAME: []}
         self.relative_bbs = {TRAIN_NAME: [], VAL_NAME: [], TEST_NAME: []}
+        self.videos = {TRAIN_NAME: [], VAL_NAME: [], TEST_NAME: []}
 
         self.min_sequence_length = min_sequence_length
+        self.packed_root = None
+        self.crop_boxes_file = None
 
     def add_data_point(self, path: Path, target_label: str, split: str):
         """Adds datapoint to samples.
@@ -149,19 +415,122 @@ class FileList:
             self.add_data_point(path, target_label, split)
 
     def save(self, path):
-        """Save self.__dict__ as json."""
+        """Save self.__dict__ as json.
+
+        If path is a directory saved by save_binary, it is updated instead. If none of
+        the splits changed since loading, only BINARY_META is rewritten.
+        Binary file lists saved as json are exported completely, i.e. all of their
+        splits are loaded.
+        """
+        if Path(path).is_dir():
+            if self._splits_changed():
+                self.save_binary(path)
+            else:
+                self._save_meta(Path(path), list(self.samples.keys()))
+            return
+
+        __dict__ = {
+            key: {split: _to_json(value) for split, value in value.items()}
+            if key in SPLIT_ATTRIBUTES
+            else value
+            for key, value in self.__dict__.items()
+        }
         with open(path, "w") as f:
-            json.dump(self.__dict__, f)  # be careful with self.root->Path
+            json.dump(__dict__, f)  # be careful with self.root->Path
+
+    def save_binary(self, directory):
+        """Save as folder of .npy files per split, that can be loaded lazily.
+
+        Everything but the splits is saved as json in directory/BINARY_META.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        splits = list(self.samples.keys())
+
+        for split in splits:
+            PackedSamples.from_samples(self.samples[split]).save(directory, split)
+            video_table = self.get_video_table(split)
+            arrays = {
+                "samples_idx": np.asarray(self.samples_idx[split], dtype=np.int32),
+                "relative_bbs": np.asarray(
+                    self.relative_bbs.get(split, []), dtype=np.int32
+                ).reshape(-1, 4),
+                "videos": np.stack((video_table.starts, video_table.lengths), axis=1),
+            }
+            for key, value in arrays.items():
+                _save_array(directory / f"{split}_{key}.npy", value)
+
+        self._save_meta(directory, splits)
+
+    def _splits_changed(self) -> bool:
+        return not all(
+            isinstance(self.__dict__.get(key), LazySplits)
+            and not self.__dict__[key].changed
+            for key in SPLIT_ATTRIBUTES
+        )
+
+    def _save_meta(self, directory: Path, splits: List[str]):
+        meta = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key not in SPLIT_ATTRIBUTES
+        }
+        meta["splits"] = splits
+        with open(directory / BINARY_META, "w") as f:
+            json.dump(meta, f)
 
     @classmethod
     def load(cls, path):
-        """Restore instance from json via self.__dict__."""
+        """Restore instance from json via self.__dict__.
+
+        If path is a directory saved by save_binary, the splits are only loaded (and
+        memory-mapped) once they are accessed.
+        """
+        if Path(path).is_dir():
+            return cls._load_binary(Path(path))
         with open(path, "r") as f:
             __dict__ = json.load(f)
         file_list = cls.__new__(cls)
         file_list.__dict__.update(__dict__)
         return file_list
 
+    @classmethod
+    def _load_binary(cls, directory: Path):
+        with open(directory / BINARY_META, "r") as f:
+            __dict__ = json.load(f)
+        splits = __dict__.pop("splits")
+
+        def load_array(key) -> Callable[[str], np.ndarray]:
+            return lambda split: _load_array(directory / f"{split}_{key}.npy")
+
+        __dict__["samples"] = LazySplits(
+            splits, lambda split: PackedSamples.load(directory, split)
+        )
+        for key in ["samples_idx", "relative_bbs", "videos"]:
+            __dict__[key] = LazySplits(splits, load_array(key))
+
+        file_list = cls.__new__(cls)
+        file_list.__dict__.update(__dict__)
+        return file_list
+
+    @classmethod
+    def change_root(cls, path, new_root: str):
+        """Changes the root of the file list saved at path.
+
+        For binary file lists only BINARY_META is rewritten, the samples stay untouched.
+        """
+        file_list = cls.load(path)
+        file_list.root = str(new_root)
+        file_list.save(path)
+        return file_list
+
+    def get_targets(self, split) -> Sequence:
+        """Returns the label of each sample of split."""
+        samples = self.samples[split]
+        if isinstance(samples, PackedSamples):
+            return samples.labels
+        return [label for _, label in samples]
+
     def copy_to(self, new_root: Path):
         curr_root = Path(self.root)
         for data_points in tqdm(self.samples.values(), position=0):
@@ -173,6 +542,54 @@ class FileList:
         self.root = str(new_root)
         return self
 
+    def build_video_tables(self):
+        """Calculates [start, length] of each video in each split."""
+        self.videos = {
+            split: VideoTable.calculate_videos(samples)
+            for split, samples in self.samples.items()
+        }
+
+    def get_video_table(self, split) -> VideoTable:
+        # file lists saved before video tables existed don't have this attribute and
+        # merged file lists can have outdated ones
+        videos = getattr(self, "videos", {}).get(split, [])
+        nb_frames = np.asarray(videos, dtype=np.int64).reshape(-1, 2)[:, 1].sum()
+        if nb_frames != len(self.samples[split]):
+            logger.info(f"Calculating video table of {split}.")
+            videos = VideoTable.calculate_videos(self.samples[split])
+        return VideoTable(self.samples[split], videos)
+
+    def precompute_crop_boxes(self, crop_boxes_file: str, n_jobs=mp.cpu_count()):
+        """Calculates the crop box of each sample once and saves them as npz.
+
+        The crop boxes are absolute and clamped to the image, so the dataset only has to
+        look them up instead of calling calculate_relative_bb for each sample.
+        The absolute path of crop_boxes_file is stored, so the file list can be loaded
+        from any working directory.
+        """
+        crop_boxes = {}
+        for split, relative_bbs in self.relative_bbs.items():
+            image_sizes = Parallel(n_jobs=n_jobs, batch_size=256)(
+                delayed(_get_image_size)(Path(self.root) / path)
+                for path, _ in tqdm(self.samples[split][: len(relative_bbs)])
+            )
+            crop_boxes[split] = calculate_crop_boxes(image_sizes, relative_bbs)
+
+        crop_boxes_file = os.path.abspath(crop_boxes_file)
+        # np.savez appends .npz otherwise
+        if not crop_boxes_file.endswith(".npz"):
+            crop_boxes_file += ".npz"
+        np.savez(crop_boxes_file, **crop_boxes)
+        self.crop_boxes_file = crop_boxes_file
+
+    def get_crop_boxes(self, split) -> Optional[np.ndarray]:
+        """Returns precomputed n x 4 crop boxes of split or None if there are none."""
+        # file lists saved before crop boxes existed don't have this attribute
+        crop_boxes_file = getattr(self, "crop_boxes_file", None)
+        if crop_boxes_file is None:
+            return None
+        return np.load(crop_boxes_file)[split]
+
     def get_dataset(
         self,
         split,
@@ -182,8 +599,18 @@ class FileList:
         should_align_faces=False,
         audio_file_list: Optional[SimpleFileList] = None,
         audio_mode: AudioMode = AudioMode.EXACT,
+        frame_loader: FrameLoader = FrameLoader.PNG,
+        raw_frames=False,
+        frame_cache_size: int = 0,
     ) -> Dataset:
-        """Get dataset by using this instance."""
+        """Get dataset by using this instance.
+
+        If raw_frames is set, batches loaded with FileListDataset.load_batch are
+        neither resized, augmented nor normalized. This has to be done by
+        batch_transforms.get_batch_transform afterwards.
+        If frame_cache_size (in bytes) is set, decoded frames are cached in a
+        SharedFrameCache of this size, that all dataloader workers use.
+        """
         if sequence_length > self.min_sequence_length:
             logger.warning(
                 f"{sequence_length}>{self.min_sequence_length}. Trying to load data that"
@@ -191,26 +618,63 @@ class FileList:
             )
         image_transforms = image_transforms or []
         tensor_transforms = tensor_transforms or []
-        image_transforms = transforms.Compose(
-            image_transforms
-            + [
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
-                ),
-            ]
-            + tensor_transforms
-        )
+        transform = get_transform(image_transforms, tensor_transforms)
+
+        if frame_loader == FrameLoader.PACKED:
+            # file lists saved before packing existed don't have this attribute
+            packed_root = getattr(self, "packed_root", None)
+            if packed_root is None:
+                raise ValueError(
+                    "Trying to load packed frames, but file list was not packed."
+                )
+            packed_frames = PackedFrames(packed_root, split)
+        else:
+            packed_frames = None
+
+        if frame_cache_size:
+            frame_cache = SharedFrameCache(
+                len(self.samples[split]),
+                frame_cache_size,
+                slot_size=self._get_max_frame_size(split, packed_frames),
+            )
+        else:
+            frame_cache = None
+
         return FileListDataset(
             file_list=self,
             split=split,
             sequence_length=sequence_length,
             should_align_faces=should_align_faces,
-            transform=image_transforms,
+            transform=transform,
             audio_file_list=audio_file_list,
             audio_mode=audio_mode,
+            packed_frames=packed_frames,
+            image_transform=transforms.Compose(image_transforms)
+            if image_transforms
+            else None,
+            tensor_transform=transforms.Compose(tensor_transforms)
+            if tensor_transforms
+            else None,
+            raw_frames=raw_frames,
+            frame_cache=frame_cache,
         )
 
+    def _get_max_frame_size(
+        self, split, packed_frames: Optional[PackedFrames], nb_probes=100
+    ) -> int:
+        """Returns the size in bytes of the biggest decoded rgb frame of split.
+
+        Without packed frames only the headers of nb_probes frames are read.
+        """
+        if packed_frames is not None:
+            return int(packed_frames.sizes.max())
+        samples = self.samples[split]
+        probes = np.linspace(0, len(samples) - 1, min(nb_probes, len(samples)))
+        image_sizes = [
+            _get_image_size(Path(self.root) / samples[int(idx)][0]) for idx in probes
+        ]
+        return max(width * height * 3 for width, height in image_sizes)
+
     @classmethod
     def get_dataset_form_file(
         cls, path, split, transform=None, sequence_length: int = 1
@@ -0,0 +1,139 @@
+import logging
+import multiprocessing as mp
+from typing import Dict
+from typing import Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__file__)
+
+HITS = 0
+MISSES = 1
+
+
+class SharedFrameCache:
+    """Size bounded cache of decoded frames, shared by all dataloader workers.
+
+    The frames are stored in fixed size slots of a shared memory tensor. All
+    bookkeeping is in shared memory as well, therefore the workers, which are forked
+    or spawned after the cache is created, see each others frames. If the cache is
+    full, a slot is freed with the CLOCK algorithm: the hand skips (and clears) slots
+    that were used since it last passed them and evicts the first one that was not.
+
+    Args:
+        nb_samples: number of keys, i.e. the samples of the split
+        size: size of the cache in bytes
+        slot_size: max size of a frame in bytes. Bigger frames are never cached.
+
+    """
+
+    def __init__(self, nb_samples: int, size: int, slot_size: int):
+        self.nb_slots = max(size // slot_size, 1)
+        self.slot_size = slot_size
+
+        self._data = torch.zeros(
+            (self.nb_slots, slot_size), dtype=torch.uint8
+        ).share_memory_()
+        self._shapes = torch.zeros(
+            (self.nb_slots, 3), dtype=torch.int32
+        ).share_memory_()
+        self._slot_keys = torch.full(
+            (self.nb_slots,), -1, dtype=torch.int64
+        ).share_memory_()
+        self._key_slots = torch.full(
+            (nb_samples,), -1, dtype=torch.int32
+        ).share_memory_()
+        self._referenced = torch.zeros(self.nb_slots, dtype=torch.uint8).share_memory_()
+        self._hand = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self._counters = torch.zeros(2, dtype=torch.int64).share_memory_()
+        self._lock = mp.Lock()
+
+        logger.info(
+            f"Frame cache with {self.nb_slots} slots of {slot_size / 2 ** 20:.2f} MB."
+        )
+
+    def get(self, key: int) -> Optional[np.ndarray]:
+        """Returns a copy of the cached frame or None if key is not cached."""
+        # numpy views share the memory of the tensors and are faster to index
+        counters = self._counters.numpy()
+        with self._lock:
+            slot = self._key_slots.numpy()[key]
+            if slot < 0:
+                counters[MISSES] += 1
+                return None
+            counters[HITS] += 1
+            self._referenced.numpy()[slot] = 1
+            shape = self._shapes.numpy()[slot]
+            nb_bytes = int(np.prod(shape))
+            return self._data.numpy()[slot, :nb_bytes].reshape(shape).copy()
+
+    def put(self, key: int, frame: np.ndarray):
+        if frame.nbytes > self.slot_size or frame.ndim != 3:
+            return
+        key_slots = self._key_slots.numpy()
+        with self._lock:
+            if key_slots[key] >= 0:
+                # another worker was faster
+                return
+            slot = self._evict()
+            self._data.numpy()[slot, : frame.nbytes] = np.ascontiguousarray(
+                frame, dtype=np.uint8
+            ).reshape(-1)
+            self._shapes.numpy()[slot] = frame.shape
+            self._slot_keys.numpy()[slot] = key
+            key_slots[key] = slot
+            self._referenced.numpy()[slot] = 1
+
+    def _evict(self) -> int:
+        """Frees a slot with the CLOCK algorithm. Has to be called with the lock held.
+
+        Same as advancing the hand one slot at a time, but vectorised.
+        """
+        referenced = self._referenced.numpy()
+        hand = int(self._hand[0])
+
+        unreferenced = np.flatnonzero(referenced[hand:] == 0)
+        if len(unreferenced):
+            slot = hand + unreferenced[0]
+            referenced[hand:slot] = 0
+        else:
+            referenced[hand:] = 0
+            unreferenced = np.flatnonzero(referenced[:hand] == 0)
+            # if all slots were referenced the hand arrives at its start again
+            slot = unreferenced[0] if len(unreferenced) else hand
+            referenced[:slot] = 0
+
+        old_key = self._slot_keys.numpy()[slot]
+        if old_key >= 0:
+            self._key_slots.numpy()[old_key] = -1
+        self._hand[0] = (slot + 1) % self.nb_slots
+        return int(slot)
+
+    @property
+    def hits(self) -> int:
+        return int(self._counters[HITS])
+
+    @property
+    def misses(self) -> int:
+        return int(self._counters[MISSES])
+
+    def get_log(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def __len__(self):
+        return int((self._slot_keys >= 0).sum())
+
+    def __repr__(self):
+        return f"""SharedFrameCache:
+
+nb_slots={self.nb_slots}
+slot_size={self.slot_size}
+cached_frames={len(self)}
+hits={self.hits}
+misses={self.misses}"""
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import logging
+import queue
 import random
+import threading
+import time
 from typing import Dict
+from typing import Iterator
+from typing import Optional
 from typing import TYPE_CHECKING
 
 import numpy as np
@@ -74,7 +79,19 @@ def get_fixed_dataloader(
     num_workers=6,
     sampler=RandomSampler,
     worker_init_fn=None,
+    batched_loading=False,
+    seed: Optional[int] = None,
+    prefetch_depth=0,
+    device: Optional[torch.device] = None,
 ):
+    """Returns a dataloader that keeps its workers alive between epochs.
+
+    If batched_loading is set, each worker receives the indices of a whole batch and
+    FileListDataset.load_batch assembles the b x t x c x h x w batch in one call.
+    If seed is set, the audio sampling is reproducible for each epoch.
+    If prefetch_depth is set, a background thread keeps up to prefetch_depth batches
+    ready, already moved to device if that is a cuda device. See BatchPrefetcher.
+    """
     # look https://github.com/williamFalcon/pytorch-lightning/issues/434
     batch_sampler = SequenceBatchSampler(
         sampler(dataset),
@@ -83,6 +100,7 @@ def get_fixed_dataloader(
         sequence_length=dataset.sequence_length,
         samples_idx=dataset.samples_idx,
         dataset=dataset,
+        seed=seed,
     )
 
     class _RepeatSampler(torch.utils.data.Sampler):
@@ -107,26 +125,160 @@ def get_fixed_dataloader(
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
             self.iterator = super().__iter__()
+            if prefetch_depth:
+                self.iterator = BatchPrefetcher(self.iterator, prefetch_depth, device)
 
         def __len__(self):
-            return len(self.batch_sampler.sampler)
+            # with batched loading the batches are sampled by self.sampler
+            return len((self.batch_sampler or self.sampler).sampler)
 
         def __iter__(self):
             for i in range(len(self)):
                 yield next(self.iterator)
 
-    loader = _DataLoader(
-        dataset=dataset,
-        shuffle=False,
-        batch_sampler=_RepeatSampler(batch_sampler),
-        num_workers=num_workers,
-        worker_init_fn=worker_init_fn,
-        collate_fn=get_sequence_collate_fn(sequence_length=dataset.sequence_length),
-    )
+        def close(self):
+            """Stops the prefetching and the workers, the loader can't be used after."""
+            if isinstance(self.iterator, BatchPrefetcher):
+                self.iterator.close()
+            # the workers are shut down once their iterator is garbage collected
+            self.iterator = None
+
+        def __del__(self):
+            if getattr(self, "iterator", None) is not None:
+                self.close()
+
+    if device is not None and device.type != "cuda":
+        device = None
+    # only copies from pinned memory can overlap with computation
+    pin_memory = prefetch_depth > 0 and device is not None
+
+    if batched_loading:
+        loader = _DataLoader(
+            dataset=dataset,
+            batch_size=None,
+            shuffle=False,
+            sampler=_RepeatSampler(batch_sampler),
+            num_workers=num_workers,
+            worker_init_fn=worker_init_fn,
+            pin_memory=pin_memory,
+        )
+    else:
+        loader = _DataLoader(
+            dataset=dataset,
+            shuffle=False,
+            batch_sampler=_RepeatSampler(batch_sampler),
+            num_workers=num_workers,
+            worker_init_fn=worker_init_fn,
+            pin_memory=pin_memory,
+            collate_fn=get_sequence_collate_fn(
+                sequence_length=dataset.sequence_length
+            ),
+        )
 
     return loader
 
 
+def _to_device(batch, device: torch.device):
+    """Moves all tensors in (nested) lists and tuples to device."""
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=True)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_to_device(x, device) for x in batch)
+    return batch
+
+
+class _PrefetchError:
+    def __init__(self, exception: Exception):
+        self.exception = exception
+
+
+class BatchPrefetcher:
+    """Iterator that loads batches of iterator in a background thread.
+
+    Up to depth batches are kept in a queue, so batch n + 1 is assembled while the model
+    works on batch n. If device is given, the batches are copied to it on a separate
+    cuda stream before they are put in the queue.
+
+    queue_depth (summed over all batches) and stall_time count how many batches were
+    ready and how long the training had to wait for the next batch.
+
+    The thread runs until iterator is exhausted or close is called.
+    """
+
+    # seconds between checks whether the prefetcher was closed, while the queue is full
+    put_timeout = 0.1
+
+    def __init__(
+        self, iterator: Iterator, depth: int, device: Optional[torch.device] = None
+    ):
+        self.device = device
+        self.queue = queue.Queue(maxsize=depth)
+
+        self.nb_batches = 0
+        self.queue_depth = 0
+        self.stall_time = 0.0
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._prefetch, args=(iterator,), daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        """Waits for a free slot in the queue. Returns False if closed meanwhile."""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=self.put_timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _prefetch(self, iterator: Iterator):
+        stream = torch.cuda.Stream(self.device) if self.device is not None else None
+        try:
+            for batch in iterator:
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = _to_device(batch, self.device)
+                    # only blocks this thread, not the training
+                    stream.synchronize()
+                if not self._put(batch):
+                    return
+            self._put(_PrefetchError(StopIteration()))
+        except Exception as e:
+            self._put(_PrefetchError(e))
+
+    def close(self):
+        """Stops the thread, which releases iterator and the prefetched batches."""
+        self._stop.set()
+        self._thread.join()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.queue_depth += self.queue.qsize()
+        start = time.perf_counter()
+        batch = self.queue.get()
+        self.stall_time += time.perf_counter() - start
+        self.nb_batches += 1
+
+        if isinstance(batch, _PrefetchError):
+            raise batch.exception
+        return batch
+
+    def get_log(self) -> Dict[str, float]:
+        nb_batches = max(self.nb_batches, 1)
+        return {
+            "stall_time": self.stall_time,
+            "mean_stall_time": self.stall_time / nb_batches,
+            "mean_queue_depth": self.queue_depth / nb_batches,
+        }
+
+
 class BalancedSampler(WeightedRandomSampler):
     def __init__(
         self, dataset: FileListDataset, replacement=True, predefined_weights=None
@@ -155,6 +307,7 @@ class SequenceBatchSampler(BatchSampler):
         sequence_length: int,
         samples_idx,
         dataset: FileListDataset,
+        seed: Optional[int] = None,
     ):
         super().__init__(sampler, batch_size, drop_last)
         self.sequence_length = sequence_length
@@ -164,30 +317,86 @@ class SequenceBatchSampler(BatchSampler):
 
         self.should_sample_audio = dataset.should_sample_audio
 
-    def __iter__(self):
-        batch = []
-        for idx in self.sampler:
-            idx = self.samples_idx[idx]
-
-            vid_idx = [(x, idx) for x in range(idx + 1 - self.sequence_length, idx + 1)]
+        self._samples_idx = np.asarray(samples_idx, dtype=np.int64)
+        self._sequence_offsets = np.arange(1 - sequence_length, 1)
+        self.seed = seed
+        self.epoch = -1
 
-            if self.should_sample_audio:
-                aud_idx = self._sample_audio(idx)
-            else:
-                aud_idx = [None] * self.sequence_length
+    def __iter__(self):
+        # each pass over the sampler is a new epoch, because of the _RepeatSampler
+        # nobody calls set_epoch
+        self.epoch += 1
+        random_state = self._get_random_state()
 
-            batch += list(zip(vid_idx, aud_idx))
+        sampled = []
+        for idx in self.sampler:
+            sampled.append(idx)
+            if len(sampled) == self.batch_size:
+                yield self._to_batch(sampled, random_state)
+                sampled = []
+        if len(sampled) > 0 and not self.drop_last:
+            yield self._to_batch(sampled, random_state)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch - 1
+
+    def _get_random_state(self):
+        if self.seed is None:
+            # the global numpy random state has the same interface
+            return np.random
+        return np.random.RandomState([self.seed, self.epoch])
+
+    def _to_batch(self, sampled: list, random_state) -> list:
+        idx = self._samples_idx[sampled]
+
+        vid_idx = (idx[:, None] + self._sequence_offsets).ravel().tolist()
+        align_idx = np.repeat(idx, self.sequence_length).tolist()
+
+        if self.should_sample_audio:
+            aud_idx = self._sample_audio_batch(idx, random_state)
+            aud_idx = (aud_idx[:, None] + self._sequence_offsets).ravel().tolist()
+        else:
+            aud_idx = [None] * len(vid_idx)
+
+        return list(zip(zip(vid_idx, align_idx), aud_idx))
+
+    def _sample_audio_batch(self, idx: np.ndarray, random_state) -> np.ndarray:
+        """Returns the index of the last audio frame for each sample in idx."""
+        audio_mode = self.d.audio_mode
+        aud_idx = idx.copy()
+        if audio_mode not in [
+            AudioMode.DIFFERENT_VIDEO,
+            AudioMode.FAKE_NOISE_DIFFERENT_VIDEO,
+            AudioMode.SAME_VIDEO_MIN_DISTANCE,
+            AudioMode.SAME_VIDEO_MAX_DISTANCE,
+        ]:
+            # audio always matches
+            return aud_idx
 
-            if len(batch) == self.batch_size * self.sequence_length:
-                yield batch
-                batch = []
-        if len(batch) > 0 and not self.drop_last:
-            yield batch
+        # 50% matching
+        shifted = random_state.random_sample(len(idx)) < 0.5
+        if audio_mode in [
+            AudioMode.DIFFERENT_VIDEO,
+            AudioMode.FAKE_NOISE_DIFFERENT_VIDEO,
+        ]:
+            aud_idx[shifted] = self._samples_idx[
+                random_state.randint(0, self.sampled_idx_len, shifted.sum())
+            ]
+        elif audio_mode == AudioMode.SAME_VIDEO_MIN_DISTANCE:
+            aud_idx[shifted] += self.d._sample_audio_shifts_with_min_distance(
+                idx[shifted], random_state
+            )
+        else:
+            aud_idx[shifted] += self.d._sample_audio_shifts_with_max_distance(
+                idx[shifted], random_state
+            )
+        return aud_idx
 
     def better_np_random_choice(self, arr: list):
         return arr[np.random.randint(0, len(arr))]
 
     def _sample_audio(self, idx):
+        """Per sample version of _sample_audio_batch. Kept as baseline for benchmarks."""
         if self.d.audio_mode == AudioMode.MANIPULATION_METHOD_DIFFERENT_VIDEO:
             # always select different audio
             # idx = self.samples_idx[np.random.randint(0, self.sampled_idx_len)]
@@ -0,0 +1,252 @@
+import io
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Dict
+
+import click
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import RandomSampler
+
+from forgery_detection.data.face_forensics.splits import TRAIN_NAME
+from forgery_detection.data.file_lists import FileList
+from forgery_detection.data.file_lists import SimpleFileList
+from forgery_detection.data.loading import get_fixed_dataloader
+from forgery_detection.data.loading import get_sequence_collate_fn
+from forgery_detection.data.loading import SequenceBatchSampler
+from forgery_detection.data.set import FileListDataset
+from forgery_detection.lightning.logging.const import AudioMode
+from forgery_detection.lightning.logging.const import FrameLoader
+from forgery_detection.lightning.logging.utils import get_device
+from forgery_detection.lightning.logging.utils import PythonLiteralOptionGPUs
+from forgery_detection.lightning.system import Supervised
+
+STAGES = [
+    "sampler",
+    "open",
+    "decode",
+    "crop",
+    "transforms",
+    "audio",
+    "collate",
+    "transfer",
+]
+
+
+class StageTimer:
+    """Sums up the time spent in each stage."""
+
+    def __init__(self):
+        self.times = dict.fromkeys(STAGES, 0.0)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        start = time.perf_counter()
+        yield
+        self.times[stage] += time.perf_counter() - start
+
+
+def _read_frame(dataset: FileListDataset, img_idx: int):
+    if dataset.packed_frames is not None:
+        return dataset.packed_frames.load_frame(img_idx)
+    path, _ = dataset._samples[img_idx]
+    with open(f"{dataset.root}/{path}", "rb") as f:
+        return f.read()
+
+
+def _decode_frame(frame) -> Image.Image:
+    if isinstance(frame, np.ndarray):
+        return Image.fromarray(frame)
+    # same as torchvision's default_loader, but from memory
+    return Image.open(io.BytesIO(frame)).convert("RGB")
+
+
+def profile_stages(
+    dataset: FileListDataset,
+    batch_sampler: SequenceBatchSampler,
+    nb_batches: int,
+    device: torch.device,
+) -> Dict[str, float]:
+    """Seconds spent in each stage of loading nb_batches in the main process.
+
+    Follows FileListDataset.__getitem__ and the sequence collate step by step.
+    """
+    timer = StageTimer()
+    collate = get_sequence_collate_fn(dataset.sequence_length)
+    batches = iter(batch_sampler)
+    for _ in range(nb_batches):
+        with timer("sampler"):
+            batch = next(batches)
+
+        samples = []
+        for (img_idx, align_idx), audio_idx in batch:
+            _, target = dataset._samples[img_idx]
+            with timer("open"):
+                frame = _read_frame(dataset, img_idx)
+            with timer("decode"):
+                x = _decode_frame(frame)
+            if dataset.should_align_faces:
+                with timer("crop"):
+                    x = dataset._crop_face(x, align_idx)
+            with timer("transforms"):
+                x = dataset.transform(x)
+            if dataset.should_sample_audio:
+                with timer("audio"):
+                    aud, target = dataset._load_audio(img_idx, audio_idx, target)
+                x = x, aud
+            samples.append((x, target))
+
+        with timer("collate"):
+            x, target = collate(samples)
+
+        if device.type == "cuda":
+            with timer("transfer"):
+                for _x in [x] if isinstance(x, torch.Tensor) else x:
+                    _x.to(device)
+                torch.cuda.synchronize(device)
+    return timer.times
+
+
+def samples_per_second(loader, batch_size: int, nb_batches: int) -> float:
+    batches = iter(loader)
+    # the first batch includes starting the workers
+    next(batches)
+    start = time.perf_counter()
+    nb_batches = sum(1 for _ in islice(batches, nb_batches))
+    return nb_batches * batch_size / (time.perf_counter() - start)
+
+
+def _get_transforms(names: str):
+    return [
+        transform
+        for name in names.split(" ")
+        for transform in Supervised.CUSTOM_TRANSFORMS[name]
+    ]
+
+
+@click.command()
+@click.option(
+    "--data_dir",
+    required=True,
+    type=click.Path(exists=True),
+    help="Path to file list json.",
+)
+@click.option("--split", default=TRAIN_NAME)
+@click.option(
+    "--audio_file",
+    default=None,
+    type=click.Path(exists=True),
+    help="Path to json with dict of files to load.",
+)
+@click.option(
+    "--audio_mode",
+    type=click.Choice(AudioMode.__members__.keys()),
+    default=AudioMode.EXACT.name,
+)
+@click.option(
+    "--frame_loader",
+    type=click.Choice(FrameLoader.__members__.keys()),
+    default=FrameLoader.PNG.name,
+)
+@click.option("--batch_size", default=256)
+@click.option("--sequence_length", default=1)
+@click.option("--resize_transforms", default="none")
+@click.option("--image_augmentation_transforms", default="none")
+@click.option("--tensor_augmentation_transforms", default="none")
+@click.option("--crop_faces", is_flag=True)
+@click.option("--batched_loading", is_flag=True)
+@click.option("--prefetch_depth", default=0)
+@click.option("--gpus", cls=PythonLiteralOptionGPUs, default="[]")
+@click.option(
+    "--n_cpu",
+    "n_cpus",
+    multiple=True,
+    default=[0, 2, 4, 8],
+    help="Numbers of dataloader workers the throughput is measured for.",
+)
+@click.option("--nb_batches", default=20)
+def benchmark_data_pipeline(
+    data_dir,
+    split,
+    audio_file,
+    audio_mode,
+    frame_loader,
+    batch_size,
+    sequence_length,
+    resize_transforms,
+    image_augmentation_transforms,
+    tensor_augmentation_transforms,
+    crop_faces,
+    batched_loading,
+    prefetch_depth,
+    gpus,
+    n_cpus,
+    nb_batches,
+):
+    """Time of each loading stage and samples/s for different numbers of workers.
+
+    The stages are timed in a single process. The throughput is measured with the
+    dataloader that is used for training. A sample is a sequence of sequence_length
+    frames.
+    """
+    file_list = FileList.load(data_dir)
+    dataset = file_list.get_dataset(
+        split,
+        image_transforms=_get_transforms(resize_transforms)
+        + _get_transforms(image_augmentation_transforms),
+        tensor_transforms=_get_transforms(tensor_augmentation_transforms),
+        sequence_length=sequence_length,
+        should_align_faces=crop_faces,
+        audio_file_list=SimpleFileList.load(audio_file) if audio_file else None,
+        audio_mode=AudioMode[audio_mode],
+        frame_loader=FrameLoader[frame_loader],
+    )
+    device = get_device(gpus)
+
+    batch_sampler = SequenceBatchSampler(
+        RandomSampler(dataset),
+        batch_size=batch_size,
+        drop_last=True,
+        sequence_length=sequence_length,
+        samples_idx=dataset.samples_idx,
+        dataset=dataset,
+        seed=0,
+    )
+    times = profile_stages(dataset, batch_sampler, nb_batches, device)
+    total = sum(times.values())
+
+    print(f"{'stage':<12}{'seconds':>10}{'share':>9}{'samples/s':>12}")
+    for stage, seconds in list(times.items()) + [("total", total)]:
+        if not seconds:
+            # skipped, e.g. crop without --crop_faces or transfer on the cpu
+            print(f"{stage:<12}{'-':>10}{'-':>9}{'-':>12}")
+            continue
+        print(
+            f"{stage:<12}{seconds:>10.3f}{seconds / total:>9.1%}"
+            f"{nb_batches * batch_size / seconds:>12.1f}"
+        )
+    bottleneck = max(times, key=times.get)
+    print(f"Bottleneck: {bottleneck} ({times[bottleneck] / total:.1%})\n")
+
+    print(f"{'n_cpu':<8}{'samples/s':>12}{'per worker':>12}")
+    for n_cpu in n_cpus:
+        loader = get_fixed_dataloader(
+            dataset,
+            batch_size,
+            num_workers=n_cpu,
+            sampler=RandomSampler,
+            worker_init_fn=lambda worker_id: np.random.seed(worker_id),
+            batched_loading=batched_loading,
+            prefetch_depth=prefetch_depth,
+            device=device,
+        )
+        throughput = samples_per_second(loader, batch_size, nb_batches)
+        print(f"{n_cpu:<8}{throughput:>12.1f}{throughput / max(n_cpu, 1):>12.1f}")
+        # stops the prefetching and the workers before the next setting is measured
+        loader.close()
+
+
+if __name__ == "__main__":
+    benchmark_data_pipeline()
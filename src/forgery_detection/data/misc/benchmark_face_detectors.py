@@ -0,0 +1,122 @@
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import click
+import cv2
+import numpy as np
+
+from forgery_detection.data.face_detection import DETECTORS
+from forgery_detection.data.face_detection import FaceDetector
+from forgery_detection.data.face_detection import get_boundingbox
+from forgery_detection.data.face_detection import get_detector
+from forgery_detection.data.face_forensics.face_tracking import box_iou
+from forgery_detection.data.video_clips import find_videos
+from forgery_detection.data.video_clips import read_frames
+from forgery_detection.data.video_clips import select_clip_starts
+
+
+def _sample_frames(video, nb_frames: int) -> List[np.ndarray]:
+    capture = cv2.VideoCapture(str(video))
+    video_length = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    capture.release()
+    frames = read_frames(video, select_clip_starts(video_length, 1, nb_frames))
+    return list(frames.values())
+
+
+def detect_boxes(
+    detector: FaceDetector, videos: List[List[np.ndarray]], batch_size: int
+) -> List[Optional[List[int]]]:
+    """[x, y, size] box of the first face of each frame or None."""
+    boxes = []
+    for frames in videos:
+        for start in range(0, len(frames), batch_size):
+            batch = frames[start : start + batch_size]
+            for frame, faces in zip(batch, detector.detect(batch)):
+                height, width, _ = frame.shape
+                boxes.append(
+                    list(get_boundingbox(faces[0], width, height)) if faces else None
+                )
+    return boxes
+
+
+def compare_boxes(
+    boxes: List[Optional[List[int]]], reference: List[Optional[List[int]]]
+) -> Dict[str, float]:
+    ious = [
+        box_iou(box, reference_box)
+        for box, reference_box in zip(boxes, reference)
+        if box is not None and reference_box is not None
+    ]
+    return {
+        "found": np.mean([box is not None for box in boxes]),
+        "agreement": np.mean(
+            [(box is None) == (ref is None) for box, ref in zip(boxes, reference)]
+        ),
+        "mean_iou": np.mean(ious) if ious else float("nan"),
+    }
+
+
+@click.command()
+@click.option("--videos_dir", required=True, type=click.Path(exists=True))
+@click.option("--nb_videos", default=10)
+@click.option("--nb_frames", default=32, help="Frames per video, evenly spread.")
+@click.option(
+    "--detector",
+    "detectors",
+    multiple=True,
+    type=click.Choice(list(DETECTORS)),
+    default=list(DETECTORS),
+)
+@click.option(
+    "--max_size",
+    "max_sizes",
+    multiple=True,
+    default=[0, 640, 320],
+    help="Longer side frames are downscaled to for detection, 0 is full size.",
+)
+@click.option("--reference", type=click.Choice(list(DETECTORS)), default="dlib")
+@click.option("--batch_size", default=16)
+def benchmark_face_detectors(
+    videos_dir, nb_videos, nb_frames, detectors, max_sizes, reference, batch_size
+):
+    """Compares frames/s and boxes of the detectors to reference on full size frames.
+
+    Decoding the frames is not timed.
+    """
+    videos = [
+        _sample_frames(video, nb_frames)
+        for video in find_videos(videos_dir)[:nb_videos]
+    ]
+    nb_frames = sum(map(len, videos))
+    reference_boxes = detect_boxes(get_detector(reference), videos, batch_size)
+
+    print(
+        f"{'detector':<18}{'max_size':>10}{'frames/s':>10}"
+        f"{'found':>8}{'agreement':>11}{'mean iou':>10}"
+    )
+    for name in detectors:
+        for max_size in max_sizes:
+            try:
+                detector = get_detector(name, max_size=max_size or None)
+            except ImportError as e:
+                print(f"{name:<18}skipped: {e}")
+                break
+            # the first call can include one time setup costs
+            detector.detect(videos[0][:1])
+
+            start = time.perf_counter()
+            boxes = detect_boxes(detector, videos, batch_size)
+            frames_per_second = nb_frames / (time.perf_counter() - start)
+
+            comparison = compare_boxes(boxes, reference_boxes)
+            print(
+                f"{name:<18}{max_size or 'full':>10}{frames_per_second:>10.1f}"
+                f"{comparison['found']:>8.1%}{comparison['agreement']:>11.1%}"
+                f"{comparison['mean_iou']:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    benchmark_face_detectors()
@@ -0,0 +1,105 @@
+import time
+from itertools import islice
+
+import click
+from torch.utils.data import RandomSampler
+
+from forgery_detection.data.face_forensics.splits import TRAIN_NAME
+from forgery_detection.data.file_lists import FileList
+from forgery_detection.data.file_lists import SimpleFileList
+from forgery_detection.data.loading import SequenceBatchSampler
+from forgery_detection.lightning.logging.const import AudioMode
+
+
+def _synthetic_file_list(nb_videos: int, video_length: int, sequence_length: int):
+    """File list with nb_videos of video_length frames, without any files on disk."""
+    file_list = FileList(
+        root="", classes=["fake", "real"], min_sequence_length=sequence_length
+    )
+    for video in range(nb_videos):
+        start = len(file_list.samples[TRAIN_NAME])
+        file_list.samples[TRAIN_NAME] += [
+            (f"{video:05d}/{frame:04d}.png", video % 2) for frame in range(video_length)
+        ]
+        file_list.samples_idx[TRAIN_NAME] += list(
+            range(start + sequence_length - 1, start + video_length)
+        )
+    return file_list
+
+
+def _per_sample_iter(batch_sampler: SequenceBatchSampler):
+    """The sampling as it was done before _sample_audio_batch existed."""
+    batch = []
+    for idx in batch_sampler.sampler:
+        idx = batch_sampler.samples_idx[idx]
+
+        vid_idx = [
+            (x, idx) for x in range(idx + 1 - batch_sampler.sequence_length, idx + 1)
+        ]
+        aud_idx = batch_sampler._sample_audio(idx)
+        batch += list(zip(vid_idx, aud_idx))
+
+        if len(batch) == batch_sampler.batch_size * batch_sampler.sequence_length:
+            yield batch
+            batch = []
+
+
+def _batches_per_second(batches, nb_batches: int) -> float:
+    # the first batch includes one time setup costs (lazy imports, caches)
+    next(batches)
+    start = time.perf_counter()
+    nb_batches = sum(1 for _ in islice(batches, nb_batches))
+    return nb_batches / (time.perf_counter() - start)
+
+
+@click.command()
+@click.option(
+    "--file_list",
+    default=None,
+    type=click.Path(exists=True),
+    help="File list to sample from. If not given a synthetic one is used.",
+)
+@click.option("--split", default=TRAIN_NAME)
+@click.option("--batch_size", default=256)
+@click.option("--sequence_length", default=8)
+@click.option("--nb_batches", default=50)
+@click.option("--nb_videos", default=1000, help="Only used for synthetic file list.")
+@click.option("--video_length", default=300, help="Only used for synthetic file list.")
+def benchmark_sequence_sampler(
+    file_list, split, batch_size, sequence_length, nb_batches, nb_videos, video_length
+):
+    """Compares batches/s of the per sample and the vectorised audio sampling."""
+    if file_list:
+        f = FileList.load(file_list)
+    else:
+        f = _synthetic_file_list(nb_videos, video_length, sequence_length)
+        split = TRAIN_NAME
+
+    print(f"{'audio_mode':<38}{'per sample':>15}{'vectorised':>15}{'speedup':>10}")
+    for audio_mode in AudioMode:
+        dataset = f.get_dataset(
+            split,
+            sequence_length=sequence_length,
+            # the audio features are never loaded, only sampled
+            audio_file_list=SimpleFileList(root=""),
+            audio_mode=audio_mode,
+        )
+        batch_sampler = SequenceBatchSampler(
+            RandomSampler(dataset),
+            batch_size=batch_size,
+            drop_last=True,
+            sequence_length=sequence_length,
+            samples_idx=dataset.samples_idx,
+            dataset=dataset,
+            seed=0,
+        )
+        per_sample = _batches_per_second(_per_sample_iter(batch_sampler), nb_batches)
+        vectorised = _batches_per_second(iter(batch_sampler), nb_batches)
+        print(
+            f"{str(audio_mode):<38}{per_sample:>13.1f}/s{vectorised:>13.1f}/s"
+            f"{vectorised / per_sample:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_sequence_sampler()
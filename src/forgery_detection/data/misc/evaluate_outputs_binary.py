@@ -4,10 +4,18 @@ from pathlib import Path
 import numpy as np
 import torch
 
-from forgery_detection.lightning.logging.const import NAN_TENSOR
+from forgery_detection.lightning.logging.metrics import per_class_mean
+from forgery_detection.lightning.logging.output_store import OutputReader
 
 
 def load_outputs(outputs_file):
+    if OutputReader.is_output_folder(outputs_file):
+        outputs = OutputReader(outputs_file)
+        pred = torch.from_numpy(np.array(outputs["pred"]))
+        label = torch.from_numpy(np.array(outputs["target"]))
+        return pred, label // 4, label
+
+    # outputs of older test runs are pickled
     with open(outputs_file, "rb") as f:
         outputs = pickle.load(f)
 
@@ -36,64 +44,34 @@ def calculate_accuracy(class_accuracies, binary):
 
 
 def class_acc(pred, target, binary, classes=5):
-    accs = np.zeros((classes,))
-    for c in range(classes):
-        class_mask = target == c
-        if binary:
-            p, t = pred[class_mask], c // 4
-        else:
-            p, t = pred[class_mask], c
-        if p.shape[0] == 0:
-            accs[c] = NAN_TENSOR
-        else:
-            accs[c] = p.eq(t).float().mean()
-    return accs
+    # in the binary case the first 4 classes are fake (0) and the last is real (1)
+    expected = torch.arange(classes) // 4 if binary else torch.arange(classes)
+    correct = pred.eq(expected[target]).double()
+    return per_class_mean(correct, target, classes).numpy()
 
 
 # both inputs are 0 or 1
 def binary_acc(pred_arg_maxed, binary_target):
-    accs = np.zeros((2,))
-    for c in range(2):
-        class_mask = binary_target == c
-        p = pred_arg_maxed[class_mask]
-
-        if p.shape[0] == 0:
-            accs[c] = NAN_TENSOR
-        else:
-            accs[c] = p.eq(c).float().mean()
-    return accs
+    correct = pred_arg_maxed.eq(binary_target).double()
+    return per_class_mean(correct, binary_target, 2).numpy()
 
 
 # first 0 or 1, last 5
 def binary_class_acc(pred_arg_maxed, labels):
-    accs = np.zeros((5,))
-    for c in range(5):
-        class_mask = labels == c
-        p, t = pred_arg_maxed[class_mask], c // 4
-
-        if p.shape[0] == 0:
-            accs[c] = NAN_TENSOR
-        else:
-            accs[c] = p.eq(t).float().mean()
-    return accs
+    return class_acc(pred_arg_maxed, labels, binary=True)
 
 
 # both in range of 0 to 5
 def multi_class_acc(pred_arg_maxed, labels):
-    accs = np.zeros((5,))
-    for c in range(5):
-        class_mask = labels == c
-        p, t = pred_arg_maxed[class_mask], c
-
-        if p.shape[0] == 0:
-            accs[c] = NAN_TENSOR
-        else:
-            accs[c] = p.eq(t).float().mean()
-    return accs
+    return class_acc(pred_arg_maxed, labels, binary=False)
 
 
 def get_output_file_names_ordered(folder):
-    return sorted(Path(folder).glob("*.pkl"))
+    return sorted(
+        path
+        for path in Path(folder).glob("outputs_*")
+        if path.suffix == ".pkl" or OutputReader.is_output_folder(path)
+    )
 
 
 def calculate_metrics(outputs_file, binary=True):
@@ -0,0 +1,47 @@
+import click
+import numpy as np
+import torch
+
+from forgery_detection.lightning.logging.output_store import OutputReader
+from forgery_detection.lightning.logging.video_metrics import evaluate_videos
+from forgery_detection.lightning.logging.video_metrics import STRATEGIES
+
+
+@click.command()
+@click.option(
+    "--outputs_folder",
+    required=True,
+    type=click.Path(exists=True),
+    help="Test outputs folder written by Supervised.test_step.",
+)
+@click.option(
+    "--strategy",
+    "strategies",
+    type=click.Choice(list(STRATEGIES)),
+    multiple=True,
+    default=list(STRATEGIES),
+    help="How the clips of a video are aggregated. Can be given multiple times.",
+)
+@click.option("--k", default=5, help="Number of clips used by top_k.")
+@click.option("--binary", is_flag=True, help="Evaluate fake vs. real.")
+def evaluate_outputs_per_video(outputs_folder, strategies, k, binary):
+    """Prints video level accuracy, auc and class accuracies of each strategy."""
+    outputs = OutputReader(outputs_folder)
+    logits = torch.from_numpy(np.array(outputs["pred"]))
+    targets = torch.from_numpy(np.array(outputs["target"]))
+    video_idx = outputs["video_idx"]
+
+    print(f"{'strategy':<10}{'videos':>8}{'acc':>9}{'auc':>9}  class_acc")
+    for strategy in strategies:
+        metrics = evaluate_videos(
+            logits, targets, video_idx, strategy=strategy, k=k, binary=binary
+        )
+        print(
+            f"{strategy:<10}{metrics['nb_videos']:>8}{metrics['acc']:>9.2%}"
+            f"{metrics['auc']:>9.3f}  "
+            + "".join("{:.2%};".format(x) for x in metrics["class_acc"])
+        )
+
+
+if __name__ == "__main__":
+    evaluate_outputs_per_video()
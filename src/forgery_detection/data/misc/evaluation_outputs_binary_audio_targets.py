@@ -5,9 +5,19 @@ import numpy as np
 import torch
 
 from forgery_detection.lightning.logging.const import NAN_TENSOR
+from forgery_detection.lightning.logging.output_store import OutputReader
 
 
 def load_outputs(outputs_file):
+    if OutputReader.is_output_folder(outputs_file):
+        outputs = OutputReader(outputs_file)
+        pred = torch.from_numpy(np.array(outputs["pred"]))
+        # test runs without audio don't write audio_sync
+        label_column = "audio_sync" if "audio_sync" in outputs else "target"
+        label = torch.from_numpy(np.array(outputs[label_column]))
+        return pred, label // 4, label
+
+    # outputs of older test runs are pickled
     with open(outputs_file, "rb") as f:
         outputs = pickle.load(f)
 
@@ -93,7 +103,11 @@ def multi_class_acc(pred_arg_maxed, labels):
 
 
 def get_output_file_names_ordered(folder):
-    return sorted(Path(folder).glob("*.pkl"))
+    return sorted(
+        path
+        for path in Path(folder).glob("outputs_*")
+        if path.suffix == ".pkl" or OutputReader.is_output_folder(path)
+    )
 
 
 def calculate_metrics(outputs_file, binary=True):
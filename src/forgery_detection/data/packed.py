@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import itertools
+import logging
+import multiprocessing as mp
+from pathlib import Path
+from typing import List
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+import numpy as np
+from joblib import delayed
+from joblib import Parallel
+from torchvision.datasets.folder import default_loader
+
+logger = logging.getLogger(__file__)
+
+if TYPE_CHECKING:
+    from forgery_detection.data.file_lists import FileList
+
+SHARD_SUFFIX = ".bin"
+
+
+def _video_of(path: str) -> str:
+    return path.rsplit("/", 1)[0]
+
+
+def group_samples_by_video(samples: list) -> List[Tuple[str, List[int]]]:
+    """Groups consecutive samples of a split by the folder (i.e. video) they are in.
+
+    Returns:
+        List of (relative video path, list of sample indices) in order of samples.
+
+    """
+    return [
+        (video, [sample_idx for sample_idx, _ in group])
+        for video, group in itertools.groupby(
+            enumerate(samples), key=lambda item: _video_of(item[1][0])
+        )
+    ]
+
+
+def pack_video(
+    root: Path, packed_root: Path, video: str, sample_paths: List[str]
+) -> np.ndarray:
+    """Decodes all frames of one video and writes them into a single flat uint8 shard.
+
+    Frames are stored one after the other in HWC order without any header.
+
+    Returns:
+        Array with shape len(sample_paths) x 3 containing the shape of each frame.
+
+    """
+    frames = [np.asarray(default_loader(str(root / path))) for path in sample_paths]
+    shard_path = packed_root / (video + SHARD_SUFFIX)
+    shard_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(shard_path, "wb") as f:
+        for frame in frames:
+            f.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+    return np.array([frame.shape for frame in frames], dtype=np.int32)
+
+
+def write_index(
+    packed_root: Path,
+    split: str,
+    videos: List[Tuple[str, List[int]]],
+    shapes: List[np.ndarray],
+):
+    """Writes the index of a split, that maps each sample to its frame in a shard."""
+    nb_samples = sum(len(sample_indices) for _, sample_indices in videos)
+    shard_idx = np.zeros(nb_samples, dtype=np.int32)
+    offsets = np.zeros(nb_samples, dtype=np.int64)
+    frame_shapes = np.zeros((nb_samples, 3), dtype=np.int32)
+
+    for video_idx, ((_, sample_indices), video_shapes) in enumerate(
+        zip(videos, shapes)
+    ):
+        sizes = np.prod(video_shapes, axis=1, dtype=np.int64)
+        shard_idx[sample_indices] = video_idx
+        offsets[sample_indices] = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        frame_shapes[sample_indices] = video_shapes
+
+    np.savez(
+        packed_root / f"{split}.npz",
+        shards=np.array([video for video, _ in videos], dtype=str),
+        shard_idx=shard_idx,
+        offsets=offsets,
+        shapes=frame_shapes,
+    )
+
+
+class PackedFrames:
+    """Frames of one split of a FileList packed into one uint8 shard per video.
+
+    The index maps each sample to its shard, its byte offset inside the shard and the
+    shape of the frame. Consecutive frames of a video are stored next to each other,
+    therefore a whole sequence can be read with one seek."""
+
+    def __init__(self, packed_root: str, split: str):
+        self.packed_root = Path(packed_root)
+        self.split = split
+
+        index = np.load(self.packed_root / f"{split}.npz")
+        self.shards = index["shards"]
+        self.shard_idx = index["shard_idx"]
+        self.offsets = index["offsets"]
+        self.shapes = index["shapes"]
+        self.sizes = np.prod(self.shapes, axis=1, dtype=np.int64)
+
+    def _read(self, shard_idx: int, offset: int, nb_bytes: int) -> np.ndarray:
+        shard_path = self.packed_root / (str(self.shards[shard_idx]) + SHARD_SUFFIX)
+        with open(shard_path, "rb") as f:
+            f.seek(offset)
+            return np.frombuffer(f.read(nb_bytes), dtype=np.uint8)
+
+    def load_frame(self, idx: int) -> np.ndarray:
+        """Returns frame of sample idx as h x w x c uint8 array."""
+        frame = self._read(self.shard_idx[idx], self.offsets[idx], self.sizes[idx])
+        return frame.reshape(self.shapes[idx])
+
+    def load_sequence(self, last_idx: int, sequence_length: int) -> List[np.ndarray]:
+        """Returns the frames of samples last_idx + 1 - sequence_length to last_idx.
+
+        All frames have to be in the same video.
+        """
+        first_idx = last_idx + 1 - sequence_length
+        if self.shard_idx[first_idx] != self.shard_idx[last_idx]:
+            raise ValueError(
+                f"Sequence {first_idx}-{last_idx} spans more than one video."
+            )
+        start = self.offsets[first_idx]
+        data = self._read(
+            self.shard_idx[first_idx],
+            start,
+            self.offsets[last_idx] + self.sizes[last_idx] - start,
+        )
+        return [
+            data[offset - start : offset - start + size].reshape(shape)
+            for offset, size, shape in zip(
+                self.offsets[first_idx : last_idx + 1],
+                self.sizes[first_idx : last_idx + 1],
+                self.shapes[first_idx : last_idx + 1],
+            )
+        ]
+
+    def __len__(self):
+        return len(self.shard_idx)
+
+    def __repr__(self):
+        return f"""PackedFrames:
+
+packed_root={self.packed_root}
+split={self.split}
+number_of_shards={len(self.shards)}
+number_of_frames={len(self)}"""
+
+
+def pack_file_list(
+    file_list: FileList, packed_root: Path, split: str, n_jobs=mp.cpu_count()
+):
+    """Packs all samples of a split into shards below packed_root."""
+    root = Path(file_list.root)
+    videos = group_samples_by_video(file_list.samples[split])
+    if len({video for video, _ in videos}) != len(videos):
+        raise ValueError(f"Frames of a video are not consecutive in {split}.")
+
+    shapes = Parallel(n_jobs=n_jobs)(
+        delayed(pack_video)(
+            root,
+            packed_root,
+            video,
+            [file_list.samples[split][sample_idx][0] for sample_idx in sample_indices],
+        )
+        for video, sample_indices in videos
+    )
+    write_index(packed_root, split, videos, shapes)
+    logger.info(f"Packed {len(videos)} videos of {split} into {packed_root}.")
@@ -2,24 +2,44 @@ from __future__ import annotations
 
 import logging
 import os
-from pathlib import Path
 from typing import List
 from typing import Optional
 from typing import Tuple
 from typing import TYPE_CHECKING
 
 import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
 from torchvision.datasets import ImageFolder
 from torchvision.datasets import VisionDataset
 from torchvision.datasets.folder import default_loader
 
+from forgery_detection.data.utils import calculate_relative_bb
 from forgery_detection.lightning.logging.const import AudioMode
 
 logger = logging.getLogger(__file__)
 
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
 if TYPE_CHECKING:
     from forgery_detection.data.file_lists import FileList
     from forgery_detection.data.file_lists import SimpleFileList
+    from forgery_detection.data.frame_cache import SharedFrameCache
+    from forgery_detection.data.packed import PackedFrames
+
+
+def get_transform(image_transforms=None, tensor_transforms=None):
+    """Image transforms, conversion to a normalized tensor and tensor transforms."""
+    return transforms.Compose(
+        (image_transforms or [])
+        + [
+            transforms.ToTensor(),
+            transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD),
+        ]
+        + (tensor_transforms or [])
+    )
 
 
 class SafeImageFolder(ImageFolder):
@@ -61,13 +81,17 @@ class FileListDataset(VisionDataset):
         target_transform=None,
         audio_file_list: Optional[SimpleFileList] = None,
         audio_mode: AudioMode = AudioMode.EXACT,
+        packed_frames: Optional[PackedFrames] = None,
+        image_transform=None,
+        tensor_transform=None,
+        raw_frames=False,
+        frame_cache: Optional[SharedFrameCache] = None,
     ):
         super().__init__(
             file_list.root, transform=transform, target_transform=target_transform
         )
         self.audio_file_list = audio_file_list
         self.should_sample_audio = audio_file_list is not None
-        self.audio_table = {}
         self.audio_mode = audio_mode
 
         self.classes = file_list.classes
@@ -75,14 +99,26 @@ class FileListDataset(VisionDataset):
         self._samples = file_list.samples[split]
         self.samples_idx = file_list.samples_idx[split]
         self.split = split
-        self.targets = [s[1] for s in self._samples]
+        self.targets = file_list.get_targets(split)
         self.sequence_length = sequence_length
+        self.packed_frames = packed_frames
+        self.video_table = file_list.get_video_table(split)
+
+        # used by load_batch, which converts and normalizes the stacked images itself
+        self.image_transform = image_transform
+        self.tensor_transform = tensor_transform
+        # if set load_batch leaves resizing, augmentation and normalization to a
+        # batch_transforms.BatchCompose that runs on the whole batch
+        self.raw_frames = raw_frames
+        self.frame_cache = frame_cache
 
         self.should_align_faces = should_align_faces
         if self.should_align_faces:
-            self.relative_bbs = file_list.relative_bbs[split]
-            if len(self.relative_bbs) == 0:
-                raise ValueError("Trying to align faces without relative bbs.")
+            self.crop_boxes = file_list.get_crop_boxes(split)
+            if self.crop_boxes is None:
+                self.relative_bbs = file_list.relative_bbs[split]
+                if len(self.relative_bbs) == 0:
+                    raise ValueError("Trying to align faces without relative bbs.")
 
     def __getitem__(self, index: Tuple[Tuple[int, int], int]):
         """
@@ -92,14 +128,17 @@ class FileListDataset(VisionDataset):
         Returns:
             tuple: (sample, target) where target is class_index of the target class.
         """
+        if isinstance(index, list):
+            # the dataloader hands over whole batches if batched loading is used
+            return self.load_batch(index)
+
         (img_idx, align_idx), audio_idx = index
 
-        path, target = self._samples[img_idx]
-        vid = default_loader(f"{self.root}/{path}")
+        _, target = self._samples[img_idx]
+        vid = self._load_image(img_idx)
 
         if self.should_align_faces:
-            relative_bb = self.relative_bbs[align_idx]
-            vid = self.align_face(vid, relative_bb)
+            vid = self._crop_face(vid, align_idx)
 
         if self.transform is not None:
             vid = self.transform(vid)
@@ -108,46 +147,175 @@ class FileListDataset(VisionDataset):
             target = self.target_transform(target)
 
         if self.should_sample_audio:
-            if self.audio_mode == AudioMode.FAKE_NOISE_DIFFERENT_VIDEO or (
-                self.audio_mode == AudioMode.MANIPULATION_METHOD_DIFFERENT_VIDEO
-                and target
-                == 4  # MANIPULATION_METHOD_DIFFERENT_VIDEO means we select different audio for manipulation vidoes
-            ):
-                aud_path, _ = self._samples[img_idx]
-            else:
-                aud_path, _ = self._samples[audio_idx]
-            aud = self.audio_file_list(aud_path, stacked=True)
-            aud: np.ndarray
-
-            # this adds gaussian noise to audio input if it's supposed to be fake input
-            if (
-                self.audio_mode == AudioMode.FAKE_NOISE_DIFFERENT_VIDEO
-                and audio_idx != img_idx
-            ) or (self.audio_mode == AudioMode.FAKE_NOISE and target != 4):
-                aud += np.random.normal(0, 1, aud.shape).astype(aud.dtype)
-
+            aud, target = self._load_audio(img_idx, audio_idx, target)
             sample = vid, aud
-
-            # we have to do this because noisynets use the audio label for classification
-            if self.audio_mode == AudioMode.MANIPULATION_METHOD_DIFFERENT_VIDEO:
-                if target == 4:
-                    audio_idx = img_idx
-                else:
-                    audio_idx = (
-                        -1
-                    )  # this is nessecary for the case of wanting exact audio,
-                    # but using audio targets for training not class targets
-
-            # this indicates if the audio and the images are in sync
-            target = (target, int(audio_idx == img_idx))
         else:
             sample = vid
 
         return sample, target
 
+    def load_batch(self, batch: List[Tuple[Tuple[int, int], int]]):
+        """Loads a whole batch of sequences in one call.
+
+        Resize and augmentations are applied per image, conversion to tensor and
+        normalization are done once for the stacked batch.
+
+        Args:
+            batch: indices as yielded by SequenceBatchSampler, i.e.
+                batch_size * sequence_length items, sequence after sequence
+
+        Returns:
+            tuple: (sample, target) like get_sequence_collate_fn would return them, i.e.
+                sample has the shape b x t x c x h x w. With raw_frames the sample is
+                (frames, boxes) instead, see _to_raw_frames.
+        """
+        images = []
+        for seq_start in range(0, len(batch), self.sequence_length):
+            sequence = batch[seq_start : seq_start + self.sequence_length]
+            frames = self._load_sequence([img_idx for (img_idx, _), _ in sequence])
+            for frame, ((_, align_idx), _) in zip(frames, sequence):
+                if self.should_align_faces:
+                    frame = self._crop_face(frame, align_idx)
+                if self.image_transform is not None and not self.raw_frames:
+                    frame = self.image_transform(frame)
+                images.append(frame)
+
+        if self.raw_frames:
+            vid = self._to_raw_frames(images)
+        else:
+            vid = self._to_sequences(self._to_normalized_tensor(images))
+
+        targets = []
+        auds = []
+        for (img_idx, _), audio_idx in batch:
+            _, target = self._samples[img_idx]
+            if self.target_transform is not None:
+                target = self.target_transform(target)
+            if self.should_sample_audio:
+                aud, target = self._load_audio(img_idx, audio_idx, target)
+                auds.append(aud)
+            targets.append(target)
+
+        # like in the sequence collate only the target of the first frame is used
+        targets = torch.tensor(targets[:: self.sequence_length])
+        if self.should_sample_audio:
+            aud = self._to_sequences(torch.from_numpy(np.stack(auds)))
+            # default_collate does not stack the targets for single images
+            targets = targets.t() if self.sequence_length > 1 else list(targets.t())
+            return [vid, aud], targets
+        return vid, targets
+
+    def _to_sequences(self, x: torch.Tensor) -> torch.Tensor:
+        if self.sequence_length == 1:
+            return x
+        return x.view(-1, self.sequence_length, *x.shape[1:])
+
+    def _load_sequence(self, img_indices: List[int]) -> List[Image.Image]:
+        if (
+            self.packed_frames is not None
+            and self.frame_cache is None
+            and img_indices[-1] - img_indices[0] == len(img_indices) - 1
+        ):
+            return [
+                Image.fromarray(frame)
+                for frame in self.packed_frames.load_sequence(
+                    img_indices[-1], len(img_indices)
+                )
+            ]
+        return [self._load_image(img_idx) for img_idx in img_indices]
+
+    def _to_normalized_tensor(self, images: List[Image.Image]) -> torch.Tensor:
+        first = np.asarray(images[0])
+        batch = np.empty((len(images), *first.shape), dtype=np.uint8)
+        for idx, image in enumerate(images):
+            batch[idx] = np.asarray(image)
+
+        # b x h x w x c -> b x c x h x w
+        batch = torch.from_numpy(batch).permute(0, 3, 1, 2).float().div_(255)
+        mean = torch.tensor(NORMALIZE_MEAN).view(1, -1, 1, 1)
+        std = torch.tensor(NORMALIZE_STD).view(1, -1, 1, 1)
+        batch.sub_(mean).div_(std)
+
+        if self.tensor_transform is not None:
+            batch = torch.stack([self.tensor_transform(image) for image in batch])
+        return batch
+
+    @staticmethod
+    def _to_raw_frames(images: List[Image.Image]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Stacks images of different sizes without resizing them.
+
+        Returns:
+            n x h x w x c uint8 tensor, where each image is zero padded to the biggest
+            height and width, and n x 4 int32 tensor with the box (x, y, w, h) of the
+            actual image in each frame.
+        """
+        arrays = [np.asarray(image) for image in images]
+        height = max(array.shape[0] for array in arrays)
+        width = max(array.shape[1] for array in arrays)
+
+        frames = np.zeros((len(arrays), height, width, arrays[0].shape[2]), np.uint8)
+        boxes = np.zeros((len(arrays), 4), dtype=np.int32)
+        for idx, array in enumerate(arrays):
+            frames[idx, : array.shape[0], : array.shape[1]] = array
+            boxes[idx, 2:] = array.shape[1], array.shape[0]
+        return torch.from_numpy(frames), torch.from_numpy(boxes)
+
+    def _load_audio(self, img_idx: int, audio_idx: int, target):
+        if self.audio_mode == AudioMode.FAKE_NOISE_DIFFERENT_VIDEO or (
+            self.audio_mode == AudioMode.MANIPULATION_METHOD_DIFFERENT_VIDEO
+            and target
+            == 4  # MANIPULATION_METHOD_DIFFERENT_VIDEO means we select different audio for manipulation vidoes
+        ):
+            aud_path, _ = self._samples[img_idx]
+        else:
+            aud_path, _ = self._samples[audio_idx]
+        aud = self.audio_file_list(aud_path, stacked=True)
+        aud: np.ndarray
+
+        # this adds gaussian noise to audio input if it's supposed to be fake input
+        if (
+            self.audio_mode == AudioMode.FAKE_NOISE_DIFFERENT_VIDEO
+            and audio_idx != img_idx
+        ) or (self.audio_mode == AudioMode.FAKE_NOISE and target != 4):
+            # not in-place, aud can be a view on the (memory-mapped) features
+            aud = aud + np.random.normal(0, 1, aud.shape).astype(aud.dtype)
+
+        # we have to do this because noisynets use the audio label for classification
+        if self.audio_mode == AudioMode.MANIPULATION_METHOD_DIFFERENT_VIDEO:
+            if target == 4:
+                audio_idx = img_idx
+            else:
+                audio_idx = -1  # this is nessecary for the case of wanting exact audio,
+                # but using audio targets for training not class targets
+
+        # this indicates if the audio and the images are in sync
+        return aud, (target, int(audio_idx == img_idx))
+
     def __len__(self):
         return len(self.samples_idx)
 
+    def _load_image(self, img_idx: int) -> Image.Image:
+        if self.frame_cache is None:
+            return self._decode_image(img_idx)
+
+        frame = self.frame_cache.get(img_idx)
+        if frame is None:
+            frame = np.asarray(self._decode_image(img_idx))
+            self.frame_cache.put(img_idx, frame)
+        return Image.fromarray(frame)
+
+    def _decode_image(self, img_idx: int) -> Image.Image:
+        if self.packed_frames is not None:
+            return Image.fromarray(self.packed_frames.load_frame(img_idx))
+        path, _ = self._samples[img_idx]
+        return default_loader(f"{self.root}/{path}")
+
+    def _crop_face(self, sample: Image.Image, align_idx: int) -> Image.Image:
+        if self.crop_boxes is not None:
+            x, y, w, h = self.crop_boxes[align_idx]
+            return sample.crop((x, y, x + w, y + h))
+        return self.align_face(sample, self.relative_bbs[align_idx])
+
     def align_face(self, sample, relative_bb):
         x, y, w, h = self.calculate_relative_bb(
             sample.width, sample.height, relative_bb
@@ -157,46 +325,27 @@ class FileListDataset(VisionDataset):
         # width, height = sample.size
         # return sample.crop((x * width, y * height, (x + w) * width, (y + h) * height))
 
-    # todo do this in advance
-    @staticmethod
-    def calculate_relative_bb(
-        total_width: int, total_height: int, relative_bb_values: List[int]
-    ):
-        x, y, w, h = relative_bb_values
-
-        size_bb = int(max(w, h) * 1.3)
-        center_x, center_y = x + int(0.5 * w), y + int(0.5 * h)
-
-        # Check for out of bounds, x-y lower left corner
-        x = max(int(center_x - size_bb // 2), 0)
-        y = max(int(center_y - size_bb // 2), 0)
-
-        # Check for too big size for given x, y
-        size_bb = min(total_width - x, size_bb)
-        size_bb = min(total_height - y, size_bb)
-
-        return x, y, size_bb, size_bb
+    # use FileList.precompute_crop_boxes to do this in advance
+    calculate_relative_bb = staticmethod(calculate_relative_bb)
 
     def _get_possible_audio_shifts_with_min_distance(
         self, idx, min_offset=16, audio_length=8
     ):
         frame_number_in_video, video_length = self._get_video_length_and_frame_idx(idx)
 
-        indices = np.array(
-            list(
-                range(
+        indices = np.concatenate(
+            (
+                np.arange(
                     audio_length - 1,
                     max(audio_length, frame_number_in_video - min_offset + 1),
-                )
-            )
-            + list(
-                range(
+                ),
+                np.arange(
                     min(
                         video_length - 1,
                         frame_number_in_video + min_offset + audio_length,
                     ),
                     video_length,
-                )
+                ),
             )
         )
         return indices - frame_number_in_video
@@ -205,37 +354,80 @@ class FileListDataset(VisionDataset):
         self, idx, max_distance=50, audio_length=8
     ):
         frame_number_in_video, video_length = self._get_video_length_and_frame_idx(idx)
-        indices = np.array(
-            list(
-                range(
+        indices = np.concatenate(
+            (
+                np.arange(
                     max(audio_length, frame_number_in_video - max_distance),
                     frame_number_in_video,
-                )
-            )
-            + list(
-                range(
+                ),
+                np.arange(
                     frame_number_in_video + 1,
                     min(frame_number_in_video + 1 + max_distance, video_length),
-                )
+                ),
             )
         )
         return indices - frame_number_in_video
 
+    def _sample_audio_shifts_with_min_distance(
+        self, idx: np.ndarray, random_state, min_offset=16, audio_length=8
+    ) -> np.ndarray:
+        """Vectorised np.random.choice of _get_possible_audio_shifts_with_min_distance."""
+        frame_number_in_video, video_length = self._get_video_length_and_frame_idx(idx)
+        indices = self._sample_from_two_ranges(
+            random_state,
+            (
+                audio_length - 1,
+                np.maximum(audio_length, frame_number_in_video - min_offset + 1),
+            ),
+            (
+                np.minimum(
+                    video_length - 1, frame_number_in_video + min_offset + audio_length
+                ),
+                video_length,
+            ),
+            default=frame_number_in_video,
+        )
+        return indices - frame_number_in_video
+
+    def _sample_audio_shifts_with_max_distance(
+        self, idx: np.ndarray, random_state, max_distance=50, audio_length=8
+    ) -> np.ndarray:
+        """Vectorised np.random.choice of _get_possible_audio_shifts_with_max_distance."""
+        frame_number_in_video, video_length = self._get_video_length_and_frame_idx(idx)
+        indices = self._sample_from_two_ranges(
+            random_state,
+            (
+                np.maximum(audio_length, frame_number_in_video - max_distance),
+                frame_number_in_video,
+            ),
+            (
+                frame_number_in_video + 1,
+                np.minimum(frame_number_in_video + 1 + max_distance, video_length),
+            ),
+            default=frame_number_in_video,
+        )
+        return indices - frame_number_in_video
+
+    @staticmethod
+    def _sample_from_two_ranges(random_state, first, second, default):
+        """Draws one value uniformly from the union of the ranges first and second.
+
+        All arguments are (start, end) tuples of arrays, i.e. one range per sample.
+        Where both ranges are empty, default is returned.
+        """
+        first_length = np.maximum(first[1] - first[0], 0)
+        second_length = np.maximum(second[1] - second[0], 0)
+        total_length = first_length + second_length
+
+        choice = (
+            random_state.random_sample(len(total_length)) * total_length
+        ).astype(np.int64)
+        indices = np.where(
+            choice < first_length,
+            first[0] + choice,
+            second[0] + choice - first_length,
+        )
+        return np.where(total_length > 0, indices, default)
+
     def _get_video_length_and_frame_idx(self, idx):
-        path, _ = self._samples[idx]
-        abs_path = Path(f"{self.root}/{path}")
-        frame_number_in_video = int(abs_path.with_suffix("").name)
-        video_length = len(sorted(abs_path.parent.glob("*" + abs_path.suffix)))
-
-        # frame_number_in_video = int(path.split("/")[-1].split(".")[0])
-        #
-        # video_path = "/".join(path.split("/")[:-1])
-        # try:
-        #     video_length = self.audio_table[video_path]
-        # except KeyError:
-        #     video_length = len(
-        #         list(filter(lambda x: video_path in x[0], self._samples))
-        #     )
-        #     self.audio_table[video_path] = video_length
-
-        return frame_number_in_video, video_length
+        return self.video_table.get_frame_number_and_video_length(idx)
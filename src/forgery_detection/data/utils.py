@@ -1,9 +1,12 @@
 from pathlib import Path
 from typing import List
+from typing import Tuple
+from typing import Union
 
 import numpy as np
 import torch
 from torchvision import transforms
+from torchvision.ops import roi_align
 
 
 def crop(size=299):
@@ -169,3 +172,76 @@ def select_frames(nb_images: int, samples_per_video: int) -> List[int]:
             np.linspace(1, nb_images, min(samples_per_video, nb_images)) - 1
         ).astype(int)
     return selected_frames
+
+
+def calculate_relative_bb(
+    total_width: int, total_height: int, relative_bb_values: List[int]
+):
+    x, y, w, h = relative_bb_values
+
+    size_bb = int(max(w, h) * 1.3)
+    center_x, center_y = x + int(0.5 * w), y + int(0.5 * h)
+
+    # Check for out of bounds, x-y lower left corner
+    x = max(int(center_x - size_bb // 2), 0)
+    y = max(int(center_y - size_bb // 2), 0)
+
+    # Check for too big size for given x, y
+    size_bb = min(total_width - x, size_bb)
+    size_bb = min(total_height - y, size_bb)
+
+    return x, y, size_bb, size_bb
+
+
+def calculate_crop_boxes(image_sizes: np.ndarray, relative_bbs: np.ndarray) -> np.ndarray:
+    """Vectorised version of calculate_relative_bb.
+
+    Args:
+        image_sizes: n x 2 array containing width and height of each image
+        relative_bbs: n x 4 array containing x, y, w, h of each face
+
+    Returns:
+        n x 4 int32 array with the clamped crop box (x, y, w, h) of each image.
+
+    """
+    relative_bbs = np.asarray(relative_bbs, dtype=np.float64).reshape(-1, 4)
+    image_sizes = np.asarray(image_sizes, dtype=np.int64).reshape(-1, 2)
+    x, y, w, h = relative_bbs.T
+
+    size_bb = (np.maximum(w, h) * 1.3).astype(np.int64)
+    center_x = x + (0.5 * w).astype(np.int64)
+    center_y = y + (0.5 * h).astype(np.int64)
+
+    # astype truncates like int() does
+    x = np.maximum((center_x - size_bb // 2).astype(np.int64), 0)
+    y = np.maximum((center_y - size_bb // 2).astype(np.int64), 0)
+
+    size_bb = np.minimum(image_sizes[:, 0] - x, size_bb)
+    size_bb = np.minimum(image_sizes[:, 1] - y, size_bb)
+
+    return np.stack((x, y, size_bb, size_bb), axis=1).astype(np.int32)
+
+
+def crop_and_resize(
+    images: torch.Tensor, crop_boxes: torch.Tensor, size: Union[int, Tuple[int, int]]
+) -> torch.Tensor:
+    """Crops a box out of each image and resizes all crops to size.
+
+    Args:
+        images: b x c x h x w
+        crop_boxes: b x 4 (x, y, w, h), as returned by calculate_crop_boxes
+        size: size x size or (h, w) of the resized crops
+
+    """
+    crop_boxes = crop_boxes.to(images.device, torch.float)
+    boxes = torch.cat(
+        (
+            torch.arange(len(images), device=images.device, dtype=torch.float)[:, None],
+            crop_boxes[:, :2],
+            crop_boxes[:, :2] + crop_boxes[:, 2:],
+        ),
+        dim=1,
+    )
+    if isinstance(size, int):
+        size = (size, size)
+    return roi_align(images, boxes, output_size=size)
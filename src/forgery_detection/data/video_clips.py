@@ -0,0 +1,156 @@
+import logging
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import cv2
+import dlib
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from forgery_detection.data.face_detection import get_boundingbox
+
+logger = logging.getLogger(__file__)
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov")
+
+
+def find_videos(folder) -> List[Path]:
+    return sorted(
+        path for path in Path(folder).iterdir() if path.suffix in VIDEO_EXTENSIONS
+    )
+
+
+def select_clip_starts(nb_frames: int, sequence_length: int, nb_clips: int):
+    """Evenly spread starts of nb_clips clips of sequence_length consecutive frames."""
+    if nb_frames < sequence_length:
+        return np.zeros(0, dtype=int)
+    return np.unique(
+        np.linspace(0, nb_frames - sequence_length, nb_clips).astype(int)
+    )
+
+
+def read_frames(video: Path, frame_numbers: List[int]) -> Dict[int, np.ndarray]:
+    """Decodes only the given frames, all others are skipped with grab().
+
+    Videos that report more frames than they have just return less frames.
+    """
+    wanted = set(frame_numbers)
+    last = max(wanted, default=-1)
+    frames = {}
+    capture = cv2.VideoCapture(str(video))
+    frame_num = 0
+    while capture.isOpened() and frame_num <= last:
+        if not capture.grab():
+            break
+        if frame_num in wanted:
+            success, frame = capture.retrieve()
+            if not success:
+                break
+            frames[frame_num] = frame
+        frame_num += 1
+    capture.release()
+    return frames
+
+
+class FaceTracker:
+    """Finds the face of a clip and keeps it while the clip is cropped.
+
+    The face is only detected on the first frame of each clip, the other frames are
+    cropped with the same box. If no face is found, the box of the previous clip is
+    used, clips before the first detected face are skipped.
+    """
+
+    def __init__(self, scale=1.3):
+        self.scale = scale
+        self._detector = None
+        self.box = None
+
+    def update(self, frame: np.ndarray) -> Optional[Tuple[int, int, int]]:
+        if self._detector is None:
+            # dlib objects can not be pickled, so each dataloader worker creates its own
+            self._detector = dlib.get_frontal_face_detector()
+        faces = self._detector(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), 1)
+        if len(faces):
+            face = max(faces, key=lambda rect: rect.area())
+            height, width, _ = frame.shape
+            self.box = get_boundingbox(face, width, height, scale=self.scale)
+        return self.box
+
+    def reset(self):
+        self.box = None
+
+
+class VideoClipDataset(Dataset):
+    """Face clips of raw videos, each item holds all clips of one video.
+
+    Decoding and face detection happen in __getitem__, so a DataLoader with workers
+    prepares the next videos while the model runs.
+
+    Args:
+        videos: paths of the video files
+        transform: applied to each cropped face (PIL image), has to return a tensor
+        sequence_length: number of consecutive frames of a clip
+        nb_clips: number of clips, evenly spread over each video
+
+    """
+
+    def __init__(self, videos: List[Path], transform, sequence_length=1, nb_clips=8):
+        self.videos = list(videos)
+        self.transform = transform
+        self.sequence_length = sequence_length
+        self.nb_clips = nb_clips
+        self.tracker = FaceTracker()
+
+    def __len__(self):
+        return len(self.videos)
+
+    def __getitem__(self, index) -> Tuple[torch.Tensor, int]:
+        """Returns nb_clips x sequence_length x c x h x w clips and index.
+
+        Videos without any face have 0 clips.
+        """
+        video = self.videos[index]
+        capture = cv2.VideoCapture(str(video))
+        nb_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+
+        starts = select_clip_starts(nb_frames, self.sequence_length, self.nb_clips)
+        frames = read_frames(
+            video,
+            [start + offset for start in starts for offset in range(self.sequence_length)],
+        )
+
+        self.tracker.reset()
+        clips = []
+        for start in starts:
+            clip_frames = [frames.get(start + i) for i in range(self.sequence_length)]
+            if any(frame is None for frame in clip_frames):
+                break
+            box = self.tracker.update(clip_frames[0])
+            if box is None:
+                continue
+            x, y, size = box
+            clips.append(
+                torch.stack(
+                    [
+                        self.transform(
+                            Image.fromarray(
+                                cv2.cvtColor(
+                                    frame[y : y + size, x : x + size], cv2.COLOR_BGR2RGB
+                                )
+                            )
+                        )
+                        for frame in clip_frames
+                    ]
+                )
+            )
+
+        if not clips:
+            logger.warning(f"Found no face in {video}.")
+            return torch.zeros(0), index
+        return torch.stack(clips), index
@@ -0,0 +1,215 @@
+import logging
+import multiprocessing as mp
+import os
+import subprocess
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Union
+
+import click
+import cv2
+import numpy as np
+from joblib import delayed
+from joblib import Parallel
+
+logger = logging.getLogger(__file__)
+
+METADATA_FILE = "video_metadata.npz"
+
+# dtype of each field, unknown values are 0 or -1 for face_frames
+FIELDS = {
+    "modified": np.int64,
+    "fps": np.float64,
+    "frame_count": np.int64,
+    "width": np.int64,
+    "height": np.int64,
+    "duration": np.float64,
+    "audio_sample_rate": np.int64,
+    "face_frames": np.int64,
+}
+
+
+def _probe_audio_sample_rate(video: Path, ffprobe: str) -> int:
+    try:
+        output = subprocess.check_output(
+            [
+                ffprobe,
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "stream=sample_rate",
+                "-of",
+                "csv=p=0",
+                str(video),
+            ],
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return 0
+    output = output.decode().strip()
+    return int(output) if output.isdigit() else 0
+
+
+def probe_video(video: Path, ffprobe="ffprobe") -> Dict[str, Union[int, float]]:
+    """Probes a video file or a folder of extracted (face) frames of a video.
+
+    The audio sample rate needs ffprobe, it is 0 if ffprobe is not available or the
+    video has no audio.
+    """
+    metadata = {field: 0 for field in FIELDS}
+    metadata["face_frames"] = -1
+    metadata["modified"] = video.stat().st_mtime_ns
+    if video.is_dir():
+        metadata["face_frames"] = len(list(video.glob("*.png")))
+        return metadata
+
+    capture = cv2.VideoCapture(str(video))
+    metadata["fps"] = capture.get(cv2.CAP_PROP_FPS)
+    metadata["frame_count"] = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    metadata["width"] = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    metadata["height"] = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    capture.release()
+    if metadata["fps"] > 0:
+        metadata["duration"] = metadata["frame_count"] / metadata["fps"]
+    metadata["audio_sample_rate"] = _probe_audio_sample_rate(video, ffprobe)
+    return metadata
+
+
+class VideoMetadataIndex:
+    """Metadata of the videos below root, probed once and cached in root.
+
+    Videos are identified by their path relative to root. They can be video files or
+    folders of extracted frames, for which only face_frames is known. A video is
+    probed again if it was modified.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.videos = []
+        self.columns = {
+            field: np.zeros(0, dtype=dtype) for field, dtype in FIELDS.items()
+        }
+        self._index = {}
+
+    @property
+    def path(self) -> Path:
+        return self.root / METADATA_FILE
+
+    @classmethod
+    def load(cls, root) -> "VideoMetadataIndex":
+        """Loads the cached index of root. If there is none, the index is empty."""
+        index = cls(root)
+        if not index.path.exists():
+            return index
+
+        data = np.load(index.path)
+        if set(FIELDS) - set(data.files):
+            logger.warning(f"{index.path} misses fields, all videos are probed again.")
+            return index
+        index.videos = data["videos"].tolist()
+        index.columns = {field: data[field] for field in FIELDS}
+        index._index = {video: idx for idx, video in enumerate(index.videos)}
+        return index
+
+    def save(self):
+        np.savez(self.path, videos=np.array(self.videos, dtype=str), **self.columns)
+
+    def _key(self, video: Path) -> str:
+        # symlinks are not followed, linked folders can point outside of root
+        relative = Path(os.path.abspath(video)).relative_to(os.path.abspath(self.root))
+        return relative.as_posix()
+
+    def _is_stale(self, video: Path) -> bool:
+        idx = self._index.get(self._key(video))
+        return (
+            idx is None or self.columns["modified"][idx] != video.stat().st_mtime_ns
+        )
+
+    def update(
+        self, videos: Iterable[Path], n_jobs=mp.cpu_count(), ffprobe="ffprobe"
+    ) -> int:
+        """Probes the videos that are new or changed in parallel.
+
+        Returns:
+            Number of probed videos.
+
+        """
+        videos = [Path(video) for video in videos]
+        stale = [video for video in videos if self._is_stale(video)]
+        if not stale:
+            return 0
+
+        metadata = Parallel(n_jobs=n_jobs)(
+            delayed(probe_video)(video, ffprobe) for video in stale
+        )
+        new_videos = {self._key(video) for video in stale} - set(self._index)
+        for key in sorted(new_videos):
+            self._index[key] = len(self.videos)
+            self.videos.append(key)
+        self.columns = {
+            field: np.concatenate((column, np.zeros(len(new_videos), column.dtype)))
+            for field, column in self.columns.items()
+        }
+
+        for video, video_metadata in zip(stale, metadata):
+            idx = self._index[self._key(video)]
+            for field in FIELDS:
+                self.columns[field][idx] = video_metadata[field]
+        logger.info(f"Probed {len(stale)} videos.")
+        return len(stale)
+
+    def get(self, video: Path) -> Dict[str, Union[int, float]]:
+        idx = self._index[self._key(video)]
+        return {field: self.columns[field][idx].item() for field in FIELDS}
+
+    def frame_count(self, video: Path) -> int:
+        return self.get(video)["frame_count"]
+
+    def face_frames(self, video: Path) -> int:
+        return self.get(video)["face_frames"]
+
+    def __contains__(self, video: Path) -> bool:
+        return self._key(video) in self._index
+
+    def __len__(self):
+        return len(self.videos)
+
+
+def get_video_metadata(
+    root, videos: Iterable[Path], n_jobs=mp.cpu_count(), ffprobe="ffprobe"
+) -> VideoMetadataIndex:
+    """Loads the index of root, probes new videos and saves it if it changed."""
+    index = VideoMetadataIndex.load(root)
+    if index.update(videos, n_jobs=n_jobs, ffprobe=ffprobe):
+        index.save()
+    return index
+
+
+@click.command()
+@click.option("--root", required=True, type=click.Path(exists=True))
+@click.option(
+    "--pattern",
+    "patterns",
+    multiple=True,
+    default=["**/*.mp4"],
+    help="Glob patterns relative to root, matching video files or frame folders.",
+)
+@click.option("--n_jobs", default=mp.cpu_count())
+@click.option("--ffprobe", default="ffprobe", help="ffprobe binary.")
+def build_video_metadata(root, patterns, n_jobs, ffprobe):
+    """Builds or updates the metadata index of root.
+
+    For example --pattern "*/*/*/videos/*.mp4" --pattern "*/*/*/face_images_tracked/*"
+    for FaceForensics++.
+    """
+    root = Path(root)
+    videos = sorted({video for pattern in patterns for video in root.glob(pattern)})
+    index = get_video_metadata(root, videos, n_jobs=n_jobs, ffprobe=ffprobe)
+    print(f"{len(index)} videos in {index.path}")
+
+
+if __name__ == "__main__":
+    build_video_metadata()
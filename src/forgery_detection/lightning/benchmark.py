@@ -2,10 +2,11 @@ import json
 from pathlib import Path
 
 import click
-import torch
 
+from forgery_detection.lightning.inference import PROBABILITY_STRATEGIES
 from forgery_detection.lightning.logging.const import SystemMode
 from forgery_detection.lightning.logging.utils import get_checkpoint
+from forgery_detection.lightning.logging.utils import get_device
 from forgery_detection.lightning.logging.utils import PythonLiteralOptionGPUs
 from forgery_detection.lightning.system import Supervised
 
@@ -27,9 +28,16 @@ from forgery_detection.lightning.system import Supervised
     "--benchmark_dir",
     required=True,
     type=click.Path(exists=True),
-    help="Folder containing images.",
+    help="Folder containing videos.",
 )
 @click.option("--gpus", cls=PythonLiteralOptionGPUs, default="[3]")
+@click.option("--nb_clips", default=8, help="Number of clips classified per video.")
+@click.option(
+    "--strategy",
+    type=click.Choice(PROBABILITY_STRATEGIES),
+    default="mean",
+    help="How the clips of a video are aggregated.",
+)
 def run_benchmark(*args, **kwargs):
     kwargs["mode"] = SystemMode.BENCHMARK
 
@@ -38,11 +46,17 @@ def run_benchmark(*args, **kwargs):
     model = Supervised.load_from_metrics(
         weights_path=get_checkpoint(checkpoint_folder),
         tags_csv=Path(kwargs["checkpoint_dir"]) / "meta_tags.csv",
+        overwrite_hparams={"mode": kwargs["mode"]},
     )
-    device = torch.device("cuda", kwargs["gpus"][0])
+    # works without gpus, i.e. with --gpus []
+    device = get_device(kwargs["gpus"])
 
     predictions_dict = model.benchmark(
-        benchmark_dir=kwargs["benchmark_dir"], device=device, threshold=0.05
+        benchmark_dir=kwargs["benchmark_dir"],
+        device=device,
+        threshold=0.05,
+        nb_clips=kwargs["nb_clips"],
+        strategy=kwargs["strategy"],
     )
     with open(checkpoint_folder / "submission.json", "w") as f:
         json.dump(predictions_dict, f)
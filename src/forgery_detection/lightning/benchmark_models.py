@@ -0,0 +1,339 @@
+import csv
+import json
+import multiprocessing as mp
+import resource
+import statistics
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from unittest import mock
+
+import click
+import torch
+
+from forgery_detection.lightning.system import Supervised
+
+# audio of each video frame, tried in order: 9 stacked mfcc features, the mfcc
+# features of the frame only and deep speech features
+AUDIO_SHAPES = [(9, 4, 13), (4, 13), (29,)]
+
+COLUMNS = [
+    "model",
+    "input",
+    "image_size",
+    "sequence_length",
+    "params",
+    "trainable_params",
+    "batch_size",
+    "forward_ms",
+    "forward_backward_ms",
+    "throughput",
+    "peak_memory_mb",
+    "error",
+]
+# metrics that are compared against the baseline, higher is worse for all of them
+COMPARED_METRICS = ["forward_ms", "forward_backward_ms", "peak_memory_mb"]
+
+
+def _empty_state_dict(*args, **kwargs):
+    return defaultdict(dict)
+
+
+@contextmanager
+def random_weights():
+    """Builds models without loading any pretrained weights or checkpoints.
+
+    Most constructors load weights, either downloaded by torchvision or from local
+    checkpoints. Their costs don't depend on the weights, so torch.load and all
+    load_state_dict_from_url functions return empty state dicts, which are ignored.
+    """
+    with ExitStack() as stack:
+        stack.enter_context(mock.patch("torch.load", _empty_state_dict))
+        stack.enter_context(
+            mock.patch.object(
+                torch.nn.Module, "load_state_dict", lambda *args, **kwargs: None
+            )
+        )
+        for module in list(sys.modules.values()):
+            if callable(getattr(module, "load_state_dict_from_url", None)):
+                stack.enter_context(
+                    mock.patch.object(
+                        module, "load_state_dict_from_url", _empty_state_dict
+                    )
+                )
+        yield
+
+
+def synthetic_input(
+    sequence_length: int,
+    batch_size: int,
+    image_size: int,
+    audio_shape: Optional[Tuple[int, ...]] = None,
+):
+    """Random input like the batches of FileListDataset, see get_sequence_collate_fn.
+
+    Video is b x c x h x w for sequence_length 1, otherwise b x t x c x h x w. If
+    audio_shape is given, the input is [video, b x t x audio_shape audio].
+    """
+    if sequence_length == 1:
+        video = torch.randn(batch_size, 3, image_size, image_size)
+    else:
+        video = torch.randn(batch_size, sequence_length, 3, image_size, image_size)
+    if audio_shape is None:
+        return video
+    return [video, torch.randn(batch_size, sequence_length, *audio_shape)]
+
+
+def _first_line(error: Exception) -> str:
+    return (str(error).splitlines() or [repr(error)])[0]
+
+
+def find_input(
+    model: torch.nn.Module, image_sizes: List[int]
+) -> Tuple[Optional[Tuple[int, ...]], int]:
+    """Returns the audio shape (None for video only) and image size model accepts.
+
+    The model is probed with a single sample, so audio models can not unpack a video
+    tensor by accident.
+    """
+    model.eval()
+    errors = []
+    for audio_shape in [None] + AUDIO_SHAPES:
+        for image_size in image_sizes:
+            x = synthetic_input(model.sequence_length, 1, image_size, audio_shape)
+            try:
+                with torch.no_grad():
+                    model.forward(x)
+                return audio_shape, image_size
+            except Exception as e:
+                errors.append(f"{audio_shape}, {image_size}: {_first_line(e)}")
+    raise ValueError("No synthetic input fits. " + " | ".join(errors))
+
+
+def _sum_outputs(pred) -> torch.Tensor:
+    """Differentiable scalar of all tensors in pred, which can be nested."""
+    if isinstance(pred, torch.Tensor):
+        return pred.float().sum()
+    if isinstance(pred, dict):
+        pred = pred.values()
+    return sum(
+        _sum_outputs(p)
+        for p in pred
+        if isinstance(p, (torch.Tensor, tuple, list, dict))
+        and (not isinstance(p, torch.Tensor) or p.requires_grad)
+    )
+
+
+def _median_time(fn, repeats: int, warmup: int) -> float:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def _max_rss_mb() -> float:
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_model(
+    name: str,
+    batch_sizes: List[int],
+    image_sizes: List[int],
+    num_classes: int,
+    repeats: int,
+    warmup: int,
+    threads: int = None,
+) -> List[Dict]:
+    """Latency, throughput and peak memory of one model for each batch size.
+
+    Should run in its own process, the peak memory is the increase of the maximum
+    resident set size of the process. The batch sizes are benchmarked in ascending
+    order, so each peak is the one of the biggest batch size so far.
+    """
+    baseline_rss = _max_rss_mb()
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    with random_weights():
+        model = Supervised.MODEL_DICT[name](num_classes=num_classes)
+    audio_shape, image_size = find_input(model, image_sizes)
+
+    info = {
+        "model": name,
+        "input": "video" if audio_shape is None else f"video+audio{audio_shape}",
+        "image_size": image_size,
+        "sequence_length": model.sequence_length,
+        "params": sum(p.numel() for p in model.parameters()),
+        "trainable_params": sum(
+            p.numel() for p in model.parameters() if p.requires_grad
+        ),
+    }
+
+    rows = []
+    for batch_size in sorted(batch_sizes):
+        row = {**info, "batch_size": batch_size}
+        x = synthetic_input(model.sequence_length, batch_size, image_size, audio_shape)
+        try:
+            model.eval()
+            with torch.no_grad():
+                forward = _median_time(lambda: model.forward(x), repeats, warmup)
+
+            model.train()
+
+            def forward_backward():
+                model.zero_grad()
+                loss = _sum_outputs(model.forward(x))
+                if not isinstance(loss, torch.Tensor):
+                    raise ValueError("The model has no differentiable output.")
+                loss.backward()
+
+            row["forward_ms"] = forward * 1000
+            row["throughput"] = batch_size / forward
+            row["forward_backward_ms"] = (
+                _median_time(forward_backward, repeats, warmup) * 1000
+            )
+        except Exception as e:
+            row["error"] = _first_line(e)
+        row["peak_memory_mb"] = _max_rss_mb() - baseline_rss
+        rows.append(row)
+    return rows
+
+
+def run_isolated(name: str, *args) -> List[Dict]:
+    """Runs benchmark_model in a new process. Errors are returned as rows."""
+    try:
+        with mp.get_context("fork").Pool(1) as pool:
+            return pool.apply(benchmark_model, (name, *args))
+    except Exception as e:
+        return [{"model": name, "error": _first_line(e)}]
+
+
+def compare_to_baseline(
+    rows: List[Dict], baseline: List[Dict], tolerance: float
+) -> List[Dict]:
+    """Adds the relative change of each compared metric and flags regressions."""
+    baseline = {(row["model"], row.get("batch_size")): row for row in baseline}
+    for row in rows:
+        old = baseline.get((row["model"], row.get("batch_size")))
+        if old is None:
+            continue
+        regressions = []
+        for metric in COMPARED_METRICS:
+            if row.get(metric) is None or not old.get(metric):
+                continue
+            change = row[metric] / old[metric] - 1
+            row[f"{metric}_change"] = change
+            if change > tolerance:
+                regressions.append(metric)
+        row["regressions"] = " ".join(regressions)
+    return rows
+
+
+def save_results(rows: List[Dict], output: Path):
+    """Saves rows as output.json and output.csv."""
+    with open(output.with_suffix(".json"), "w") as f:
+        json.dump(rows, f, indent=2)
+
+    columns = COLUMNS + sorted({key for row in rows for key in row} - set(COLUMNS))
+    with open(output.with_suffix(".csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@click.command()
+@click.option(
+    "--model",
+    "models",
+    multiple=True,
+    type=click.Choice(list(Supervised.MODEL_DICT)),
+    help="Models to benchmark. Can be given multiple times, default is all.",
+)
+@click.option("--batch_size", "batch_sizes", multiple=True, default=[1, 8])
+@click.option(
+    "--image_size",
+    "image_sizes",
+    multiple=True,
+    default=[112, 224],
+    help="Image sizes tried in order until one fits the model.",
+)
+@click.option("--num_classes", default=5)
+@click.option("--repeats", default=10)
+@click.option("--warmup", default=2)
+@click.option("--threads", default=None, type=int, help="torch cpu threads.")
+@click.option(
+    "--output",
+    required=True,
+    type=click.Path(),
+    help="Results are saved as <output>.json and <output>.csv.",
+)
+@click.option(
+    "--baseline",
+    default=None,
+    type=click.Path(exists=True),
+    help="json of a previous run the results are compared to.",
+)
+@click.option(
+    "--tolerance",
+    default=0.1,
+    help="Relative increase of a metric that counts as regression.",
+)
+def benchmark_models(
+    models,
+    batch_sizes,
+    image_sizes,
+    num_classes,
+    repeats,
+    warmup,
+    threads,
+    output,
+    baseline,
+    tolerance,
+):
+    """Costs of the models of Supervised.MODEL_DICT with random weights and inputs.
+
+    Everything runs on the cpu.
+    """
+    rows = []
+    for name in models or Supervised.MODEL_DICT:
+        model_rows = run_isolated(
+            name, batch_sizes, image_sizes, num_classes, repeats, warmup, threads
+        )
+        for row in model_rows:
+            if row.get("error"):
+                print(f"{name:<60}{row.get('batch_size', '-'):>5}  {row['error']}")
+            else:
+                print(
+                    f"{name:<60}{row['batch_size']:>5}{row['forward_ms']:>10.1f}ms"
+                    f"{row['forward_backward_ms']:>10.1f}ms"
+                    f"{row['peak_memory_mb']:>10.0f}MB"
+                )
+        rows += model_rows
+
+    if baseline:
+        with open(baseline) as f:
+            rows = compare_to_baseline(rows, json.load(f), tolerance)
+        for row in rows:
+            if row.get("regressions"):
+                print(
+                    f"Regression of {row['model']} ({row['batch_size']}): "
+                    f"{row['regressions']}"
+                )
+
+    save_results(rows, Path(output))
+
+
+if __name__ == "__main__":
+    benchmark_models()
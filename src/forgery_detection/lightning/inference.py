@@ -0,0 +1,126 @@
+import logging
+import time
+from pathlib import Path
+from typing import Dict
+from typing import List
+
+import torch
+from torch.nn import functional as F
+from torch.utils.data import DataLoader
+
+from forgery_detection.data.video_clips import VideoClipDataset
+from forgery_detection.lightning.logging.video_metrics import aggregate_videos
+from forgery_detection.lightning.logging.video_metrics import binary_probabilities
+from forgery_detection.lightning.logging.video_metrics import to_segments
+
+logger = logging.getLogger(__file__)
+
+# strategies of aggregate_videos whose scores are probabilities
+PROBABILITY_STRATEGIES = ("mean", "median", "top_k")
+
+
+class ClipBatcher:
+    """Collects the clips of consecutive videos into batches of batch_size clips."""
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._clips = []
+        self._videos = []
+        self._nb_clips = 0
+
+    def add(self, clips: torch.Tensor, video: int):
+        self._clips.append(clips)
+        self._videos.append(torch.full((len(clips),), video, dtype=torch.long))
+        self._nb_clips += len(clips)
+
+    def __iter__(self):
+        """Yields all full batches."""
+        while self._nb_clips >= self.batch_size:
+            yield self._pop(self.batch_size)
+
+    def pop_remaining(self):
+        return self._pop(self._nb_clips)
+
+    def _pop(self, size: int):
+        clips, videos = torch.cat(self._clips), torch.cat(self._videos)
+        self._clips, self._videos = [clips[size:]], [videos[size:]]
+        self._nb_clips -= size
+        return clips[:size], videos[:size]
+
+
+def predict_videos(
+    model: torch.nn.Module,
+    videos: List[Path],
+    transform,
+    sequence_length: int,
+    device: torch.device,
+    batch_size: int,
+    num_workers: int = 0,
+    nb_clips: int = 8,
+    strategy: str = "mean",
+    k: int = 5,
+) -> Dict[str, float]:
+    """Probability of each video to be fake.
+
+    The dataloader workers decode the videos and crop the faces while the model
+    classifies the clips of the previous videos. Videos without faces get 0.5.
+
+    Args:
+        model: returns logits for b x c x h x w (sequence_length 1) or
+            b x t x c x h x w inputs. The last class is real, all others are fake.
+        videos: video files
+        transform: applied to each cropped face, see set.get_transform
+        strategy: how the clip probabilities are aggregated, see aggregate_videos
+
+    """
+    if strategy not in PROBABILITY_STRATEGIES:
+        raise ValueError(f"strategy has to be one of {PROBABILITY_STRATEGIES}.")
+
+    loader = DataLoader(
+        VideoClipDataset(videos, transform, sequence_length, nb_clips),
+        batch_size=None,
+        num_workers=num_workers,
+    )
+    batcher = ClipBatcher(batch_size)
+    probabilities, clip_videos = [], []
+
+    def classify(clips, clip_videos_of_batch):
+        if sequence_length == 1:
+            clips = clips[:, 0]
+        pred = model.forward(clips.to(device))
+        if isinstance(pred, tuple):
+            pred = pred[0]
+        probabilities.append(F.softmax(pred, dim=1).cpu())
+        clip_videos.append(clip_videos_of_batch)
+
+    model.to(device)
+    model.eval()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for clips, video in loader:
+            if len(clips):
+                batcher.add(clips, video)
+            for batch in batcher:
+                classify(*batch)
+        clips, clip_videos_of_batch = batcher.pop_remaining()
+        if len(clips):
+            classify(clips, clip_videos_of_batch)
+    logger.info(
+        f"Classified {len(videos)} videos in {time.perf_counter() - start:.1f}s."
+    )
+
+    predictions = {video.name: 0.5 for video in videos}
+    if not probabilities:
+        return predictions
+
+    segments, video_ids = to_segments(torch.cat(clip_videos))
+    scores = aggregate_videos(
+        binary_probabilities(torch.cat(probabilities)),
+        segments,
+        len(video_ids),
+        strategy=strategy,
+        k=k,
+    )
+    for video, fake_probability in zip(video_ids, scores[:, 0].tolist()):
+        predictions[videos[video].name] = fake_probability
+    return predictions
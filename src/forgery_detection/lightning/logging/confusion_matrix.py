@@ -2,7 +2,8 @@ import itertools
 
 import numpy as np
 import torch
-from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 # https://www.tensorflow.org/tensorboard/image_summaries
 
@@ -11,18 +12,23 @@ def plot_cm(cm, class_names):
     """
   Returns a matplotlib figure containing the plotted confusion matrix.
 
+  The figure does not use pyplot, so it can be drawn outside of the main thread.
+
   Args:
     cm (array, shape = [n, n]): a confusion matrix of integer classes
     class_names (array, shape = [n]): String names of the integer classes
   """
-    plt.switch_backend("Agg")
-    figure = plt.figure(figsize=(8, 8))
-    plt.imshow(cm, interpolation="nearest", cmap=plt.cm.Blues)
-    plt.title("Confusion matrix")
-    plt.colorbar()
+    figure = Figure(figsize=(8, 8))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(1, 1, 1)
+    image = ax.imshow(cm, interpolation="nearest", cmap="Blues")
+    ax.set_title("Confusion matrix")
+    figure.colorbar(image)
     tick_marks = np.arange(len(class_names))
-    plt.xticks(tick_marks, class_names, rotation=45)
-    plt.yticks(tick_marks, class_names)
+    ax.set_xticks(tick_marks)
+    ax.set_xticklabels(list(class_names), rotation=45)
+    ax.set_yticks(tick_marks)
+    ax.set_yticklabels(list(class_names))
 
     # Normalize the confusion matrix.
     # cm = np.around(cm.astype("float") / cm.sum(axis=1)[:, np.newaxis], decimals=2)
@@ -33,7 +39,7 @@ def plot_cm(cm, class_names):
     for i, j in itertools.product(range(cm.shape[0]), range(cm.shape[1])):
         # first row always should be black
         color = "white" if i > 0 and cm[i, j] > threshold else "black"
-        plt.text(
+        ax.text(
             j,
             i,
             str(cm[i, j]).split("(")[1][:-1],
@@ -41,8 +47,8 @@ def plot_cm(cm, class_names):
             color=color,
         )
 
-    plt.ylabel("True label")
-    plt.xlabel("Predicted label")
+    ax.set_ylabel("True label")
+    ax.set_xlabel("Predicted label")
     return figure
 
 
@@ -64,17 +70,4 @@ def plot_to_image(fig):
     # return image
     # todo can we do it like the tf-example above?
     fig.canvas.draw()
-    image_from_plot = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-    image_from_plot = image_from_plot.reshape(
-        fig.canvas.get_width_height()[::-1] + (3,)
-    )
-    return image_from_plot
-
-
-def confusion_matrix(
-    target: torch.Tensor, pred: torch.Tensor, num_classes: int
-) -> torch.Tensor:
-    cm = torch.zeros(num_classes, num_classes)
-    for t, p in zip(target.view(-1), pred.view(-1)):
-        cm[t.long(), p.long()] += 1
-    return cm
+    return np.array(fig.canvas.buffer_rgba())[..., :3]
@@ -19,6 +19,14 @@ class AudioMode(str, Enum):
         return self.name
 
 
+class FrameLoader(str, Enum):
+    PNG = auto()
+    PACKED = auto()
+
+    def __str__(self):
+        return self.name
+
+
 NAN_TENSOR = torch.Tensor([float("NaN")])
 VAL_ACC = "val_acc"
 CHECKPOINTS = "checkpoints"
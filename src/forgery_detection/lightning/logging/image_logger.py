@@ -0,0 +1,83 @@
+import logging
+import threading
+from collections import deque
+from typing import Callable
+
+import numpy as np
+
+logger = logging.getLogger(__file__)
+
+
+class BackgroundImageLogger:
+    """Renders images in a background thread and adds them to tensorboard.
+
+    The caller only passes the raw data (confusion matrix, roc values) and the
+    function that draws it. At most max_pending images wait for rendering, if more
+    are logged the oldest ones are dropped, so logging never blocks training.
+
+    Args:
+        experiment: SummaryWriter the images are added to
+        max_pending: size of the queue
+
+    """
+
+    def __init__(self, experiment, max_pending: int = 8):
+        self.experiment = experiment
+        self.max_pending = max_pending
+        self.dropped = 0
+
+        self._pending = deque(maxlen=max_pending)
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log_image(
+        self, tag: str, render: Callable[..., np.ndarray], *args, global_step: int
+    ):
+        """Calls render(*args) in the background and adds the h x w x c result."""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BackgroundImageLogger is closed.")
+            if len(self._pending) == self.max_pending:
+                self.dropped += 1
+                logger.warning(
+                    f"Dropping {self._pending[0][0]} of step {self._pending[0][3]}, "
+                    f"rendering is too slow."
+                )
+            self._pending.append((tag, render, args, global_step))
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                tag, render, args, global_step = self._pending.popleft()
+                self._busy = True
+            try:
+                self.experiment.add_image(
+                    tag, render(*args), dataformats="HWC", global_step=global_step
+                )
+            except Exception:
+                logger.exception(f"Could not log {tag} of step {global_step}.")
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def flush(self):
+        """Blocks until all pending images are added."""
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def close(self):
+        """Adds the pending images and stops the thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
@@ -0,0 +1,178 @@
+import torch
+
+
+def confusion_matrix(
+    target: torch.Tensor, pred: torch.Tensor, num_classes: int
+) -> torch.Tensor:
+    """Returns num_classes x num_classes float matrix, rows are targets.
+
+    Both inputs contain class indices. The matrix is always on the cpu.
+    """
+    target = target.view(-1).to(pred.device, torch.long)
+    pred = pred.view(-1).long()
+    cm = torch.bincount(target * num_classes + pred, minlength=num_classes ** 2)
+    return cm.view(num_classes, num_classes).float().cpu()
+
+
+def per_class_mean(
+    values: torch.Tensor, target: torch.Tensor, num_classes: int
+) -> torch.Tensor:
+    """Mean of values for each class. Classes without samples are NaN."""
+    target = target.view(-1).to(values.device, torch.long)
+    sums = torch.zeros(num_classes, dtype=values.dtype, device=values.device)
+    sums.scatter_add_(0, target, values.view(-1))
+    counts = torch.bincount(target, minlength=num_classes).to(values.dtype)
+    return sums / counts
+
+
+def class_accuracies(cm: torch.Tensor) -> torch.Tensor:
+    return cm.diagonal() / cm.sum(dim=1)
+
+
+def binary_confusion_matrix(
+    cm: torch.Tensor, binary_predictions: bool = False
+) -> torch.Tensor:
+    """Collapses the predictions of cm to fake (0) and real (1).
+
+    The last class is real, all others are fake. If binary_predictions is set, the
+    model only predicts fake or real, i.e. only the first two columns of cm are used.
+
+    Returns:
+        num_classes x 2 matrix, rows are still the targets.
+    """
+    if binary_predictions:
+        return cm[:, :2]
+    return torch.stack((cm[:, :-1].sum(dim=1), cm[:, -1]), dim=1)
+
+
+def binary_class_accuracies(
+    cm: torch.Tensor, binary_predictions: bool = False
+) -> torch.Tensor:
+    """Accuracy of each class, if only fake vs. real is predicted."""
+    binary_cm = binary_confusion_matrix(cm, binary_predictions)
+    correct = torch.cat((binary_cm[:-1, 0], binary_cm[-1:, 1]))
+    return correct / binary_cm.sum(dim=1)
+
+
+def binary_accuracies(
+    cm: torch.Tensor, binary_predictions: bool = False
+) -> torch.Tensor:
+    """Accuracy of fake and real, with all fake classes merged into one."""
+    binary_cm = binary_confusion_matrix(cm, binary_predictions)
+    binary_cm = torch.stack((binary_cm[:-1].sum(dim=0), binary_cm[-1]))
+    return class_accuracies(binary_cm)
+
+
+class MetricAccumulator:
+    """Running metrics of a classifier, updated batch by batch.
+
+    Only the confusion matrix, the loss sum and histograms of the predicted
+    probabilities are kept, so the memory does not depend on the number of samples.
+    Everything stays on the device of the predictions until it is read.
+
+    Args:
+        num_classes: number of targets. Only the first num_classes columns of the
+            predictions are used for the confusion matrix.
+        nb_roc_bins: number of probability bins the roc curves are calculated from
+
+    """
+
+    def __init__(self, num_classes: int, nb_roc_bins: int = 1000):
+        self.num_classes = num_classes
+        self.nb_roc_bins = nb_roc_bins
+        self.reset()
+
+    def reset(self):
+        self._cm = None
+        self._loss_sum = None
+        # nb_pred_columns x nb_roc_bins histograms of the probability of each column
+        # for all samples and for the samples of the column's class
+        self._hist = None
+        self._pos_hist = None
+
+    def update(self, probabilities: torch.Tensor, target: torch.Tensor, loss=None):
+        """Adds a batch.
+
+        Args:
+            probabilities: b x c softmax of the predictions
+            target: b class indices
+            loss: mean loss of the batch
+
+        """
+        probabilities = probabilities.detach()
+        target = target.view(-1).to(probabilities.device, torch.long)
+        batch_size, nb_columns = probabilities.shape
+        if self._cm is None:
+            self._init_state(nb_columns, probabilities.device)
+
+        pred = torch.argmax(probabilities[:, : self.num_classes], dim=1)
+        self._cm += torch.bincount(
+            target * self.num_classes + pred, minlength=self.num_classes ** 2
+        )
+
+        if loss is not None:
+            self._loss_sum += loss.detach().float() * batch_size
+
+        bins = (probabilities * self.nb_roc_bins).long().clamp_(0, self.nb_roc_bins - 1)
+        column_offsets = torch.arange(nb_columns, device=bins.device) * self.nb_roc_bins
+        self._hist += torch.bincount(
+            (bins + column_offsets).view(-1), minlength=self._hist.numel()
+        ).view_as(self._hist)
+        has_column = target < nb_columns
+        target = target[has_column]
+        pos_bins = bins[has_column].gather(1, target.view(-1, 1)).view(-1)
+        self._pos_hist += torch.bincount(
+            target * self.nb_roc_bins + pos_bins, minlength=self._pos_hist.numel()
+        ).view_as(self._pos_hist)
+
+    def _init_state(self, nb_columns: int, device: torch.device):
+        self._cm = torch.zeros(self.num_classes ** 2, dtype=torch.long, device=device)
+        self._loss_sum = torch.zeros((), device=device)
+        self._hist = torch.zeros(
+            (nb_columns, self.nb_roc_bins), dtype=torch.long, device=device
+        )
+        self._pos_hist = torch.zeros_like(self._hist)
+
+    def __len__(self):
+        return 0 if self._cm is None else int(self._cm.sum())
+
+    @property
+    def confusion_matrix(self) -> torch.Tensor:
+        """Same as confusion_matrix of all targets and predictions so far."""
+        if self._cm is None:
+            return torch.zeros((self.num_classes, self.num_classes))
+        return self._cm.view(self.num_classes, self.num_classes).float().cpu()
+
+    @property
+    def class_counts(self) -> torch.Tensor:
+        return self.confusion_matrix.sum(dim=1).long()
+
+    @property
+    def loss_mean(self) -> torch.Tensor:
+        if self._loss_sum is None:
+            return torch.tensor(float("nan"))
+        return self._loss_sum.cpu() / len(self)
+
+    @property
+    def accuracy(self) -> torch.Tensor:
+        cm = self.confusion_matrix
+        return cm.diagonal().sum() / cm.sum()
+
+    def roc_curve(self, pos_label: int):
+        """fpr, tpr and thresholds like sklearn.metrics.roc_curve.
+
+        The thresholds are the lower edges of the probability bins, i.e. the curve
+        is exact up to 1 / nb_roc_bins.
+        """
+        # from the highest to the lowest threshold
+        pos = self._pos_hist[pos_label].flip(0).cpu()
+        neg = self._hist[pos_label].flip(0).cpu() - pos
+        tps = torch.cat((pos.new_zeros(1), pos.cumsum(0))).double()
+        fps = torch.cat((neg.new_zeros(1), neg.cumsum(0))).double()
+        thresholds = torch.arange(self.nb_roc_bins - 1, -1, -1).double()
+        thresholds = torch.cat((thresholds.new_ones(1), thresholds / self.nb_roc_bins))
+        return (
+            (fps / fps[-1]).numpy(),
+            (tps / tps[-1]).numpy(),
+            thresholds.numpy(),
+        )
@@ -0,0 +1,152 @@
+import json
+from pathlib import Path
+from typing import Dict
+from typing import List
+from typing import Union
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+def _chunk_name(column: str, idx: int) -> str:
+    return f"{column}_{idx:06d}.npy"
+
+
+def _merged_name(column: str) -> str:
+    return f"{column}.npy"
+
+
+class OutputWriter:
+    """Writes outputs of the test steps column by column into a folder.
+
+    Each append writes one .npy chunk per column. The manifest is updated every
+    manifest_interval appends, so an aborted run can still be read, except for the
+    appends after the last update. close() merges the chunks of each column into a
+    single <column>.npy, which OutputReader can memory-map.
+
+    Args:
+        folder: is created and must not exist yet
+        manifest_interval: number of appends between updates of the manifest
+
+    """
+
+    def __init__(self, folder: Union[str, Path], manifest_interval: int = 100):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True)
+        self.manifest_interval = manifest_interval
+        self._columns: Dict[str, dict] = {}
+        self._length = 0
+        self._nb_chunks = 0
+        self._merged = False
+
+    def append(self, **columns: np.ndarray):
+        """Appends rows. All columns need the same number of rows.
+
+        The first append defines the columns, later ones have to pass the same.
+        """
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) != 1:
+            raise ValueError(f"Columns have different lengths: {lengths}.")
+        if self._columns and columns.keys() != self._columns.keys():
+            raise ValueError(
+                f"Expected columns {sorted(self._columns)}, got {sorted(columns)}."
+            )
+
+        for name, values in columns.items():
+            values = np.ascontiguousarray(values)
+            column = self._columns.setdefault(
+                name, {"dtype": values.dtype.str, "shape": values.shape[1:]}
+            )
+            np.save(
+                self.folder / _chunk_name(name, self._nb_chunks),
+                values.astype(column["dtype"], copy=False),
+            )
+        self._length += lengths.pop()
+        self._nb_chunks += 1
+        if self._nb_chunks % self.manifest_interval == 0:
+            self._save_manifest()
+
+    def close(self):
+        """Merges the chunks of each column into one file."""
+        # the manifest has to list all chunks, until the merged files are complete
+        self._save_manifest()
+        for name, column in self._columns.items():
+            merged = np.lib.format.open_memmap(
+                self.folder / _merged_name(name),
+                mode="w+",
+                dtype=np.dtype(column["dtype"]),
+                shape=(self._length, *column["shape"]),
+            )
+            start = 0
+            for idx in range(self._nb_chunks):
+                values = np.load(self.folder / _chunk_name(name, idx), mmap_mode="r")
+                merged[start : start + len(values)] = values
+                start += len(values)
+            merged.flush()
+            del merged
+        self._merged = True
+        self._save_manifest()
+        for name in self._columns:
+            for idx in range(self._nb_chunks):
+                (self.folder / _chunk_name(name, idx)).unlink()
+
+    def _save_manifest(self):
+        # rename is atomic, so the manifest is either complete or the previous one
+        tmp_file = (self.folder / MANIFEST).with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(
+                {
+                    "length": self._length,
+                    "nb_chunks": self._nb_chunks,
+                    "merged": self._merged,
+                    "columns": self._columns,
+                },
+                f,
+            )
+        tmp_file.replace(self.folder / MANIFEST)
+
+    def __len__(self):
+        return self._length
+
+
+class OutputReader:
+    """Reads folders written by OutputWriter. Single columns can be memory-mapped."""
+
+    def __init__(self, folder: Union[str, Path]):
+        self.folder = Path(folder)
+        with open(self.folder / MANIFEST) as f:
+            manifest = json.load(f)
+        self._length = manifest["length"]
+        self._nb_chunks = manifest["nb_chunks"]
+        self._merged = manifest["merged"]
+        self._columns = manifest["columns"]
+
+    @staticmethod
+    def is_output_folder(path: Union[str, Path]) -> bool:
+        return (Path(path) / MANIFEST).exists()
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._columns)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Returns the column memory-mapped, if it was merged, otherwise loaded."""
+        if name not in self._columns:
+            raise KeyError(name)
+        if self._merged:
+            return np.load(self.folder / _merged_name(name), mmap_mode="r")
+        column = self._columns[name]
+        chunks = [
+            np.load(self.folder / _chunk_name(name, idx), mmap_mode="r")
+            for idx in range(self._nb_chunks)
+        ]
+        if not chunks:
+            return np.zeros((0, *column["shape"]), dtype=column["dtype"])
+        return np.concatenate(chunks)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._columns
+
+    def __len__(self):
+        return self._length
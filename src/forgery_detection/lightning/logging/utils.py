@@ -8,14 +8,17 @@ import shutil
 from argparse import Namespace
 from copy import deepcopy
 from pathlib import Path
+from typing import Callable
 from typing import Dict
+from typing import Optional
 from typing import TYPE_CHECKING
 from typing import Union
 
 import click
 import numpy as np
 import torch
-from matplotlib import pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from pytorch_lightning.callbacks import ModelCheckpoint
 from pytorch_lightning.logging import TestTubeLogger
 from sklearn import metrics
@@ -26,7 +29,6 @@ from torch.utils.tensorboard import SummaryWriter
 from torch.utils.tensorboard.summary import hparams
 from torchvision.utils import make_grid
 
-from forgery_detection.lightning.logging.confusion_matrix import confusion_matrix
 from forgery_detection.lightning.logging.confusion_matrix import plot_cm
 from forgery_detection.lightning.logging.confusion_matrix import plot_to_image
 from forgery_detection.lightning.logging.const import CHECKPOINTS
@@ -34,6 +36,9 @@ from forgery_detection.lightning.logging.const import NAN_TENSOR
 from forgery_detection.lightning.logging.const import RUNS
 from forgery_detection.lightning.logging.const import SystemMode
 from forgery_detection.lightning.logging.const import VAL_ACC
+from forgery_detection.lightning.logging.image_logger import BackgroundImageLogger
+from forgery_detection.lightning.logging.metrics import class_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
 
 if TYPE_CHECKING:
     from forgery_detection.data.set import FileListDataset
@@ -99,8 +104,47 @@ class DictHolder(dict):
         )
 
 
+def _add_image(
+    _logger,
+    image_logger: Optional[BackgroundImageLogger],
+    tag: str,
+    render: Callable[..., np.ndarray],
+    *args,
+    global_step: int,
+):
+    """Renders and adds the image in the background if image_logger is given."""
+    if image_logger is not None:
+        image_logger.log_image(tag, render, *args, global_step=global_step)
+    else:
+        _logger.experiment.add_image(
+            tag, render(*args), dataformats="HWC", global_step=global_step
+        )
+
+
+def render_confusion_matrix(cm: torch.tensor, class_names) -> np.ndarray:
+    return plot_to_image(plot_cm(cm, class_names=class_names))
+
+
 def log_confusion_matrix(
-    _logger, global_step, target: torch.tensor, pred: torch.tensor, class_to_idx
+    _logger,
+    global_step,
+    target: torch.tensor,
+    pred: torch.tensor,
+    class_to_idx,
+    image_logger: Optional[BackgroundImageLogger] = None,
+) -> Dict[str, torch.Tensor]:
+    cm = confusion_matrix(target, pred, num_classes=len(class_to_idx))
+    return log_confusion_matrix_from_cm(
+        _logger, global_step, cm, class_to_idx, image_logger=image_logger
+    )
+
+
+def log_confusion_matrix_from_cm(
+    _logger,
+    global_step,
+    cm: torch.tensor,
+    class_to_idx,
+    image_logger: Optional[BackgroundImageLogger] = None,
 ) -> Dict[str, torch.Tensor]:
     if len(class_to_idx) > 50:
         # assume that only the last 5 classes are relevant for logging
@@ -109,44 +153,60 @@ def log_confusion_matrix(
             x: class_to_idx[x] - disregarded_classes
             for x in list(class_to_idx.keys())[-5:]
         }
-    cm = confusion_matrix(target, pred, num_classes=len(class_to_idx))
-
-    figure = plot_cm(cm, class_names=class_to_idx.keys())
-
-    cm_image = plot_to_image(figure)
-
-    plt.close()
-    _logger.experiment.add_image(
-        "metrics/cm", cm_image, dataformats="HWC", global_step=global_step
+        cm = cm[-5:, -5:]
+
+    _add_image(
+        _logger,
+        image_logger,
+        "metrics/cm",
+        render_confusion_matrix,
+        cm,
+        list(class_to_idx.keys()),
+        global_step=global_step,
     )
 
     # use cm to calculate class accuracies
-    class_accuracies = cm.diagonal() / cm.sum(dim=1)
+    accuracies = class_accuracies(cm)
     class_accuracies_dict = {}
     for key, value in class_to_idx.items():
-        class_accuracies_dict[str(key)] = class_accuracies[value]
+        class_accuracies_dict[str(key)] = accuracies[value]
     return class_accuracies_dict
 
 
 def log_roc_graph(
-    logger, global_step, target: torch.tensor, pred: torch.tensor, pos_label
+    logger,
+    global_step,
+    target: torch.tensor,
+    pred: torch.tensor,
+    pos_label,
+    image_logger: Optional[BackgroundImageLogger] = None,
 ) -> float:
     fpr, tpr, thresholds = metrics.roc_curve(target, pred, pos_label=pos_label)
-    roc_auc = auc(fpr, tpr)
-    figure = plt.figure(figsize=(8, 8))
+    return log_roc_curve(
+        logger, global_step, fpr, tpr, thresholds, pos_label, image_logger=image_logger
+    )
+
+
+def render_roc_curve(
+    fpr: np.ndarray, tpr: np.ndarray, thresholds: np.ndarray, pos_label, roc_auc
+) -> np.ndarray:
+    # no pyplot, so it can be drawn outside of the main thread
+    figure = Figure(figsize=(8, 8))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(1, 1, 1)
     lw = 2
-    plt.plot(
+    ax.plot(
         fpr, tpr, color="darkorange", lw=lw, label="ROC curve (area = %0.2f)" % roc_auc
     )
-    plt.plot([0, 1], [0, 1], color="navy", lw=lw, linestyle="--")
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel("False Positive Rate")
-    plt.ylabel("True Positive Rate")
-    plt.title(f"Receiver operating characteristic curve for label {pos_label}")
-    plt.legend(loc="lower right")
-
-    ax2 = plt.gca().twinx()
+    ax.plot([0, 1], [0, 1], color="navy", lw=lw, linestyle="--")
+    ax.set_xlim([0.0, 1.0])
+    ax.set_ylim([0.0, 1.05])
+    ax.set_xlabel("False Positive Rate")
+    ax.set_ylabel("True Positive Rate")
+    ax.set_title(f"Receiver operating characteristic curve for label {pos_label}")
+    ax.legend(loc="lower right")
+
+    ax2 = ax.twinx()
     ax2.plot(fpr, thresholds, markeredgecolor="r", linestyle="dashed", color="r")
     ax2.set_ylabel("Threshold", color="r")
     ax2.set_ylim([thresholds[-1], thresholds[0]])
@@ -155,10 +215,30 @@ def log_roc_graph(
     except ValueError:
         del ax2
 
-    cm_image = plot_to_image(figure)
-    plt.close()
-    logger.experiment.add_image(
-        "metrics/roc", cm_image, dataformats="HWC", global_step=global_step
+    return plot_to_image(figure)
+
+
+def log_roc_curve(
+    logger,
+    global_step,
+    fpr: np.ndarray,
+    tpr: np.ndarray,
+    thresholds,
+    pos_label,
+    image_logger: Optional[BackgroundImageLogger] = None,
+) -> float:
+    roc_auc = auc(fpr, tpr)
+    _add_image(
+        logger,
+        image_logger,
+        "metrics/roc",
+        render_roc_curve,
+        fpr,
+        tpr,
+        thresholds,
+        pos_label,
+        roc_auc,
+        global_step=global_step,
     )
     return roc_auc
 
@@ -340,6 +420,13 @@ class PythonLiteralOptionGPUs(click.Option):
             raise click.BadParameter(value)
 
 
+def get_device(gpus) -> torch.device:
+    """First gpu of PythonLiteralOptionGPUs or the cpu if there is none."""
+    if gpus and torch.cuda.is_available():
+        return torch.device("cuda", gpus[0])
+    return torch.device("cpu")
+
+
 def get_logger_and_checkpoint_callback(
     log_dir, mode: SystemMode, debug, logger_info=None
 ):
@@ -0,0 +1,427 @@
+import logging
+from typing import Dict
+from typing import Tuple
+
+import numpy as np
+import torch
+from sklearn.metrics import roc_auc_score
+
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import binary_class_accuracies
+from forgery_detection.lightning.logging.metrics import class_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
+
+logger = logging.getLogger(__file__)
+
+# probabilities are clamped to this before taking the log
+EPS = 1e-6
+
+
+def to_segments(video_idx) -> Tuple[torch.Tensor, np.ndarray]:
+    """Maps arbitrary video ids to 0..nb_videos-1.
+
+    The clips of all videos are aggregated at once with segment reductions, segments
+    holds the video of each clip.
+
+    Returns:
+        segments: segment of each clip
+        video_ids: video id of each segment
+
+    """
+    video_ids, segments = np.unique(np.asarray(video_idx), return_inverse=True)
+    return torch.from_numpy(segments.reshape(-1)).long(), video_ids
+
+
+def segment_sum(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int
+) -> torch.Tensor:
+    sums = values.new_zeros((nb_segments, *values.shape[1:]))
+    return sums.index_add_(0, segments.to(values.device), values)
+
+
+def segment_counts(segments: torch.Tensor, nb_segments: int) -> torch.Tensor:
+    return torch.bincount(segments, minlength=nb_segments)
+
+
+def segment_mean(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int
+) -> torch.Tensor:
+    counts = segment_counts(segments, nb_segments).to(values)
+    return segment_sum(values, segments, nb_segments) / counts.view(
+        -1, *([1] * (values.dim() - 1))
+    )
+
+
+def _sort_within_segments(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int, descending: bool
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Sorts each column of the n x c values by segment and by value in a segment.
+
+    Returns:
+        sorted values, segment of each row and the position of each row in its segment
+
+    """
+    n = len(values)
+    # the rank makes the keys unique, so an unstable sort is enough
+    rank = values.argsort(dim=0, descending=descending).argsort(dim=0)
+    order = (segments.view(-1, 1) * n + rank).argsort(dim=0)
+    sorted_segments = segments.sort()[0]
+    counts = segment_counts(segments, nb_segments)
+    starts = counts.cumsum(0) - counts
+    position = torch.arange(n, device=segments.device) - starts[sorted_segments]
+    return values.gather(0, order), sorted_segments, position
+
+
+def segment_median(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int
+) -> torch.Tensor:
+    """Lower median of each segment, like torch.median, for each column."""
+    sorted_values, sorted_segments, position = _sort_within_segments(
+        values, segments, nb_segments, descending=False
+    )
+    counts = segment_counts(segments, nb_segments)
+    is_median = position == ((counts - 1) // 2)[sorted_segments]
+    medians = values.new_zeros((nb_segments, values.shape[1]))
+    medians[sorted_segments[is_median]] = sorted_values[is_median]
+    return medians
+
+
+def segment_top_k_mean(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int, k: int
+) -> torch.Tensor:
+    """Mean of the k biggest values of each segment, for each column."""
+    sorted_values, sorted_segments, position = _sort_within_segments(
+        values, segments, nb_segments, descending=True
+    )
+    in_top_k = (position < k).view(-1, 1).to(values)
+    sums = segment_sum(sorted_values * in_top_k, sorted_segments, nb_segments)
+    counts = segment_counts(segments, nb_segments).clamp(max=k).to(values)
+    return sums / counts.view(-1, 1)
+
+
+def log_odds(probabilities: torch.Tensor) -> torch.Tensor:
+    probabilities = probabilities.clamp(EPS, 1 - EPS)
+    return torch.log(probabilities) - torch.log1p(-probabilities)
+
+
+def binary_probabilities(probabilities: torch.Tensor) -> torch.Tensor:
+    """Collapses the probabilities of all fake classes, the last class is real."""
+    if probabilities.shape[1] == 2:
+        return probabilities
+    return torch.stack(
+        (probabilities[:, :-1].sum(dim=1), probabilities[:, -1]), dim=1
+    )
+
+
+def _mean(probabilities, segments, nb_segments, k):
+    return segment_mean(probabilities, segments, nb_segments)
+
+
+def _median(probabilities, segments, nb_segments, k):
+    return segment_median(probabilities, segments, nb_segments)
+
+
+def _top_k(probabilities, segments, nb_segments, k):
+    return segment_top_k_mean(probabilities, segments, nb_segments, k)
+
+
+def _log_odds(probabilities, segments, nb_segments, k):
+    return segment_sum(log_odds(probabilities), segments, nb_segments)
+
+
+def _majority(probabilities, segments, nb_segments, k):
+    votes = torch.zeros_like(probabilities).scatter_(
+        1, probabilities.argmax(dim=1, keepdim=True), 1.0
+    )
+    return segment_mean(votes, segments, nb_segments)
+
+
+STRATEGIES = {
+    "mean": _mean,
+    "median": _median,
+    "top_k": _top_k,
+    "log_odds": _log_odds,
+    "majority": _majority,
+}
+
+
+def aggregate_videos(
+    probabilities: torch.Tensor,
+    segments: torch.Tensor,
+    nb_segments: int,
+    strategy: str = "mean",
+    k: int = 5,
+) -> torch.Tensor:
+    """Returns nb_segments x c scores, the argmax of a row is the video prediction.
+
+    Args:
+        probabilities: n x c softmax of the clip predictions
+        segments: video of each clip, see to_segments
+        nb_segments: number of videos
+        strategy: mean, median or top_k of the probabilities, sum of the log-odds or
+            the fraction of votes of the clips
+        k: only used by top_k
+
+    """
+    try:
+        reduce = STRATEGIES[strategy]
+    except KeyError:
+        raise ValueError(
+            f"Unknown strategy {strategy}, choose one of {list(STRATEGIES)}."
+        )
+    return reduce(probabilities.float(), segments, nb_segments, k)
+
+
+def video_targets(
+    targets: torch.Tensor, segments: torch.Tensor, nb_segments: int
+) -> torch.Tensor:
+    """Target of each video. If the clips of a video disagree, the majority wins."""
+    targets = targets.long()
+    one_hot = torch.zeros(len(targets), int(targets.max()) + 1).scatter_(
+        1, targets.view(-1, 1), 1.0
+    )
+    votes = segment_sum(one_hot, segments, nb_segments)
+    if ((votes > 0).sum(dim=1) > 1).any():
+        logger.warning("Some videos contain clips with different targets.")
+    return votes.argmax(dim=1)
+
+
+def evaluate_videos(
+    logits: torch.Tensor,
+    targets: torch.Tensor,
+    video_idx,
+    strategy: str = "mean",
+    k: int = 5,
+    binary: bool = False,
+) -> Dict[str, object]:
+    """Video level accuracy, class accuracies and auc.
+
+    Like in the evaluation mixins, the accuracy is the mean of the class accuracies.
+    Only classes with videos count, their class accuracy is NaN.
+    For binary the targets are the five classes, the first four are fake and the
+    last one is real. The auc is always the one of real vs. fake.
+
+    Args:
+        logits: n x c predictions of the clips
+        targets: n class indices
+        video_idx: n video ids, e.g. the video_idx column of the test outputs or
+            VideoTable.video_idx[sample_idx]
+
+    """
+    segments, video_ids = to_segments(video_idx)
+    nb_videos = len(video_ids)
+    probabilities = torch.softmax(logits.float(), dim=1)
+    label = video_targets(targets, segments, nb_videos)
+
+    binary_scores = aggregate_videos(
+        binary_probabilities(probabilities), segments, nb_videos, strategy, k
+    )
+    is_real = (label // 4).numpy()
+    try:
+        auc = roc_auc_score(is_real, binary_scores[:, 1].numpy())
+    except ValueError:
+        # only real or only fake videos
+        auc = float("nan")
+
+    if binary:
+        pred = binary_scores.argmax(dim=1)
+        cm = confusion_matrix(label, pred, num_classes=5)
+        class_accs = binary_class_accuracies(cm, binary_predictions=True)
+        class_counts = cm.sum(dim=1)
+        has_videos = torch.stack((class_counts[:-1].sum(), class_counts[-1])) > 0
+        acc = binary_accuracies(cm, binary_predictions=True)[has_videos].mean()
+    else:
+        scores = aggregate_videos(probabilities, segments, nb_videos, strategy, k)
+        pred = scores.argmax(dim=1)
+        cm = confusion_matrix(label, pred, num_classes=scores.shape[1])
+        class_accs = class_accuracies(cm)
+        acc = class_accs[cm.sum(dim=1) > 0].mean()
+
+    return {
+        "acc": float(acc),
+        "class_acc": class_accs.numpy(),
+        "auc": auc,
+        "nb_videos": nb_videos,
+    }
+
+
+def _single_segment(n: int) -> Tuple[torch.Tensor, int]:
+    return torch.zeros(n, dtype=torch.long), 1
+
+
+def _pad_segments(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int, pad: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Zero pads each segment by pad rows on both sides.
+
+    The segments have to be consecutive.
+
+    Returns:
+        the padded values and the position of each row in them
+
+    """
+    n = len(values)
+    segments = segments.to(values.device)
+    positions = torch.arange(n, device=values.device) + pad * (2 * segments + 1)
+    padded = values.new_zeros((n + 2 * pad * nb_segments, *values.shape[1:]))
+    padded[positions] = values
+    return padded, positions
+
+
+def _segment_windows(
+    values: torch.Tensor, segments: torch.Tensor, nb_segments: int, pad: int
+) -> torch.Tensor:
+    """Window of size 2 * pad + 1 around each of the n values, as n x (2 * pad + 1).
+
+    The windows at the borders of a segment contain zeros instead of the values of
+    the neighbouring segments.
+    """
+    padded, positions = _pad_segments(values, segments, nb_segments, pad)
+    return padded.unfold(0, 2 * pad + 1, 1)[positions - pad]
+
+
+def calc_pdist(
+    feat1: torch.Tensor,
+    feat2: torch.Tensor,
+    vshift: int = 15,
+    segments: torch.Tensor = None,
+    nb_segments: int = None,
+) -> torch.Tensor:
+    """Distance of each video feature to the audio features shifted by -vshift..vshift.
+
+    Same as syncnet's calc_pdist: the audio is zero padded at the borders of each
+    video and the distances are the ones of F.pairwise_distance, i.e. of
+    x - y + eps. The squared distances are expanded, so the dot products of all
+    frames and shifts are one bmm with a strided view of the padded audio.
+
+    Args:
+        feat1: n x d video features
+        feat2: n x d audio features
+        vshift: maximal shift
+        segments: video of each frame, if the features of multiple videos are given.
+            The frames of a video have to be consecutive.
+        nb_segments: number of videos
+
+    Returns:
+        n x (2 * vshift + 1) distances
+
+    """
+    if segments is None:
+        segments, nb_segments = _single_segment(len(feat1))
+    eps = 1e-6
+    win_size = 2 * vshift + 1
+
+    feat2p, positions = _pad_segments(feat2, segments, nb_segments, vshift)
+    # the video features at the center of each window of the padded audio
+    feat1p = torch.zeros_like(feat2p)
+    feat1p[positions] = feat1
+    windows = feat2p.unfold(0, win_size, 1)
+    dots = torch.bmm(
+        feat1p[vshift : vshift + len(windows)].unsqueeze(1), windows
+    ).squeeze(1)
+
+    starts = positions - vshift
+    feat1_terms = (feat1 * (feat1 + 2 * eps)).sum(dim=1) + feat1.shape[1] * eps ** 2
+    feat2_terms = (feat2p * (feat2p - 2 * eps)).sum(dim=1).unfold(0, win_size, 1)
+    squared = feat1_terms.view(-1, 1) + feat2_terms[starts] - 2 * dots[starts]
+    return squared.clamp(min=0).sqrt()
+
+
+def segment_median_filter(
+    values: torch.Tensor,
+    segments: torch.Tensor,
+    nb_segments: int,
+    kernel_size: int = 9,
+) -> torch.Tensor:
+    """Same as scipy.signal.medfilt applied to the values of each segment."""
+    windows = _segment_windows(values, segments, nb_segments, kernel_size // 2)
+    return torch.median(windows, dim=1)[0]
+
+
+def sync_offsets(
+    dists: torch.Tensor, segments: torch.Tensor, nb_segments: int, vshift: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Audio-video offset of each video, like syncnet does it.
+
+    Args:
+        dists: n x (2 * vshift + 1) distance of each frame to the audio of each shift
+        segments: video of each frame
+        nb_segments: number of videos
+        vshift: maximal shift
+
+    Returns:
+        offset, confidence and the mean distance of each shift of each video
+
+    """
+    mdists = segment_mean(dists, segments, nb_segments)
+    minval, minidx = torch.min(mdists, dim=1)
+    offsets = vshift - minidx
+    confs = torch.median(mdists, dim=1)[0] - minval
+    return offsets, confs, mdists
+
+
+def offset_statistics(offsets: torch.Tensor, confs: torch.Tensor) -> Dict[str, float]:
+    offsets = offsets.float()
+    return {
+        "mean_offset": float(offsets.mean()),
+        "median_offset": float(offsets.median()),
+        "mean_abs_offset": float(offsets.abs().mean()),
+        "in_sync": float((offsets == 0).float().mean()),
+        "mean_conf": float(confs.mean()),
+        "median_conf": float(confs.median()),
+    }
+
+
+def framewise_confidence(
+    dists: torch.Tensor,
+    offsets: torch.Tensor,
+    mdists: torch.Tensor,
+    segments: torch.Tensor,
+    nb_segments: int,
+    vshift: int,
+    kernel_size: int = 9,
+) -> torch.Tensor:
+    """Median filtered confidence of each frame at the offset of its video."""
+    segments = segments.to(dists.device)
+    minidx = (vshift - offsets)[segments]
+    fdist = dists.gather(1, minidx.view(-1, 1)).view(-1)
+    fconf = torch.median(mdists, dim=1)[0][segments] - fdist
+    return segment_median_filter(fconf, segments, nb_segments, kernel_size)
+
+
+def evaluate_sync(
+    video_features: torch.Tensor,
+    audio_features: torch.Tensor,
+    vshift: int = 15,
+    segments: torch.Tensor = None,
+    nb_segments: int = None,
+    kernel_size: int = 9,
+) -> Dict[str, torch.Tensor]:
+    """Offset, confidence and framewise confidence of one or multiple videos.
+
+    Args:
+        video_features: n x d
+        audio_features: n x d
+        segments: video of each frame, the frames of a video have to be consecutive
+        nb_segments: number of videos
+
+    Returns:
+        dict with offsets, confs, framewise_confs, dists and mdists
+
+    """
+    if segments is None:
+        segments, nb_segments = _single_segment(len(video_features))
+    dists = calc_pdist(
+        video_features, audio_features, vshift, segments, nb_segments
+    )
+    offsets, confs, mdists = sync_offsets(dists, segments, nb_segments, vshift)
+    framewise_confs = framewise_confidence(
+        dists, offsets, mdists, segments, nb_segments, vshift, kernel_size
+    )
+    return {
+        "offsets": offsets,
+        "confs": confs,
+        "framewise_confs": framewise_confs,
+        "dists": dists,
+        "mdists": mdists,
+    }
@@ -1,20 +1,27 @@
 import logging
 import pickle
 from pathlib import Path
+from typing import List
+from typing import Tuple
 
 import click
 import matplotlib.pyplot as plt
 import numpy as np
 import torch
-from scipy import signal
 from torch.utils.data import SequentialSampler
 
+from forgery_detection.data.face_forensics.splits import TEST_NAME
 from forgery_detection.data.file_lists import FileList
 from forgery_detection.data.file_lists import SimpleFileList
 from forgery_detection.data.loading import get_fixed_dataloader
 from forgery_detection.lightning.logging.const import AudioMode
+from forgery_detection.lightning.logging.output_store import OutputReader
+from forgery_detection.lightning.logging.utils import get_device
 from forgery_detection.lightning.logging.utils import get_logger_dir
 from forgery_detection.lightning.logging.utils import PythonLiteralOptionGPUs
+from forgery_detection.lightning.logging.video_metrics import evaluate_sync
+from forgery_detection.lightning.logging.video_metrics import offset_statistics
+from forgery_detection.lightning.logging.video_metrics import to_segments
 from forgery_detection.lightning.utils import get_model_and_trainer
 
 logger = logging.getLogger(__file__)
@@ -44,21 +51,117 @@ def run_inference_for_video(audio_mode, folder, model, trainer):
     trainer.test(model)
 
 
-def calc_pdist(feat1, feat2, vshift=15):
-    win_size = vshift * 2 + 1
+def load_evaluation_folders(
+    folders: List[Path]
+) -> Tuple[FileList, SimpleFileList, np.ndarray]:
+    """Concatenates the test splits of all evaluation folders into one file list.
 
-    feat2p = torch.nn.functional.pad(feat2, (0, 0, vshift, vshift))
+    All folders have to share the root, the classes and the audio file list.
 
-    dists = []
+    Returns:
+        file_list: test split contains the samples of all folders in order
+        audio_file_list: audio of all folders, loaded only once
+        folder_of_sample: index into folders of each test sample
 
-    for i in range(0, len(feat1)):
-        dists.append(
-            torch.nn.functional.pairwise_distance(
-                feat1[[i], :].repeat(win_size, 1), feat2p[i : i + win_size, :]
+    """
+    image_file_lists = [FileList.load(str(f / "image_file_list.json")) for f in folders]
+    audio_file_lists = [
+        SimpleFileList.load(f / "audio_file_list.json", load_features=False)
+        for f in folders
+    ]
+
+    first = image_file_lists[0]
+    file_list = FileList(first.root, first.classes, first.min_sequence_length)
+    folder_of_sample = []
+    for folder_idx, (folder, f) in enumerate(zip(folders, image_file_lists)):
+        if f.root != first.root or f.classes != first.classes:
+            raise ValueError(
+                f"{folder} has a different root or different classes than {folders[0]}."
             )
+        samples = list(f.samples[TEST_NAME])
+        offset = len(file_list.samples[TEST_NAME])
+        file_list.samples[TEST_NAME] += samples
+        file_list.samples_idx[TEST_NAME] += (
+            np.asarray(f.samples_idx[TEST_NAME], dtype=np.int64) + offset
+        ).tolist()
+        file_list.relative_bbs[TEST_NAME] += np.asarray(
+            f.relative_bbs.get(TEST_NAME, [])
+        ).tolist()
+        folder_of_sample += [folder_idx] * len(samples)
+        file_list.min_sequence_length = min(
+            file_list.min_sequence_length, f.min_sequence_length
         )
+    file_list.build_video_tables()
+
+    first_audio = audio_file_lists[0].__dict__
+    for folder, audio_file_list in zip(folders, audio_file_lists):
+        if audio_file_list.__dict__ != first_audio:
+            raise ValueError(
+                f"{folder} has a different audio file list than {folders[0]}, "
+                f"use --per_video."
+            )
+    audio_file_list = SimpleFileList.load(folders[0] / "audio_file_list.json")
+
+    return file_list, audio_file_list, np.asarray(folder_of_sample)
+
+
+def run_inference(model, dataset, device) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Video and audio embeddings of all samples that fit into full batches."""
+    loader = get_fixed_dataloader(
+        dataset,
+        model.hparams["batch_size"],
+        sampler=SequentialSampler,
+        num_workers=model.hparams["n_cpu"],
+        worker_init_fn=lambda worker_id: np.random.seed(worker_id),
+        prefetch_depth=2,
+        device=device,
+    )
+    model.to(device)
+    model.eval()
+
+    video_embeddings, audio_embeddings = [], []
+    with torch.no_grad():
+        for x, _ in loader:
+            x = [tensor.to(device) for tensor in x]
+            video, audio = model.forward(x)
+            video_embeddings.append(video)
+            audio_embeddings.append(audio)
+    return torch.cat(video_embeddings), torch.cat(audio_embeddings)
+
 
-    return dists
+def log_video_sync(name: str, sync: dict, vshift: int, img_folder: Path) -> dict:
+    """Prints the results of one video and saves the plots of its distances."""
+    offset, conf, mdist = sync["offsets"], sync["confs"], sync["mdists"]
+    minval = mdist[vshift - offset]
+    fconfm = sync["framewise_confs"].cpu().numpy()
+
+    np.set_printoptions(formatter={"float": "{: 0.3f}".format})
+    print("Framewise conf: ")
+    print(fconfm)
+    print(
+        "AV offset: \t%d \nMin dist: \t%.3f\nConfidence: \t%.3f"
+        % (offset, minval, conf)
+    )
+
+    dists_npy = sync["dists"].cpu().numpy()
+    plt.clf()
+    plt.imshow(dists_npy)
+    plt.savefig(img_folder / f"dists_{name}.png")
+    plt.clf()
+    plt.plot(mdist.cpu())
+    plt.savefig(img_folder / f"conf_{name}.png")
+    return {"offset": offset.cpu(), "conf": conf.cpu(), "dists": dists_npy}
+
+
+def _select_video(sync: dict, segment: int, frames) -> dict:
+    """Results of evaluate_sync of one segment, frames selects its rows."""
+    return {
+        "offsets": sync["offsets"][segment],
+        "confs": sync["confs"][segment],
+        "mdists": sync["mdists"][segment],
+        "dists": sync["dists"][frames],
+        "framewise_confs": sync["framewise_confs"][frames],
+    }
 
 
 @click.command()
@@ -89,8 +192,13 @@ def calc_pdist(feat1, feat2, vshift=15):
 )
 @click.option("--vshift", type=int, default=15, help="Folder used for logging.")
 @click.option("--gpus", cls=PythonLiteralOptionGPUs, default="[0]")
+@click.option(
+    "--per_video",
+    is_flag=True,
+    help="Run trainer.test for each video folder instead of one pass over all.",
+)
 @click.option("--debug", is_flag=True)
-def run_syncnet_evaluation(vshift, *args, **kwargs):
+def run_syncnet_evaluation(vshift, per_video, *args, **kwargs):
 
     model, trainer = get_model_and_trainer(**kwargs)
 
@@ -99,51 +207,51 @@ def run_syncnet_evaluation(vshift, *args, **kwargs):
     img_folder = get_logger_dir(model.logger) / "images"
     img_folder.mkdir()
 
+    folders = sorted(Path(kwargs["evaluation_folder"]).iterdir())
     evaluation_metrics = {}
 
-    for video in Path(kwargs["evaluation_folder"]).iterdir():
-        run_inference_for_video(audio_mode, video, model, trainer)
+    if per_video:
+        for video in folders:
+            run_inference_for_video(audio_mode, video, model, trainer)
 
-        with open(get_logger_dir(model.logger) / "outputs.pkl", "rb") as f:
-            outputs = pickle.load(f)
-            video_logits = torch.cat([x["pred"][0] for x in outputs], 0)
-            audio_logtis = torch.cat([x["pred"][1] for x in outputs], 0)
+            outputs = OutputReader(model.test_outputs_folder)
+            video_logits = torch.from_numpy(np.array(outputs["pred"]))
+            audio_logtis = torch.from_numpy(np.array(outputs["pred_1"]))
 
-            dists = calc_pdist(video_logits, audio_logtis, vshift=vshift)
-            mdist = torch.mean(torch.stack(dists, 1), 1)
-
-            minval, minidx = torch.min(mdist, 0)
-
-            offset = vshift - minidx
-            conf = torch.median(mdist) - minval
+            sync = evaluate_sync(video_logits, audio_logtis, vshift=vshift)
+            evaluation_metrics[video.name] = log_video_sync(
+                video.name, _select_video(sync, 0, slice(None)), vshift, img_folder
+            )
+    else:
+        file_list, audio_file_list, folder_of_sample = load_evaluation_folders(folders)
+        dataset = file_list.get_dataset(
+            TEST_NAME,
+            image_transforms=model.resize_transform,
+            tensor_transforms=model.tensor_augmentation_transforms,
+            sequence_length=model.model.sequence_length,
+            audio_file_list=audio_file_list,
+            audio_mode=audio_mode,
+        )
+        video_embeddings, audio_embeddings = run_inference(
+            model, dataset, get_device(kwargs["gpus"])
+        )
 
-            fdist = np.stack([dist[minidx].cpu().numpy() for dist in dists])
-            # fdist   = numpy.pad(fdist, (3,3), 'constant', constant_values=15)
-            fconf = torch.median(mdist).cpu().numpy() - fdist
-            fconfm = signal.medfilt(fconf, kernel_size=9)
+        # outputs are in the order of samples_idx, the last incomplete batch is
+        # dropped
+        samples_idx = np.asarray(dataset.samples_idx)[: len(video_embeddings)]
+        segments, folder_ids = to_segments(folder_of_sample[samples_idx])
+        sync = evaluate_sync(
+            video_embeddings, audio_embeddings, vshift, segments, len(folder_ids)
+        )
+        segments = segments.to(sync["dists"].device)
 
-            np.set_printoptions(formatter={"float": "{: 0.3f}".format})
-            print("Framewise conf: ")
-            print(fconfm)
-            print(
-                "AV offset: \t%d \nMin dist: \t%.3f\nConfidence: \t%.3f"
-                % (offset, minval, conf)
+        for segment, folder_idx in enumerate(folder_ids):
+            is_video = segments == segment
+            name = folders[folder_idx].name
+            evaluation_metrics[name] = log_video_sync(
+                name, _select_video(sync, segment, is_video), vshift, img_folder
             )
 
-            dists_npy = np.array([dist.cpu().numpy() for dist in dists])
-            plt.clf()
-            plt.imshow(dists_npy)
-            plt.savefig(img_folder / ("dists_" + (video.with_suffix(".png").name)))
-            plt.clf()
-            plt.plot(mdist.cpu())
-            plt.savefig(img_folder / ("conf_" + (video.with_suffix(".png").name)))
-            # return offset.numpy(), conf.numpy(), dists_npy
-            evaluation_metrics[video.name] = {
-                "offset": offset.cpu(),
-                "conf": conf.cpu(),
-                "dists": dists_npy,
-            }
-
     with open(get_logger_dir(model.logger) / "evaluation_metrics.pkl", "wb") as f:
         pickle.dump(evaluation_metrics, f)
 
@@ -151,6 +259,7 @@ def run_syncnet_evaluation(vshift, *args, **kwargs):
     mean_offset = torch.stack([x["offset"] for x in evaluation_metrics.values()])
 
     logger.warning(f"Mean conf: {mean_conf}. Mean offset: {mean_offset}")
+    logger.warning(f"Offset statistics: {offset_statistics(mean_offset, mean_conf)}")
 
 
 if __name__ == "__main__":
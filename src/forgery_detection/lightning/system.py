@@ -1,7 +1,9 @@
 import logging
 from argparse import Namespace
+from datetime import datetime
 from functools import partial
 from typing import Dict
+from typing import Optional
 from typing import Union
 
 import numpy as np
@@ -13,14 +15,25 @@ from torch.utils.data.sampler import RandomSampler
 from torch.utils.data.sampler import SequentialSampler
 from torchvision import transforms
 
+from forgery_detection.data.batch_transforms import BatchCenterCrop
+from forgery_detection.data.batch_transforms import BatchColorJitter
+from forgery_detection.data.batch_transforms import BatchRandomErasing
+from forgery_detection.data.batch_transforms import BatchRandomGrayscale
+from forgery_detection.data.batch_transforms import BatchRandomHorizontalFlip
+from forgery_detection.data.batch_transforms import BatchRandomResizedCrop
+from forgery_detection.data.batch_transforms import BatchRandomRotation
+from forgery_detection.data.batch_transforms import BatchResize
+from forgery_detection.data.batch_transforms import get_batch_transform
 from forgery_detection.data.face_forensics.splits import TEST_NAME
 from forgery_detection.data.face_forensics.splits import TRAIN_NAME
 from forgery_detection.data.face_forensics.splits import VAL_NAME
 from forgery_detection.data.file_lists import FileList
 from forgery_detection.data.file_lists import SimpleFileList
 from forgery_detection.data.loading import BalancedSampler
+from forgery_detection.data.loading import BatchPrefetcher
 from forgery_detection.data.loading import calculate_class_weights
 from forgery_detection.data.loading import get_fixed_dataloader
+from forgery_detection.data.set import get_transform
 from forgery_detection.data.utils import colour_jitter
 from forgery_detection.data.utils import crop
 from forgery_detection.data.utils import random_erasing
@@ -35,12 +48,21 @@ from forgery_detection.data.utils import random_rotation_greyscale
 from forgery_detection.data.utils import resized_crop
 from forgery_detection.data.utils import resized_crop_flip
 from forgery_detection.data.utils import rfft_transform
+from forgery_detection.data.video_clips import find_videos
+from forgery_detection.lightning.inference import predict_videos
 from forgery_detection.lightning.logging.const import AudioMode
+from forgery_detection.lightning.logging.const import FrameLoader
 from forgery_detection.lightning.logging.const import SystemMode
+from forgery_detection.lightning.logging.image_logger import BackgroundImageLogger
+from forgery_detection.lightning.logging.metrics import MetricAccumulator
+from forgery_detection.lightning.logging.output_store import OutputWriter
 from forgery_detection.lightning.logging.utils import DictHolder
+from forgery_detection.lightning.logging.utils import get_logger_dir
 from forgery_detection.lightning.logging.utils import log_confusion_matrix
+from forgery_detection.lightning.logging.utils import log_confusion_matrix_from_cm
 from forgery_detection.lightning.logging.utils import log_dataset_preview
 from forgery_detection.lightning.logging.utils import log_hparams
+from forgery_detection.lightning.logging.utils import log_roc_curve
 from forgery_detection.lightning.logging.utils import log_roc_graph
 from forgery_detection.models.audio.audionet import AudioNet
 from forgery_detection.models.audio.audionet import AudioNetFrozen
@@ -398,16 +420,56 @@ class Supervised(pl.LightningModule):
         "rfft": rfft_transform(),
         "imagenet_val": [transforms.Resize(256), transforms.CenterCrop(224)],
     }
+    # used instead of CUSTOM_TRANSFORMS with batch_transforms, rfft is not supported
+    BATCH_TRANSFORMS = {
+        "none": [],
+        "crop": [BatchCenterCrop(299)],
+        "resized_crop": [BatchResize(299), BatchCenterCrop(299)],
+        "resized_crop_small": [BatchResize(224), BatchCenterCrop(224)],
+        "resized_crop_128": [BatchResize(128), BatchCenterCrop(128)],
+        "resized_crop_112": [BatchResize(112), BatchCenterCrop(112)],
+        "resized_crop_56": [BatchResize(56), BatchCenterCrop(56)],
+        "resized_crop_28": [BatchResize(28), BatchCenterCrop(28)],
+        "resized_crop_14": [BatchResize(14), BatchCenterCrop(14)],
+        "resized_crop_7": [BatchResize(7), BatchCenterCrop(7)],
+        "resized_crop_flip": [
+            BatchResize(299),
+            BatchCenterCrop(299),
+            BatchRandomHorizontalFlip(),
+        ],
+        "random_resized_crop": [BatchRandomResizedCrop(112, scale=(0.75, 1.0))],
+        "random_horizontal_flip": [BatchRandomHorizontalFlip()],
+        "colour_jitter": [BatchColorJitter()],
+        "random_rotation": [BatchRandomRotation(15, p=0.1)],
+        "random_greyscale": [BatchRandomGrayscale()],
+        "random_erasing": [BatchRandomErasing(scale=(0.02, 0.11))],
+        "random_flip_rotation": [
+            BatchRandomHorizontalFlip(),
+            BatchRandomRotation(15),
+        ],
+        "random_flip_greyscale": [
+            BatchRandomHorizontalFlip(),
+            BatchRandomGrayscale(),
+        ],
+        "random_rotation_greyscale": [BatchRandomRotation(15), BatchRandomGrayscale()],
+        "random_flip_rotation_greyscale": [
+            BatchRandomHorizontalFlip(),
+            BatchRandomRotation(15),
+            BatchRandomGrayscale(),
+        ],
+        "imagenet_val": [BatchResize(256), BatchCenterCrop(224)],
+    }
     OPTIMIZER = {"adam": optim.Adam, "sgd": partial(optim.SGD, momentum=0.9)}
 
-    def _get_transforms(self, transforms: str):
+    def _get_transforms(self, transforms: str, transform_dict: Dict = None):
+        transform_dict = transform_dict or self.CUSTOM_TRANSFORMS
         if " " not in transforms:
-            return self.CUSTOM_TRANSFORMS[transforms]
+            return transform_dict[transforms]
 
         transform_list = transforms.split(" ")
         transforms = []
         for transform in transform_list:
-            transforms.extend(self.CUSTOM_TRANSFORMS[transform])
+            transforms.extend(transform_dict[transform])
         return transforms
 
     def __init__(self, kwargs: Union[dict, Namespace]):
@@ -453,6 +515,18 @@ class Supervised(pl.LightningModule):
             self.audio_file_list = None
 
         self.audio_mode = AudioMode[self.hparams["audio_mode"]]
+        # older runs were trained before the frame_loader option existed
+        self.frame_loader = FrameLoader[
+            self.hparams.get("frame_loader", FrameLoader.PNG.name)
+        ]
+        self.batched_loading = self.hparams.get("batched_loading", False)
+        # in GB, for the train and val set each
+        frame_cache_size = int(self.hparams.get("frame_cache_size", 0) * 2 ** 30)
+        self.batch_transforms = self.hparams.get("batch_transforms", False)
+        self.train_batch_transform = None
+        self.val_batch_transform = None
+        if self.batch_transforms:
+            self._init_batch_transforms()
 
         self.train_data = self.file_list.get_dataset(
             TRAIN_NAME,
@@ -462,6 +536,9 @@ class Supervised(pl.LightningModule):
             audio_file_list=self.audio_file_list,
             audio_mode=self.audio_mode,
             should_align_faces=self.hparams["crop_faces"],
+            frame_loader=self.frame_loader,
+            raw_frames=self.batch_transforms,
+            frame_cache_size=frame_cache_size,
         )
         self.val_data = self.file_list.get_dataset(
             VAL_NAME,
@@ -471,6 +548,9 @@ class Supervised(pl.LightningModule):
             audio_file_list=self.audio_file_list,
             audio_mode=self.audio_mode,
             should_align_faces=self.hparams["crop_faces"],
+            frame_loader=self.frame_loader,
+            raw_frames=self.batch_transforms,
+            frame_cache_size=frame_cache_size,
         )
         # handle empty test_data better
         self.test_data = self.file_list.get_dataset(
@@ -481,6 +561,8 @@ class Supervised(pl.LightningModule):
             audio_file_list=self.audio_file_list,
             audio_mode=self.audio_mode,
             should_align_faces=self.hparams["crop_faces"],
+            frame_loader=self.frame_loader,
+            raw_frames=self.batch_transforms,
         )
         self.hparams.add_dataset_size(len(self.train_data), TRAIN_NAME)
         self.hparams.add_dataset_size(len(self.val_data), VAL_NAME)
@@ -513,9 +595,59 @@ class Supervised(pl.LightningModule):
         self.acc = -1
         self.loss = -1
 
+        # set when the dataloaders are created
+        self._train_loader = None
+        self._val_loader = None
+
+        # updated in validation_step and test_step, reset at the end of each epoch
+        self.epoch_metrics = MetricAccumulator(len(self.file_list.class_to_idx))
+
+        # test outputs are written in test_step, the folder of the last test run is
+        # kept for evaluation scripts
+        self._test_output_writer = None
+        self._test_samples_idx = None
+        self._test_video_idx = None
+        self.test_outputs_folder = None
+
+        self._image_logger = None
+
         logger.warning(f"{self.train_data.class_to_idx}")
         self._optimizer = None
 
+    def _init_batch_transforms(self):
+        if not self.batched_loading:
+            raise ValueError("batch_transforms only work with batched_loading.")
+        resize_transform = self._get_transforms(
+            self.hparams["resize_transforms"], self.BATCH_TRANSFORMS
+        )
+        tensor_augmentation_transforms = self._get_transforms(
+            self.hparams["tensor_augmentation_transforms"], self.BATCH_TRANSFORMS
+        )
+        self.train_batch_transform = get_batch_transform(
+            resize_transform
+            + self._get_transforms(
+                self.hparams["image_augmentation_transforms"], self.BATCH_TRANSFORMS
+            ),
+            tensor_augmentation_transforms,
+            self.model.sequence_length,
+        )
+        self.val_batch_transform = get_batch_transform(
+            resize_transform,
+            tensor_augmentation_transforms,
+            self.model.sequence_length,
+        )
+
+    def _transform_batch(self, batch, batch_transform):
+        """Applies the batch transform to the raw frames loaded by the dataloader."""
+        if batch_transform is None:
+            return batch
+        x, target = batch
+        if self.audio_file_list is not None:
+            (frames, boxes), aud = x
+            return [batch_transform(frames, boxes), aud], target
+        frames, boxes = x
+        return batch_transform(frames, boxes), target
+
     def on_sanity_check_start(self):
         log_hparams(
             hparam_dict=self.hparams.to_dict(),
@@ -536,16 +668,33 @@ class Supervised(pl.LightningModule):
         return self.model.forward(x)
 
     def training_step(self, batch, batch_nb):
+        batch = self._transform_batch(batch, self.train_batch_transform)
         tensorboard_log, lightning_log = self.model.training_step(batch, batch_nb, self)
-        return self._construct_lightning_log(
-            tensorboard_log, lightning_log, suffix="train"
+        return self._add_data_loading_log(
+            self._construct_lightning_log(
+                tensorboard_log, lightning_log, suffix="train"
+            ),
+            self.train_data,
+            self._train_loader,
+            suffix="train",
         )
 
-    def validation_step(self, batch, batch_nb, dataloader_id=-1):
+    def _forward_batch(self, batch):
         # x, target = batch
         # batch = x, (target - 1) % 5
+        batch = self._transform_batch(batch, self.val_batch_transform)
         x, target = batch
-        pred = self.forward(x)
+        return self.forward(x), target
+
+    def validation_step(self, batch, batch_nb, dataloader_id=-1):
+        pred, target = self._forward_batch(batch)
+
+        if self.model.streams_metrics:
+            # only the first dataloader is evaluated, the outputs are not needed
+            if dataloader_id <= 0:
+                with torch.no_grad():
+                    self.model.update_metrics(self.epoch_metrics, pred, target)
+            return {}
 
         return {
             "pred": pred,
@@ -571,22 +720,72 @@ class Supervised(pl.LightningModule):
 
     def validation_epoch_end(self, outputs):
         tensorboard_log, lightning_log = self.model.aggregate_outputs(outputs, self)
+        self.epoch_metrics.reset()
 
         # self._log_metrics_for_hparams(tensorboard_log)
 
-        return self._construct_lightning_log(
-            tensorboard_log, lightning_log, suffix="val"
+        return self._add_data_loading_log(
+            self._construct_lightning_log(tensorboard_log, lightning_log, suffix="val"),
+            self.val_data,
+            self._val_loader,
+            suffix="val",
         )
 
     def test_step(self, batch, batch_nb):
         with torch.no_grad():
-            val_out = self.validation_step(batch, batch_nb)
-            # for key, value in val_out.items():
-            #     val_out[key] = value.cpu()
-            return val_out
+            pred, target = self._forward_batch(batch)
+            self.model.update_test_metrics(self.epoch_metrics, pred, target)
+            self._write_test_outputs(pred, target)
+            return {}
+
+    def _init_test_output_writer(self):
+        self.test_outputs_folder = get_logger_dir(self.logger) / (
+            f"outputs_{datetime.now().strftime('%Y-%m-%d_%H:%M:%S.%f')}"
+        )
+        self._test_output_writer = OutputWriter(self.test_outputs_folder)
+
+        # the test dataloader samples sequentially, so the position of an output is
+        # its index in samples_idx
+        loader = self.test_dataloader()
+        if isinstance(loader, list):
+            loader = loader[0]
+        self._test_samples_idx = np.asarray(loader.dataset.samples_idx)
+        self._test_video_idx = loader.dataset.video_table.video_idx
+
+    def _write_test_outputs(self, pred, target):
+        """Appends logits, targets, audio sync flags, sample and video indices."""
+        if self._test_output_writer is None:
+            self._init_test_output_writer()
+
+        preds = pred if isinstance(pred, tuple) else (pred,)
+        columns = {"pred": preds[0].cpu().numpy()}
+        for i, additional_pred in enumerate(preds[1:], start=1):
+            columns[f"pred_{i}"] = additional_pred.cpu().numpy()
+
+        # with audio the targets are stacked with the audio sync flags
+        if isinstance(target, list):
+            target = torch.stack(target)
+        if target.dim() > 1:
+            target, audio_sync = target
+            columns["audio_sync"] = audio_sync.cpu().numpy()
+        columns["target"] = target.cpu().numpy()
+
+        start = len(self._test_output_writer)
+        position = np.arange(start, start + len(target))
+        columns["sample_idx"] = self._test_samples_idx[position]
+        columns["video_idx"] = self._test_video_idx[columns["sample_idx"]]
+
+        self._test_output_writer.append(**columns)
 
     def test_epoch_end(self, outputs):
-        return self.model.test_epoch_end(outputs, self)
+        if self._test_output_writer is not None:
+            self._test_output_writer.close()
+            self._test_output_writer = None
+        test_log = self.model.test_epoch_end(outputs, self)
+        self.epoch_metrics.reset()
+        if self._image_logger is not None:
+            self._image_logger.flush()
+        return test_log
 
     def configure_optimizers(self):
         if self._optimizer:
@@ -611,12 +810,17 @@ class Supervised(pl.LightningModule):
         else:
             sampler = partial(self.sampler_cls, predefined_weights=self.sampling_probs)
 
-        return get_fixed_dataloader(
+        self._train_loader = get_fixed_dataloader(
             self.train_data,
             self.hparams["batch_size"],
             sampler=sampler,
             num_workers=self.hparams["n_cpu"],
+            batched_loading=self.batched_loading,
+            seed=self.hparams.get("seed"),
+            prefetch_depth=self.hparams.get("prefetch_depth", 0),
+            device=self._get_prefetch_device(),
         )
+        return self._train_loader
 
     @pl.data_loader
     def val_dataloader(self):
@@ -646,14 +850,19 @@ class Supervised(pl.LightningModule):
             sampler = self.sampler_cls
         else:
             sampler = partial(self.sampler_cls, predefined_weights=self.sampling_probs)
+        self._val_loader = get_fixed_dataloader(
+            self.val_data,
+            self.hparams["batch_size"],
+            sampler=sampler,
+            num_workers=self.hparams["n_cpu"],
+            worker_init_fn=lambda worker_id: np.random.seed(worker_id),
+            batched_loading=self.batched_loading,
+            seed=self.hparams.get("seed"),
+            prefetch_depth=self.hparams.get("prefetch_depth", 0),
+            device=self._get_prefetch_device(),
+        )
         return [
-            get_fixed_dataloader(
-                self.val_data,
-                self.hparams["batch_size"],
-                sampler=sampler,
-                num_workers=self.hparams["n_cpu"],
-                worker_init_fn=lambda worker_id: np.random.seed(worker_id),
-            ),
+            self._val_loader,
             # use static batch for autoencoders
             # get_fixed_dataloader(
             #     self.test_data,
@@ -675,9 +884,12 @@ class Supervised(pl.LightningModule):
             tensor_transforms=self.tensor_augmentation_transforms,
             sequence_length=self.model.sequence_length,
             audio_file_list=self.hparams["audio_file"],
+            frame_loader=self.frame_loader,
+            raw_frames=self.batch_transforms,
         )
         # static_batch_idx = static_batch_data.samples_idx[:: len(static_batch_data) // 3]
-        static_batch_idx = static_batch_data.samples_idx[::1]
+        # binary file lists have numpy arrays as samples_idx
+        static_batch_idx = list(static_batch_data.samples_idx[::1])
         # this is a really shitty hack but needed for compatibility
         # if len(static_batch_data) is divisable by 3 the resulting length is only 3
         if len(static_batch_idx) == 3:
@@ -691,6 +903,7 @@ class Supervised(pl.LightningModule):
             sampler=SequentialSampler,  # use sequence sampler
             num_workers=self.hparams["n_cpu"],
             worker_init_fn=lambda worker_id: np.random.seed(worker_id),
+            batched_loading=self.batch_transforms,
         )
         return static_batch_loader
         loader = get_fixed_dataloader(
@@ -702,6 +915,38 @@ class Supervised(pl.LightningModule):
         )
         return loader
 
+    def benchmark(
+        self,
+        benchmark_dir,
+        device: torch.device,
+        threshold=0.05,
+        nb_clips=8,
+        strategy="mean",
+    ) -> Dict[str, float]:
+        """Probability of each video in benchmark_dir to be fake.
+
+        The faces are detected and cropped from the raw videos, see predict_videos.
+        The probabilities are clipped to [threshold, 1 - threshold].
+        """
+        if self.audio_file_list is not None:
+            raise ValueError("Benchmarking models with audio is not supported.")
+
+        predictions = predict_videos(
+            self,
+            find_videos(benchmark_dir),
+            get_transform(self.resize_transform, self.tensor_augmentation_transforms),
+            self.model.sequence_length,
+            device,
+            self.hparams["batch_size"],
+            num_workers=self.hparams["n_cpu"],
+            nb_clips=nb_clips,
+            strategy=strategy,
+        )
+        return {
+            video: min(max(probability, threshold), 1 - threshold)
+            for video, probability in predictions.items()
+        }
+
     def log_confusion_matrix(self, target: torch.Tensor, pred: torch.Tensor):
         return log_confusion_matrix(
             self.logger,
@@ -709,6 +954,7 @@ class Supervised(pl.LightningModule):
             target,
             torch.argmax(pred[:, : self.model.num_classes], dim=1),
             self.file_list.class_to_idx,
+            image_logger=self.image_logger,
         )
 
     def log_roc_graph(self, target: torch.Tensor, pred: torch.Tensor):
@@ -719,8 +965,44 @@ class Supervised(pl.LightningModule):
                 target.squeeze(),
                 pred[:, self.positive_class],
                 self.positive_class,
+                image_logger=self.image_logger,
+            )
+
+    def log_metrics_confusion_matrix(
+        self, metrics: MetricAccumulator
+    ) -> Dict[str, torch.Tensor]:
+        # some models change class_to_idx after the metrics were created
+        nb_classes = len(self.file_list.class_to_idx)
+        return log_confusion_matrix_from_cm(
+            self.logger,
+            self.global_step,
+            metrics.confusion_matrix[:nb_classes, :nb_classes],
+            self.file_list.class_to_idx,
+            image_logger=self.image_logger,
+        )
+
+    def log_metrics_roc_graph(self, metrics: MetricAccumulator):
+        if self.hparams["log_roc_values"]:
+            log_roc_curve(
+                self.logger,
+                self.global_step,
+                *metrics.roc_curve(self.positive_class),
+                self.positive_class,
+                image_logger=self.image_logger,
             )
 
+    @property
+    def image_logger(self) -> BackgroundImageLogger:
+        """Renders the confusion matrix and roc images without blocking training."""
+        # created lazily, because the logger is set after __init__
+        if self._image_logger is None:
+            self._image_logger = BackgroundImageLogger(self.logger.experiment)
+        return self._image_logger
+
+    def on_train_end(self):
+        if self._image_logger is not None:
+            self._image_logger.flush()
+
     def dictify_list_with_class_names(
         self, class_acc: torch.Tensor
     ) -> Dict[str, torch.Tensor]:
@@ -753,6 +1035,28 @@ class Supervised(pl.LightningModule):
                 # .item() on it -> only add non dict values
         return {"log": fixed_log, **lightning_log}
 
+    def _add_data_loading_log(self, log: dict, dataset, loader, suffix: str):
+        """Adds the counters of the frame cache and the prefetcher, if they are used."""
+        loading_logs = {}
+        if dataset.frame_cache is not None:
+            loading_logs["frame_cache"] = dataset.frame_cache.get_log()
+        if isinstance(getattr(loader, "iterator", None), BatchPrefetcher):
+            loading_logs["prefetch"] = loader.iterator.get_log()
+
+        for prefix, loading_log in loading_logs.items():
+            log["log"].update(
+                self._construct_lightning_log(
+                    loading_log, suffix=suffix, prefix=prefix
+                )["log"]
+            )
+        return log
+
+    def _get_prefetch_device(self) -> Optional[torch.device]:
+        if not self.hparams.get("prefetch_to_device", False):
+            return None
+        # the dataloaders are created after the model is moved to its device
+        return next(self.model.parameters()).device
+
     @classmethod
     def load_from_metrics(cls, weights_path, tags_csv, overwrite_hparams=None):
         overwrite_hparams = overwrite_hparams or {}
@@ -4,6 +4,7 @@ import click
 from pytorch_lightning import Trainer
 
 from forgery_detection.lightning.logging.const import AudioMode
+from forgery_detection.lightning.logging.const import FrameLoader
 from forgery_detection.lightning.logging.const import SystemMode
 from forgery_detection.lightning.logging.utils import get_logger_and_checkpoint_callback
 from forgery_detection.lightning.logging.utils import PythonLiteralOptionGPUs
@@ -29,6 +30,13 @@ from forgery_detection.lightning.system import Supervised
     default=AudioMode.EXACT.name,
     help="How the audio should be loaded.",
 )
+@click.option(
+    "--frame_loader",
+    type=click.Choice(FrameLoader.__members__.keys()),
+    default=FrameLoader.PNG.name,
+    help="How frames are loaded. PACKED requires a file list created with "
+    "pack_dataset.",
+)
 @click.option(
     "--log_dir",
     required=True,
@@ -107,6 +115,47 @@ from forgery_detection.lightning.system import Supervised
     help="Number of cpus used for data loading."
     " -1 corresponds to using all cpus available.",
 )
+@click.option(
+    "--batched_loading",
+    is_flag=True,
+    default=False,
+    help="Load whole batches in one call inside the dataloader workers instead of"
+    " loading and collating every frame separately.",
+)
+@click.option(
+    "--batch_transforms",
+    is_flag=True,
+    default=False,
+    help="Resize, augment and normalize whole batches on the training device instead"
+    " of single images in the dataloader workers. Random augmentations are the same for"
+    " all frames of a sequence. Needs --batched_loading.",
+)
+@click.option(
+    "--frame_cache_size",
+    default=0.0,
+    help="Size in GB of the cache of decoded frames, that is shared by all dataloader "
+    "workers. Train and val set get a cache of this size each. 0 disables it.",
+)
+@click.option(
+    "--prefetch_depth",
+    default=0,
+    help="Number of batches a background thread loads ahead of training. 0 disables "
+    "prefetching.",
+)
+@click.option(
+    "--prefetch_to_device",
+    is_flag=True,
+    default=False,
+    help="Let the prefetch thread copy the batches to the gpu, overlapping the copy "
+    "with the previous training step. Needs --prefetch_depth.",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="Seed for sampling audio offsets. Each epoch uses a different but "
+    "reproducible random state.",
+)
 @click.option("--max_epochs", default=100)
 @click.option("--crop_faces", is_flag=True)
 @click.option("--debug", is_flag=True)
@@ -5,7 +5,9 @@ from torch import nn
 from torch.nn import functional as F
 from torchvision.models.video import r2plus1d_18
 
-from forgery_detection.lightning.logging.confusion_matrix import confusion_matrix
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
+from forgery_detection.lightning.logging.metrics import per_class_mean
 from forgery_detection.lightning.logging.const import NAN_TENSOR
 from forgery_detection.lightning.logging.const import VAL_ACC
 from forgery_detection.models.audio.similarity_stuff import PretrainedSyncNet
@@ -117,13 +119,8 @@ class FFSyncNet(SequenceClassificationModel):
         return tensorboard_log, {}
 
     def loss_per_class(self, video_logits, audio_logits, targets):
-        class_loss = torch.zeros((5,))
-        class_counts = torch.zeros((5,))
         distances = (video_logits - audio_logits).pow(2).sum(1)
-        for target, logit in zip(targets, distances):
-            class_loss[target] += logit
-            class_counts[target] += 1
-        return class_loss / class_counts
+        return per_class_mean(distances, targets, 5)
 
 
 class PretrainedFFSyncNet(
@@ -257,10 +254,8 @@ class EmbeddingClassifier(BinaryEvaluationMixin, SequenceClassificationModel):
 
             # confusion matrix
             cm = confusion_matrix(label, torch.argmax(pred, dim=1), num_classes=5)
-            cm = cm[:, :2]  # this is only binary classification
-            cm[0] = torch.sum(cm[:-1], dim=0)
-            cm[1] = cm[-1]
-            accs = cm.diag() / torch.sum(cm[:2, :2], dim=1)
+            # this is only binary classification
+            accs = binary_accuracies(cm, binary_predictions=True)
             class_accuracies = system.log_confusion_matrix(label, pred)
             class_accuracies[list(class_accuracies.keys())[0]] = accs[0]
             class_accuracies[list(class_accuracies.keys())[1]] = accs[1]
@@ -3,7 +3,8 @@ from torch import nn
 from torch.nn import functional as F
 from torchvision.models.video import r2plus1d_18
 
-from forgery_detection.lightning.logging.confusion_matrix import confusion_matrix
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
 from forgery_detection.models.audio.ff_sync_net import FFSyncNet
 from forgery_detection.models.mixins import BinaryEvaluationMixin
 from forgery_detection.models.mixins import PretrainedNet
@@ -109,10 +110,8 @@ class FFSyncNetEnd2End(BinaryEvaluationMixin, SequenceClassificationModel):
 
             # confusion matrix
             cm = confusion_matrix(label, torch.argmax(pred, dim=1), num_classes=5)
-            cm = cm[:, :2]  # this is only binary classification
-            cm[0] = torch.sum(cm[:-1], dim=0)
-            cm[1] = cm[-1]
-            accs = cm.diag() / torch.sum(cm[:2, :2], dim=1)
+            # this is only binary classification
+            accs = binary_accuracies(cm, binary_predictions=True)
             class_accuracies = system.log_confusion_matrix(label, pred)
             class_accuracies[list(class_accuracies.keys())[0]] = accs[0]
             class_accuracies[list(class_accuracies.keys())[1]] = accs[1]
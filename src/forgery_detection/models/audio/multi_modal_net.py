@@ -4,7 +4,9 @@ from torch.nn import functional as F
 from torchvision.models import resnet18
 from torchvision.models.video import r2plus1d_18
 
-from forgery_detection.lightning.logging.confusion_matrix import confusion_matrix
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
+from forgery_detection.lightning.logging.metrics import per_class_mean
 from forgery_detection.models.audio.similarity_stuff import SimilarityNet
 from forgery_detection.models.mixins import BinaryEvaluationMixin
 from forgery_detection.models.utils import SequenceClassificationModel
@@ -121,13 +123,8 @@ class MultiModalNet(BinaryEvaluationMixin, SequenceClassificationModel):
         )
 
     def loss_per_class(self, video_logits, audio_logits, targets):
-        class_loss = torch.zeros((5,))
-        class_counts = torch.zeros((5,))
         distances = (video_logits - audio_logits).pow(2).sum(1)
-        for target, logit in zip(targets, distances):
-            class_loss[target] += logit
-            class_counts[target] += 1
-        return class_loss / class_counts
+        return per_class_mean(distances, targets, 5)
 
     def forward(self, x):
         video, audio = x
@@ -201,10 +198,8 @@ class MultiModalNet(BinaryEvaluationMixin, SequenceClassificationModel):
 
             # confusion matrix
             cm = confusion_matrix(label, torch.argmax(pred, dim=1), num_classes=5)
-            cm = cm[:, :2]  # this is only binary classification
-            cm[0] = torch.sum(cm[:-1], dim=0)
-            cm[1] = cm[-1]
-            accs = cm.diag() / torch.sum(cm[:2, :2], dim=1)
+            # this is only binary classification
+            accs = binary_accuracies(cm, binary_predictions=True)
             class_accuracies = system.log_confusion_matrix(label, pred)
             class_accuracies[list(class_accuracies.keys())[0]] = accs[0]
             class_accuracies[list(class_accuracies.keys())[1]] = accs[1]
@@ -4,6 +4,7 @@ from torch.nn import functional as F
 from torchvision.models import resnet18
 from torchvision.models.video import r2plus1d_18
 
+from forgery_detection.lightning.logging.metrics import per_class_mean
 from forgery_detection.models.audio.utils import ContrastiveLoss
 from forgery_detection.models.mixins import PretrainedNet
 from forgery_detection.models.mixins import SupervisedNet
@@ -108,13 +109,8 @@ class SimilarityNet(SequenceClassificationModel):
         return tensorboard_log, {}
 
     def loss_per_class(self, video_logits, audio_logits, targets):
-        class_loss = torch.zeros((2,))
-        class_counts = torch.zeros((2,))
         distances = (video_logits - audio_logits).pow(2).sum(1)
-        for target, logit in zip(targets, distances):
-            class_loss[target] += logit
-            class_counts[target] += 1
-        return class_loss / class_counts
+        return per_class_mean(distances, targets, 2)
 
     @staticmethod
     def get_meta_data(target: torch.Tensor):
@@ -359,13 +355,8 @@ class SimilarityNetClassification(SupervisedNet(128, 2), PretrainedSimilarityNet
         return tensorboard_log, {}
 
     def loss_per_class(self, video_logits, audio_logits, targets):
-        class_loss = torch.zeros((2,))
-        class_counts = torch.zeros((2,))
         distances = (video_logits - audio_logits).pow(2).sum(1)
-        for target, logit in zip(targets, distances):
-            class_loss[target] += logit
-            class_counts[target] += 1
-        return class_loss / class_counts
+        return per_class_mean(distances, targets, 2)
 
 
 class PretrainedSyncNet(SyncNet):
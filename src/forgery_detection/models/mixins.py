@@ -1,9 +1,7 @@
 import json
 import logging
-import pickle
 from abc import ABC
 from abc import abstractmethod
-from collections import Counter
 from collections import OrderedDict
 from datetime import datetime
 from typing import List
@@ -17,9 +15,12 @@ from torchvision.utils import make_grid
 from forgery_detection.data.utils import irfft
 from forgery_detection.data.utils import rfft
 from forgery_detection.data.utils import windowed_rfft
-from forgery_detection.lightning.logging.confusion_matrix import confusion_matrix
 from forgery_detection.lightning.logging.const import NAN_TENSOR
 from forgery_detection.lightning.logging.const import VAL_ACC
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import binary_class_accuracies
+from forgery_detection.lightning.logging.metrics import class_accuracies
+from forgery_detection.lightning.logging.metrics import MetricAccumulator
 from forgery_detection.lightning.logging.utils import get_logger_dir
 from forgery_detection.models.sliced_nets import FaceNet
 from forgery_detection.models.sliced_nets import SlicedNet
@@ -352,15 +353,31 @@ class EvaluationMixin(ABC):
     def aggregate_test_output(self, outputs, system):
         raise NotImplementedError()
 
+    def test_loss_target(self, label: torch.Tensor) -> torch.Tensor:
+        return label
+
+    def update_test_metrics(self, metrics: MetricAccumulator, pred, target):
+        """Adds the output of one test_step to metrics.
+
+        aggregate_test_output only finalizes the metrics.
+        """
+        if isinstance(pred, tuple):
+            pred = pred[0]
+        if target.shape[0] != pred.shape[0]:
+            target = target[0]
+        metrics.update(
+            F.softmax(pred, dim=1), target, self.loss(pred, self.test_loss_target(target))
+        )
+
+    @staticmethod
+    def _log_class_occurrences(metrics: MetricAccumulator):
+        logger.warning(
+            f"class_occurencies: {dict(enumerate(metrics.class_counts.tolist()))}"
+        )
+
     def test_epoch_end(self, outputs, system):
+        # the outputs were written to system.test_outputs_folder in test_step
         with torch.no_grad():
-            with open(
-                get_logger_dir(system.logger)
-                / f"outputs_{datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}.pkl",
-                "wb",
-            ) as f:
-                pickle.dump(outputs, f)
-
             tensorboard_log, lightning_log = self.aggregate_test_output(outputs, system)
             logger.info(f"Test accuracy is: {tensorboard_log}")
             print(
@@ -379,102 +396,59 @@ class EvaluationMixin(ABC):
 
 class BinaryEvaluationMixin(EvaluationMixin):
     def acc_mean_from_confusion_matrix(self, cm: torch.tensor):
-        cm[0] = cm[0:4].sum(dim=0)
-        cm[1] = cm[4]
-        cm = cm / torch.sum(cm, dim=1, keepdim=True)
-        print(cm.diag())
-        return cm.diag().mean()
+        accs = binary_accuracies(cm, binary_predictions=True)
+        print(accs)
+        return accs.mean()
+
+    def test_loss_target(self, label: torch.Tensor) -> torch.Tensor:
+        return label // 4
 
     def aggregate_test_output(self, outputs, system):
-        # if there are more then one dataloader we ignore the additional data
-        if len(system.val_dataloader()) > 1:
-            outputs = outputs[0]
+        # the metrics were accumulated in test_step
+        metrics = system.epoch_metrics
 
         with torch.no_grad():
-            if isinstance(outputs[0]["pred"], tuple):
-                pred = torch.cat([x["pred"][0] for x in outputs], 0)
-                pred_shape = outputs[0]["pred"][0].shape
-            else:
-                pred = torch.cat([x["pred"] for x in outputs], 0)
-                pred_shape = outputs[0]["pred"].shape
-
-            if outputs[0]["target"].shape[0] != pred_shape[0]:
-                label = torch.cat([x["target"][0] for x in outputs], 0)
-            else:
-                label = torch.cat([x["target"] for x in outputs], 0)
-            target = label // 4
-
-            loss_mean = self.loss(pred, target)
-            pred = pred.cpu()
-            target = target.cpu()
-            pred = F.softmax(pred, dim=1)
-
-            # confusion matrix
-            cm = confusion_matrix(label, torch.argmax(pred, dim=1), num_classes=5)
-            cm = cm[:, :2]  # this is only binary classification
-
-            cm2 = cm / torch.sum(cm, dim=1, keepdim=True)
-            class_accuracies = system.log_confusion_matrix(label, pred)
-            class_accuracies[list(class_accuracies.keys())[0]] = cm2[0, 0]
-            class_accuracies[list(class_accuracies.keys())[1]] = cm2[1, 0]
-            class_accuracies[list(class_accuracies.keys())[2]] = cm2[2, 0]
-            class_accuracies[list(class_accuracies.keys())[3]] = cm2[3, 0]
-            class_accuracies[list(class_accuracies.keys())[4]] = cm2[4, 1]
+            cm = metrics.confusion_matrix
+            # this is only binary classification
+            binary_class_accs = binary_class_accuracies(cm, binary_predictions=True)
+
+            class_accuracies = system.log_metrics_confusion_matrix(metrics)
+            for key, acc in zip(list(class_accuracies.keys()), binary_class_accs):
+                class_accuracies[key] = acc
 
             acc_mean = self.acc_mean_from_confusion_matrix(cm)
 
             tensorboard_log = {
-                "loss": loss_mean,
+                "loss": metrics.loss_mean,
                 "acc": acc_mean,
                 "class_acc": class_accuracies,
             }
 
             lightning_log = {VAL_ACC: acc_mean}
 
-        logger.warning(f"class_occurencies: {(Counter(label.cpu().numpy()))}")
+        self._log_class_occurrences(metrics)
 
         return tensorboard_log, lightning_log
 
 
 class MultiEvaluationMixin(EvaluationMixin):
     def aggregate_test_output(self, outputs, system):
-        # if there are more then one dataloader we ignore the additional data
-        if len(system.val_dataloader()) > 1:
-            outputs = outputs[0]
+        # the metrics were accumulated in test_step
+        metrics = system.epoch_metrics
 
         with torch.no_grad():
-            if isinstance(outputs[0]["pred"], tuple):
-                pred = torch.cat([x["pred"][0] for x in outputs], 0)
-                pred_shape = outputs[0]["pred"][0].shape
-            else:
-                pred = torch.cat([x["pred"] for x in outputs], 0)
-                pred_shape = outputs[0]["pred"].shape
-
-            if outputs[0]["target"].shape[0] != pred_shape[0]:
-                label = torch.cat([x["target"][0] for x in outputs], 0)
-            else:
-                label = torch.cat([x["target"] for x in outputs], 0)
+            class_accs = system.log_metrics_confusion_matrix(metrics)
 
-            loss_mean = self.loss(pred, label)
-            pred = pred.cpu()
-            label = label.cpu()
-            pred = F.softmax(pred, dim=1)
-
-            cm = confusion_matrix(label, torch.argmax(pred, dim=1), num_classes=5)
-            cm /= torch.sum(cm, dim=1, keepdim=True)
-
-            class_accuracies = system.log_confusion_matrix(label, pred)
-
-            acc_mean = cm.diag().mean()
+            acc_mean = class_accuracies(metrics.confusion_matrix).mean()
 
             tensorboard_log = {
-                "loss": loss_mean,
+                "loss": metrics.loss_mean,
                 "acc": acc_mean,
-                "class_acc": class_accuracies,
+                "class_acc": class_accs,
             }
 
             lightning_log = {VAL_ACC: acc_mean}
 
-        logger.warning(f"class_occurencies: {(Counter(label.cpu().numpy()))}")
+        self._log_class_occurrences(metrics)
 
         return tensorboard_log, lightning_log
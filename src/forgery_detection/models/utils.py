@@ -10,6 +10,7 @@ from torch.nn import functional as F
 from torchvision.utils import make_grid
 
 from forgery_detection.lightning.logging.const import VAL_ACC
+from forgery_detection.lightning.logging.metrics import MetricAccumulator
 from forgery_detection.models.mixins import MultiEvaluationMixin
 
 logger = logging.getLogger(__file__)
@@ -48,6 +49,14 @@ class LightningModel(nn.Module, MultiEvaluationMixin, ABC):
     def aggregate_outputs(self, outputs, system):
         raise NotImplementedError()
 
+    @property
+    def streams_metrics(self) -> bool:
+        """If set validation_step only calls update_metrics and returns no outputs."""
+        return False
+
+    def update_metrics(self, metrics: MetricAccumulator, pred, target):
+        metrics.update(F.softmax(pred, dim=1), target, self.loss(pred, target))
+
     def calculate_accuracy(self, pred, target):
         labels_hat = torch.argmax(pred, dim=1)
         acc = labels_hat.eq(target).float().mean()
@@ -100,29 +109,34 @@ class SequenceClassificationModel(LightningModel, ABC):
 
         return tensorboard_log, lightning_log
 
+    @property
+    def streams_metrics(self) -> bool:
+        # subclasses that overwrite aggregate_outputs usually modify the outputs
+        return (
+            type(self).aggregate_outputs
+            is SequenceClassificationModel.aggregate_outputs
+        )
+
     def aggregate_outputs(self, outputs, system):
-        # if there are more then one dataloader we ignore the additional data
-        if len(system.val_dataloader()) > 1:
-            outputs = outputs[0]
+        metrics = system.epoch_metrics
 
         with torch.no_grad():
-            pred = torch.cat([x["pred"] for x in outputs], 0)
-            target = torch.cat([x["target"] for x in outputs], 0)
-
-            loss_mean = self.loss(pred, target)
-            pred = pred.cpu()
-            target = target.cpu()
-            pred = F.softmax(pred, dim=1)
-            acc_mean = self.calculate_accuracy(pred, target)
+            if not self.streams_metrics:
+                # if there are more then one dataloader we ignore the additional data
+                if len(system.val_dataloader()) > 1:
+                    outputs = outputs[0]
+                for x in outputs:
+                    self.update_metrics(metrics, x["pred"], x["target"])
 
             # confusion matrix
-            class_accuracies = system.log_confusion_matrix(target, pred)
+            class_accuracies = system.log_metrics_confusion_matrix(metrics)
 
             # roc_auc_score
-            system.log_roc_graph(target, pred)
+            system.log_metrics_roc_graph(metrics)
 
+            acc_mean = metrics.accuracy
             tensorboard_log = {
-                "loss": loss_mean,
+                "loss": metrics.loss_mean,
                 "acc": acc_mean,
                 "class_acc": class_accuracies,
             }
@@ -0,0 +1,137 @@
+import pytest
+import torch
+
+from forgery_detection.lightning.logging.metrics import binary_accuracies
+from forgery_detection.lightning.logging.metrics import binary_class_accuracies
+from forgery_detection.lightning.logging.metrics import class_accuracies
+from forgery_detection.lightning.logging.metrics import confusion_matrix
+from forgery_detection.lightning.logging.metrics import per_class_mean
+
+NUM_CLASSES = 5
+
+
+# the loop based implementations that were replaced by metrics.py
+def old_confusion_matrix(target, pred, num_classes):
+    cm = torch.zeros(num_classes, num_classes)
+    for t, p in zip(target.view(-1), pred.view(-1)):
+        cm[t.long(), p.long()] += 1
+    return cm
+
+
+def old_per_class_mean(values, targets, num_classes):
+    class_loss = torch.zeros((num_classes,))
+    class_counts = torch.zeros((num_classes,))
+    for target, value in zip(targets, values):
+        class_loss[target] += value
+        class_counts[target] += 1
+    return class_loss / class_counts
+
+
+def old_class_accuracies(cm):
+    return cm.diagonal() / cm.sum(dim=1)
+
+
+def old_binary_accuracies(cm):
+    cm = cm.clone()
+    cm = cm[:, :2]  # this is only binary classification
+    cm[0] = torch.sum(cm[:-1], dim=0)
+    cm[1] = cm[-1]
+    return cm.diag() / torch.sum(cm[:2, :2], dim=1)
+
+
+def old_binary_class_accuracies(cm):
+    cm = cm[:, :2]  # this is only binary classification
+    cm2 = cm / torch.sum(cm, dim=1, keepdim=True)
+    return torch.stack((cm2[0, 0], cm2[1, 0], cm2[2, 0], cm2[3, 0], cm2[4, 1]))
+
+
+def old_collapsed_accuracies(target, pred):
+    """Accuracies of 5 class predictions, if only fake vs. real counts."""
+    binary_target, binary_pred = target // 4, pred // 4
+    class_accs = torch.zeros(NUM_CLASSES)
+    for c in range(NUM_CLASSES):
+        class_accs[c] = binary_pred[target == c].eq(c // 4).float().mean()
+    accs = torch.zeros(2)
+    for c in range(2):
+        accs[c] = binary_pred[binary_target == c].eq(c).float().mean()
+    return class_accs, accs
+
+
+def assert_equal(actual, expected):
+    assert torch.allclose(actual.float(), expected.float(), equal_nan=True)
+
+
+def random_samples(nb_samples, nb_predicted_classes, missing_classes=()):
+    generator = torch.Generator().manual_seed(nb_samples)
+    target = torch.randint(NUM_CLASSES, (nb_samples,), generator=generator)
+    for missing_class in missing_classes:
+        target[target == missing_class] = (missing_class + 1) % NUM_CLASSES
+    pred = torch.randint(nb_predicted_classes, (nb_samples,), generator=generator)
+    return target, pred
+
+
+SAMPLES = [
+    pytest.param(random_samples(1000, NUM_CLASSES), id="all_classes"),
+    pytest.param(random_samples(1000, NUM_CLASSES, (1, 3)), id="empty_fake_classes"),
+    pytest.param(random_samples(1000, NUM_CLASSES, (4,)), id="empty_real_class"),
+    pytest.param(random_samples(1, NUM_CLASSES), id="single_sample"),
+]
+BINARY_SAMPLES = [
+    pytest.param(random_samples(1000, 2), id="all_classes"),
+    pytest.param(random_samples(1000, 2, (0, 2)), id="empty_fake_classes"),
+    pytest.param(random_samples(1000, 2, (4,)), id="empty_real_class"),
+]
+
+
+@pytest.mark.parametrize("samples", SAMPLES + BINARY_SAMPLES)
+def test_confusion_matrix(samples):
+    target, pred = samples
+    assert_equal(
+        confusion_matrix(target, pred, NUM_CLASSES),
+        old_confusion_matrix(target, pred, NUM_CLASSES),
+    )
+
+
+@pytest.mark.parametrize("samples", SAMPLES)
+def test_per_class_mean(samples):
+    target, _ = samples
+    values = torch.rand(len(target), generator=torch.Generator().manual_seed(0))
+    assert_equal(
+        per_class_mean(values, target, NUM_CLASSES),
+        old_per_class_mean(values, target, NUM_CLASSES),
+    )
+
+
+@pytest.mark.parametrize("samples", SAMPLES)
+def test_class_accuracies(samples):
+    cm = confusion_matrix(*samples, NUM_CLASSES)
+    assert_equal(class_accuracies(cm), old_class_accuracies(cm))
+
+
+@pytest.mark.parametrize("samples", BINARY_SAMPLES)
+def test_binary_accuracies_of_binary_predictions(samples):
+    cm = confusion_matrix(*samples, NUM_CLASSES)
+    assert_equal(
+        binary_class_accuracies(cm, binary_predictions=True),
+        old_binary_class_accuracies(cm),
+    )
+    assert_equal(
+        binary_accuracies(cm, binary_predictions=True), old_binary_accuracies(cm)
+    )
+
+
+@pytest.mark.parametrize("samples", SAMPLES)
+def test_binary_accuracies_of_class_predictions(samples):
+    target, pred = samples
+    cm = confusion_matrix(target, pred, NUM_CLASSES)
+    old_class_accs, old_accs = old_collapsed_accuracies(target, pred)
+    assert_equal(binary_class_accuracies(cm), old_class_accs)
+    assert_equal(binary_accuracies(cm), old_accs)
+
+
+def test_empty_classes_are_nan():
+    target, pred = torch.tensor([0, 0, 4]), torch.tensor([0, 1, 1])
+    cm = confusion_matrix(target, pred, NUM_CLASSES)
+    assert torch.isnan(class_accuracies(cm)[1:4]).all()
+    assert torch.isnan(binary_class_accuracies(cm, binary_predictions=True)[1:4]).all()
+    assert_equal(binary_accuracies(cm, binary_predictions=True), torch.tensor([0.5, 1]))